@@ -1,3 +1,5 @@
 from .dataset import Dataset
 from .search import Search
-from .register import Register
\ No newline at end of file
+from .register import Register
+from .async_dataset import AsyncDataset
+from .cube_cache import CubeCache
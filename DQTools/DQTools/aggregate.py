@@ -0,0 +1,212 @@
+"""
+Temporal aggregation of gridded data in one pass.
+
+aggregate_time() works out statistics per period (days, months, years or
+any pandas frequency) and over the whole record together, reading the data
+a chunk of time steps at a time. Each chunk is folded into running
+accumulators (count, sum, sum of squared deviations, minimum and maximum),
+and a period is finished as soon as the data have moved past it, so only
+the current chunk and the open period are held at once. With lazily loaded
+data (Dataset.get_data(lazy=True)) each chunk is fetched as it is reached,
+so long records over large areas can be summarised in bounded memory.
+"""
+import warnings
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .lazy import CHUNK_BYTES
+
+# Frequencies by name; any other pandas frequency string may also be used
+FREQUENCIES = {'days': '1D', 'months': '1MS', 'years': '1YS'}
+
+# The statistics available
+STATISTICS = ('mean', 'sum', 'count', 'min', 'max', 'std')
+
+Aggregate = namedtuple('Aggregate', ['periods', 'overall'])
+
+
+class _Running(object):
+    """
+    Running statistics of a stream of values, merged a block at a time
+    (Chan et al.'s pairwise update for the squared deviations).
+    """
+
+    def __init__(self, shape):
+        self.count = np.zeros(shape)
+        self.total = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.low = np.full(shape, np.nan)
+        self.high = np.full(shape, np.nan)
+
+    def _mean(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.total / self.count, np.nan)
+
+    def add(self, values):
+        """
+        Fold in a block of values, reducing along the first axis.
+        """
+        block = _Running(values.shape[1:])
+        valid = np.isfinite(values)
+        block.count = valid.sum(axis=0).astype(float)
+        block.total = np.where(valid, values, 0.0).sum(axis=0)
+        deviation = np.where(valid, values - block._mean()[None], 0.0)
+        block.m2 = (deviation ** 2).sum(axis=0)
+        block.low = np.fmin.reduce(values, axis=0)
+        block.high = np.fmax.reduce(values, axis=0)
+        self.merge(block)
+
+    def merge(self, other):
+        """
+        Fold in the statistics of another _Running.
+        """
+        count = self.count + other.count
+        delta = np.nan_to_num(other._mean() - self._mean())
+        with np.errstate(invalid='ignore', divide='ignore'):
+            shift = np.where(count > 0,
+                             delta ** 2 * self.count * other.count / count, 0)
+        self.m2 = self.m2 + other.m2 + shift
+        self.count = count
+        self.total = self.total + other.total
+        self.low = np.fmin(self.low, other.low)
+        self.high = np.fmax(self.high, other.high)
+
+    def result(self, stat):
+        """
+        The statistic so far: sums of no values are 0, other statistics of
+        no values are NaN, as with xarray.
+        """
+        if stat == 'mean':
+            return self._mean()
+        if stat == 'sum':
+            return self.total
+        if stat == 'count':
+            return self.count
+        if stat == 'min':
+            return self.low
+        if stat == 'max':
+            return self.high
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, np.sqrt(self.m2 / self.count),
+                            np.nan)
+
+
+def _time_chunk(data):
+    """
+    Time steps per chunk: those of the dask chunks if the data have them,
+    otherwise about CHUNK_BYTES worth.
+    """
+    if data.chunks:
+        return max(1, data.chunks[data.dims.index('time')][0])
+    step_bytes = data.nbytes // max(1, data.sizes['time'])
+    return max(1, CHUNK_BYTES // max(1, step_bytes))
+
+
+def aggregate_time(data, frequency, stats=('mean',), dims=None,
+                   time_chunk=None, keep_periods=True):
+    """
+    Statistics of each period and of the whole record, in one pass.
+
+    :param data: xarray DataArray with a time dimension, in memory or
+                 dask-backed
+    :param frequency: 'days', 'months', 'years' or a pandas frequency
+                      string such as '7D' or 'QS'
+    :param stats: optional; any of STATISTICS
+    :param dims: optional; other dimensions to average over as well, e.g.
+                 ['latitude', 'longitude'] for statistics of the whole
+                 area. Each statistic is still worked out per pixel, then
+                 averaged over dims (ignoring NaN) for each period and
+                 overall, as Data.average_subproduct has always averaged
+                 areas. Statistics are per pixel if not given.
+    :param time_chunk: optional; time steps read at a time, by default
+                       those of the dask chunks or about CHUNK_BYTES
+    :param keep_periods: optional; set to False to return only the overall
+                         statistics, without holding each period's
+    :return: Aggregate of periods (xarray Dataset of a variable per
+             statistic, with time labelling the start of each period, or
+             None if not kept) and overall (the same, without time). The
+             overall mean is the mean of the period means, so each period
+             counts equally; the other overall statistics are over all
+             time steps.
+    """
+    unknown = set(stats) - set(STATISTICS)
+    if unknown:
+        raise ValueError("Unknown statistics %s, choose from %s"
+                         % (sorted(unknown), STATISTICS))
+    freq = FREQUENCIES.get(frequency, frequency)
+
+    if not data.indexes['time'].is_monotonic_increasing:
+        data = data.sortby('time')
+    dims = list(dims or [])
+    kept = [dim for dim in data.dims if dim != 'time' and dim not in dims]
+    data = data.transpose('time', *(dims + kept))
+    shape = tuple(data.sizes[dim] for dim in kept)
+    pixels = tuple(data.sizes[dim] for dim in dims) + shape
+
+    def average(values):
+        # Pixels without data are left out; NaN if none have any
+        if not dims:
+            return values
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmean(values, axis=tuple(range(len(dims))))
+
+    # The period of each time step
+    times = pd.DatetimeIndex(data['time'].values)
+    steps = pd.Series(np.ones(len(times)), index=times).resample(freq).count()
+    labels = steps.index
+    period_of = np.repeat(np.arange(len(steps)), steps.values)
+
+    time_chunk = time_chunk or _time_chunk(data)
+    overall = _Running(pixels)
+    means = _Running(shape)
+    periods = dict((stat, []) for stat in stats)
+
+    def finish(running):
+        overall.merge(running)
+        means.add(average(running.result('mean'))[None])
+        if keep_periods:
+            # As with xarray, periods without time steps are NaN throughout
+            empty = not steps.values[current]
+            for stat in stats:
+                periods[stat].append(np.full(shape, np.nan) if empty
+                                     else average(running.result(stat)))
+
+    current, running = 0, _Running(pixels)
+    for first in range(0, len(times), time_chunk):
+        values = np.asarray(data.isel(time=slice(first, first + time_chunk))
+                            .values, dtype=float)
+        chunk_periods = period_of[first:first + time_chunk]
+
+        for period in np.unique(chunk_periods):
+            while current < period:
+                finish(running)
+                current, running = current + 1, _Running(pixels)
+            running.add(values[chunk_periods == period])
+
+    while current < len(labels):
+        finish(running)
+        current, running = current + 1, _Running(pixels)
+
+    coords = dict((name, coord) for name, coord in data.coords.items()
+                  if set(coord.dims) <= set(kept) and name != 'time')
+    results = xr.Dataset(coords=coords)
+    for stat in stats:
+        value = means.result('mean') if stat == 'mean' \
+            else average(overall.result(stat))
+        results[stat] = (kept, value)
+    results.attrs = data.attrs
+
+    per_period = None
+    if keep_periods:
+        per_period = xr.Dataset(coords=coords)
+        per_period = per_period.assign_coords(time=labels.values)
+        for stat in stats:
+            per_period[stat] = (['time'] + kept, np.stack(periods[stat])
+                                if len(labels) else np.empty((0,) + shape))
+        per_period.attrs = data.attrs
+
+    return Aggregate(per_period, results)
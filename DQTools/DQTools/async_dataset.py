@@ -0,0 +1,125 @@
+from .dataset import BaseDataset
+from .connect.async_connect import AsyncConnect
+
+
+class AsyncDataset(BaseDataset):
+    """
+    A Dataset whose metadata and data are fetched with coroutines, so that
+    many Datasets can be loaded at once:
+
+        async with AsyncConnect(max_concurrency=20) as conn:
+            datasets = await gather(*[AsyncDataset.create(
+                'era5', 'skt', tile=tile, conn=conn) for tile in tiles])
+            await gather(*[ds.get_data(start, stop) for ds in datasets])
+
+    Creating one does not contact the DataCube; await load_metadata(), or
+    use AsyncDataset.create() which does both. A Dataset given no conn
+    makes its own, which is closed by await close() or at the end of an
+    async with block using the Dataset.
+
+    AsyncDataset only reads: use Dataset to put or update data.
+    """
+
+    def __init__(self, product, subproduct, region=None, tile=None, res=None,
+                 identfile=None, conn=None):
+        """
+        :param product: product name (str)
+        :param subproduct: sub-product name (str)
+        :param region: optional; see Dataset
+        :param tile: optional; see Dataset
+        :param res: optional; see Dataset
+        :param identfile: optional; Assimila DQ credentials file. Not used if
+                          conn is given.
+        :param conn: optional; AsyncConnect to send requests through. Share
+                     one between Datasets to bound the total number of
+                     requests in flight.
+        """
+        self._set_attributes(product, subproduct, region, tile, res,
+                             identfile)
+        self._own_conn = conn is None
+        self.conn = conn if conn is not None \
+            else AsyncConnect(identfile=identfile)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """
+        Close the connections of the Dataset's own AsyncConnect. One given
+        on creation is left open for its other users.
+        """
+        if self._own_conn:
+            await self.conn.close()
+
+    @classmethod
+    async def create(cls, product, subproduct, region=None, tile=None,
+                     res=None, identfile=None, conn=None):
+        """
+        Create the Dataset and load its metadata.
+
+        :return: AsyncDataset
+        """
+        dataset = cls(product, subproduct, region=region, tile=tile, res=res,
+                      identfile=identfile, conn=conn)
+        await dataset.load_metadata()
+        return dataset
+
+    async def load_metadata(self):
+        """
+        Download the metadata for this product & sub-product & tile.
+        """
+        bounds = self._region_bounds()
+
+        try:
+            result = await self.conn.get_subproduct_meta(
+                product=self.product, subproduct=self.subproduct,
+                bounds=bounds, tile=self.tile)
+
+            # Extract relevant metadata as attributes.
+            self._extract_metadata(result)
+
+            self.logger.info("Dataset created and metadata available for %s %s"
+                             % (self.product, self.subproduct))
+
+        except Exception as e:
+            self.logger.error("Failed to retrieve Dataset metadata.\n"
+                              "%s" % e)
+            print("Failed to retrieve Dataset metadata, "
+                  "please see logfile for details.")
+
+    async def get_data(self, start, stop,
+                       use_dask=False,
+                       region=None, tile=None, res=None, latlon=None,
+                       country=None, projection=None, codec=None,
+                       subproducts=None):
+        """
+        Extract data from the datacube to the specification supplied. See
+        Dataset.get_data() for the parameters.
+
+        :return: xarray of data (also stored in self.data), or None if the
+                 request failed
+        """
+        self.logger.info("AsyncDataset get_data args: start %s, stop %s, "
+                         "DASK %s, region %s, tile %s, resolution %s, "
+                         "latlon %s, country %s, projection %s"
+                         % (start, stop, use_dask,
+                            region, tile, res, latlon,
+                            country, projection))
+
+        try:
+            # Fetch the data from the datacube
+            data = await self.conn.get_subproduct_data(
+                **self._prepare_request(start, stop, use_dask, region, tile,
+                                        res, latlon, country, projection,
+                                        subproducts),
+                codec=codec)
+
+            self.data = self._merge_subproducts(data)
+
+        except Exception as e:
+            self._data_error(e, use_dask)
+
+        return self.data
@@ -0,0 +1,222 @@
+"""
+Which time steps of a sub-product are available.
+
+AvailabilityIndex holds the time steps as a sorted numpy datetime64 array,
+so membership and nearest earlier/later look-ups are binary searches.
+Indexes are kept per server and sub-product and rebuilt when the
+sub-product's last time step moves on, so checking many dates costs one
+metadata request rather than one per date.
+
+The DataCube has no request listing the time steps themselves. Given a
+location, the index is read from the time axis of that pixel's data
+over the whole record, which includes any gaps. Otherwise the time
+steps are worked out from the first and last time steps and the time
+resolution in the sub-product metadata (see ideal_timesteps()). Those
+are only a guess at the calendar, unless the product is one of
+YEARLY_COMPOSITES, so such an index is only relied on for the range of
+dates available.
+"""
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Products of multi-day composites which restart on 1st January each year
+YEARLY_COMPOSITES = ('MOD13A2',)
+
+
+def time_offset(time_resolution):
+    """
+    A sub-product's time_resolution as a pandas DateOffset.
+
+    :param time_resolution: e.g. '1 days' or a numpy timedelta
+    :return: pandas DateOffset
+    """
+    # split the numpy timedelta into its component parts (e.g.
+    # ['year', 1])
+    bf_fq_vals = time_resolution.__str__().split(' ')
+
+    # Create a pandas DataOffset object which represents this
+    # time_resolution
+    return pd.DateOffset(**{bf_fq_vals[1]: int(bf_fq_vals[0])})
+
+
+def _datetime64(date):
+    """
+    Convert a date or time of any common type to numpy datetime64[ns].
+    """
+    date = pd.Timestamp(date)
+    if date.tzinfo is not None:
+        date = date.tz_convert(None)
+    return date.to_datetime64()
+
+
+def ideal_timesteps(first, last, time_resolution, yearly=False):
+    """
+    The time steps expected from the first to the last.
+
+    :param first: first time step
+    :param last: last time step
+    :param time_resolution: see time_offset()
+    :param yearly: optional; whether multi-day composites restart on 1st
+                   January each year (as MODIS 16 day composites do), so
+                   the last composite of a year may be short
+    :return: numpy datetime64 array
+    """
+    offset = time_offset(time_resolution)
+    first, last = pd.Timestamp(first), pd.Timestamp(last)
+
+    days = offset.kwds.get('days', 0)
+    if yearly and len(offset.kwds) == 1 and 1 < days < 366:
+        steps = []
+        for year in range(first.year, last.year + 1):
+            steps.append(pd.date_range(pd.Timestamp(year, 1, 1),
+                                       pd.Timestamp(year, 12, 31),
+                                       freq='%dD' % days))
+        steps = steps[0].append(steps[1:])
+        return steps[(steps >= first) & (steps <= last)].values
+
+    return pd.date_range(first, last, freq=offset).values
+
+
+class AvailabilityIndex(object):
+    """
+    Sorted time steps of a sub-product, with binary search look-ups.
+    """
+    _indexes = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def for_subproduct(cls, conn, product, subproduct, latlon=None):
+        """
+        The index for a sub-product, shared within the process and rebuilt
+        when the sub-product's last time step changes.
+
+        :param conn: Connect to the DataCube
+        :param product: product name
+        :param subproduct: sub-product name
+        :param latlon: optional; [latitude, longitude] of a pixel with data,
+                       used to read the actual time steps. The index is
+                       worked out from the metadata if not given, or if
+                       reading the pixel fails.
+        :return: AvailabilityIndex
+        """
+        meta = conn.get_subproduct_meta(product=product,
+                                        subproduct=subproduct)
+        key = (conn.http_client.full_url, conn.http_client.login, product,
+               subproduct)
+
+        with cls._lock:
+            index = cls._indexes.get(key)
+        if index is not None and index.last_timestep == meta['last_timestep'] \
+                and (index.exact or latlon is None):
+            return index
+
+        index = None
+        if latlon is not None:
+            try:
+                data = conn.get_subproduct_data(
+                    product=product, subproduct=subproduct,
+                    start=pd.Timestamp(meta['first_timestep']).to_pydatetime(),
+                    stop=pd.Timestamp(meta['last_timestep']).to_pydatetime(),
+                    use_dask=False, bounds=None, res=None, tile=None,
+                    country=None, latlon=latlon, projection=None)[0]
+                index = cls(data['time'].values, exact=True)
+            except Exception as e:
+                logging.getLogger("__main__").warning(
+                    "Unable to read the time steps of %s %s, using the "
+                    "metadata instead.\n%s" % (product, subproduct, e))
+
+        if index is None:
+            yearly = product in YEARLY_COMPOSITES
+            timesteps = ideal_timesteps(meta['first_timestep'],
+                                        meta['last_timestep'],
+                                        meta['time_resolution'],
+                                        yearly=yearly)
+            # The first and last time steps are known even where the
+            # calendar is not
+            ends = [_datetime64(meta['first_timestep']),
+                    _datetime64(meta['last_timestep'])]
+            index = cls(np.append(timesteps, ends), complete=yearly)
+        index.last_timestep = meta['last_timestep']
+
+        with cls._lock:
+            cls._indexes[key] = index
+        return index
+
+    def __init__(self, timesteps, exact=False, complete=False):
+        """
+        :param timesteps: the time steps, in any order
+        :param exact: whether these are the actual time steps of the data
+                      rather than those expected
+        :param complete: whether the expected time steps follow the
+                         product's calendar, so that dates which are not
+                         time steps are not available. Exact indexes are
+                         always complete.
+        """
+        self.timesteps = np.unique(np.asarray(timesteps,
+                                              dtype='datetime64[ns]'))
+        self.exact = exact
+        self.complete = exact or complete
+        self.last_timestep = None
+
+    def __len__(self):
+        return len(self.timesteps)
+
+    def __contains__(self, date):
+        return self.contains(date)
+
+    @property
+    def first(self):
+        """
+        The first time step (pandas Timestamp), or None if there are none.
+        """
+        return pd.Timestamp(self.timesteps[0]) if len(self) else None
+
+    @property
+    def last(self):
+        """
+        The last time step (pandas Timestamp), or None if there are none.
+        """
+        return pd.Timestamp(self.timesteps[-1]) if len(self) else None
+
+    def contains(self, date):
+        """
+        :param date: date or time of any common type
+        :return: True if it is one of the time steps
+        """
+        date = _datetime64(date)
+        position = np.searchsorted(self.timesteps, date)
+        return position < len(self) and self.timesteps[position] == date
+
+    def earlier(self, date):
+        """
+        :param date: date or time of any common type
+        :return: the latest time step at or before date (pandas
+                 Timestamp), or None if there is none
+        """
+        position = np.searchsorted(self.timesteps, _datetime64(date),
+                                   side='right')
+        return pd.Timestamp(self.timesteps[position - 1]) if position \
+            else None
+
+    def later(self, date):
+        """
+        :param date: date or time of any common type
+        :return: the earliest time step at or after date (pandas
+                 Timestamp), or None if there is none
+        """
+        position = np.searchsorted(self.timesteps, _datetime64(date))
+        return pd.Timestamp(self.timesteps[position]) \
+            if position < len(self) else None
+
+    def between(self, start, stop):
+        """
+        :return: numpy datetime64 array of the time steps from start to
+                 stop inclusive
+        """
+        low = np.searchsorted(self.timesteps, _datetime64(start))
+        high = np.searchsorted(self.timesteps, _datetime64(stop),
+                               side='right')
+        return self.timesteps[low:high]
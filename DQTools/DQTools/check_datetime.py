@@ -3,6 +3,28 @@ import numpy as np
 import datetime as dt
 
 
+# String formats accepted, in the order they are tried
+FORMATS = ['%Y-%m-%d', '%Y %m %d', '%Y/%m/%d', '%d-%m-%Y',
+           '%d %m %Y', '%d/%m/%Y', '%d-%m-%YT%H:%M',
+           '%Y-%m-%dT%H:%M:%S']
+
+# Format of the last batch of strings converted, tried first next time
+_last_format = [None]
+
+
+def _detect_format(text, formats):
+    """
+    The first format which parses text, or None.
+    """
+    for fmt in formats:
+        try:
+            dt.datetime.strptime(text, fmt)
+            return fmt
+        except ValueError:
+            pass
+    return None
+
+
 class Datetime_checker:
     """
     Datetime_checker object contains a method to convert a given time
@@ -16,9 +38,7 @@ class Datetime_checker:
 
     def __init__(self, time):
         self.time = time
-        self.formats = ['%Y-%m-%d', '%Y %m %d', '%Y/%m/%d', '%d-%m-%Y',
-                        '%d %m %Y', '%d/%m/%Y', '%d-%m-%YT%H:%M',
-                        '%Y-%m-%dT%H:%M:%S']
+        self.formats = list(FORMATS)
 
     def c_and_c(self):
         """
@@ -57,3 +77,80 @@ class Datetime_checker:
 
         except TypeError as e:
             raise e
+
+    def c_and_c_array(self):
+        """
+        Converts self.time, a list, numpy array or pandas Series of times,
+        to a numpy datetime64 array in one go. Each value gives the same
+        time as c_and_c() would; values which cannot be converted are NaT.
+
+        Strings are parsed with one vectorised call per format: the format
+        is detected from the first string (trying the format of the
+        previous batch first), and only strings it does not parse are tried
+        with the other formats.
+
+        :return: numpy datetime64[ns] array
+        """
+        values = np.asarray(self.time)
+        if values.ndim != 1:
+            values = values.reshape(-1)
+
+        if np.issubdtype(values.dtype, np.datetime64):
+            # c_and_c() keeps whole seconds of numpy datetimes
+            return values.astype('datetime64[s]').astype('datetime64[ns]')
+
+        values = values.astype(object)
+        result = np.full(len(values), np.datetime64('NaT'),
+                         dtype='datetime64[ns]')
+
+        strings = np.array([isinstance(value, str) for value in values],
+                           dtype=bool)
+        if strings.any():
+            result[strings] = self._parse_strings(values[strings])
+
+        others = ~strings
+        for position in np.flatnonzero(others):
+            value = values[position]
+            if isinstance(value, np.datetime64):
+                converted = Datetime_checker(time=value).c_and_c()
+            elif isinstance(value, (dt.date, pd.Timestamp)):
+                converted = value
+            else:
+                continue
+            try:
+                result[position] = pd.Timestamp(converted).to_datetime64()
+            except (ValueError, TypeError, OverflowError):
+                pass
+
+        return result
+
+    def _parse_strings(self, strings):
+        """
+        Parse an array of strings, detecting the format once per batch.
+
+        :return: numpy datetime64[ns] array
+        """
+        result = np.full(len(strings), np.datetime64('NaT'),
+                         dtype='datetime64[ns]')
+
+        first = _last_format[0]
+        if first not in self.formats or \
+                _detect_format(strings[0], [first]) is None:
+            first = _detect_format(strings[0], self.formats)
+        if first is None:
+            order = self.formats
+        else:
+            _last_format[0] = first
+            order = [first] + [fmt for fmt in self.formats if fmt != first]
+
+        remaining = np.arange(len(strings))
+        for fmt in order:
+            parsed = pd.to_datetime(pd.Series(strings[remaining]),
+                                    format=fmt, errors='coerce').values
+            found = ~np.isnat(parsed)
+            result[remaining[found]] = parsed[found]
+            remaining = remaining[~found]
+            if not len(remaining):
+                break
+
+        return result
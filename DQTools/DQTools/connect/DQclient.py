@@ -18,17 +18,259 @@ http://www.apache.org/licenses/LICENSE-2.0.
 
 """
 from .log.setup_logger import SetUpLogger
+from .pool import ConnectionPool
+from . import wire
+from .streams import DEFAULT_CHUNK_SIZE, DEFAULT_SLICE_BYTES, \
+    open_response, pickled_slices, read_chunks, report_progress, ProgressFile
+from . import compression
 
 import logging
 import os.path as op
 import os
 import json
-import requests
 import pickle
-import gzip
+import io
 import datetime
+import threading
+import time
+import hashlib
+import tempfile
+from contextlib import closing, contextmanager
 from sys import path as syspath
 
+import requests
+
+# ======================================================================
+# Headers used to negotiate optional transfer features with the server.
+# A server which does not send them gets the original behaviour.
+HDR_ACCEPT_TRANSFER = 'X-DQ-Accept-Transfer'
+HDR_TRANSFER = 'X-DQ-Transfer'
+HDR_ACCEPT_FORMAT = 'X-DQ-Accept-Format'
+HDR_FORMAT = 'X-DQ-Format'
+HDR_ACCEPT_ENCODING = 'X-DQ-Accept-Encoding'
+HDR_ENCODING = 'X-DQ-Encoding'
+# Version stamp of a GET_META answer, and the stamp of the copy the client
+# already has; the server replies 304 (Not Modified) if they match.
+HDR_VERSION = 'X-DQ-Version'
+HDR_IF_VERSION = 'X-DQ-If-Version'
+# Checksum of a GET_FILE's decompressed contents, as '<algorithm>=<hex digest>'
+HDR_CHECKSUM = 'X-DQ-Checksum'
+
+# PUT_DATA body is a compressed stream of consecutive pickles, one per block of
+# time steps, to be concatenated along time by the server.
+SLICED_TRANSFER = 'sliced'
+
+# The server can read a PUT_FILE body sent as a chunked transfer, i.e.
+# without being told its length in advance. A server which accepts sliced
+# transfers can too.
+CHUNKED_TRANSFER = 'chunked'
+
+# Serialisation formats for xarray payloads, in order of preference. The
+# binary array format is used only when the server says it supports it.
+PICKLE_FORMAT = 'pickle'
+DATA_FORMATS = [wire.FORMAT_NAME, PICKLE_FORMAT]
+
+# GET_FILE downloads are written to target + PART_SUFFIX and renamed into
+# place when complete. What is needed to resume an interrupted download
+# (the encoding and checksum the server sent) is kept in
+# target + PART_SUFFIX + STATE_SUFFIX.
+PART_SUFFIX = '.part'
+STATE_SUFFIX = '.json'
+
+# GET_META action carrying a list of GET_META requests, answered with a
+# list holding {'result': ...} or {'error': message} for each in turn.
+BATCH_ACTION = 'batch'
+MAX_BATCH_SIZE = 100
+
+# Number of times an interrupted GET_FILE download is resumed, and the
+# wait in seconds before the first retry (doubled for each one after).
+DEFAULT_RETRIES = 3
+RETRY_BACKOFF = 1.0
+
+# Errors after which a download is worth resuming
+_TRANSIENT_ERRORS = (requests.exceptions.ConnectionError,
+                     requests.exceptions.Timeout,
+                     requests.exceptions.ChunkedEncodingError)
+
+
+def _advertised(resp, header):
+    """
+    Read a comma separated list of options from a response header.
+
+    :param resp: requests.Response
+    :param header: header name
+    :return: list of lower case option names, empty if header not sent
+    """
+    value = resp.headers.get(header, '')
+    return [item.strip().lower() for item in value.split(',') if item.strip()]
+
+
+def request_headers(service, codecs):
+    """
+    Headers telling the server which payload formats and compression
+    codecs the client can read.
+
+    :param service: command being sent
+    :param codecs: names of acceptable compression codecs, preferred first
+    :return: dictionary of headers
+    """
+    headers = {}
+    if service == "GET_DATA":
+        headers[HDR_ACCEPT_FORMAT] = ', '.join(DATA_FORMATS)
+    if service in ("GET_DATA", "GET_FILE"):
+        headers[HDR_ACCEPT_ENCODING] = ', '.join(codecs)
+    return headers
+
+
+def response_codec(headers):
+    """
+    The codec the server used to compress a response body.
+
+    :param headers: response headers
+    :return: compression.Codec
+    """
+    return compression.get_codec(
+        headers.get(HDR_ENCODING, compression.DEFAULT_CODEC))
+
+
+def load_data(source, headers):
+    """
+    Decompress and de-serialize the xarray data in a GET_DATA response
+    body, using the codec and format the server says it sent (gzip and
+    pickle unless told otherwise).
+
+    :param source: binary file-like object reading the response body
+    :param headers: response headers
+    :return: x-array data
+    """
+    data_format = headers.get(HDR_FORMAT, PICKLE_FORMAT).strip().lower()
+    load = wire.load if data_format == wire.FORMAT_NAME else pickle.load
+
+    with response_codec(headers).open(source) as body:
+        data = load(body)
+        # drain the compressed stream's trailer so a streamed
+        # connection can go back to the pool
+        body.read()
+    return data
+
+
+class ServerError(Exception):
+    """
+    The server could not carry out a request.
+    """
+    def __init__(self, message, status=None):
+        """
+        :param message: the error message sent by the server
+        :param status: optional; http status of the response
+        """
+        super(ServerError, self).__init__(message)
+        self.status = status
+
+
+def _rejects_batch(error):
+    """
+    Whether a ServerError from a batch request means the server does not
+    accept batches: a 4xx response, or an error naming the action, as an
+    older server gives for an action it does not know.
+
+    :param error: ServerError
+    :return: bool
+    """
+    if error.status is not None and 400 <= error.status < 500:
+        return True
+    message = str(error).lower()
+    return 'action' in message or BATCH_ACTION in message
+
+
+class BatchItemError(Exception):
+    """
+    One request of a batch failed. Returned in place of its result so the
+    other results can still be used.
+    """
+    def __init__(self, request, error):
+        """
+        :param request: the request which failed
+        :param error: the exception raised, or message sent by the server
+        """
+        super(BatchItemError, self).__init__(str(error))
+        self.request = request
+        self.error = error
+
+def raise_response_error(status_code, headers):
+    """
+    Raise the exception for a failed request, using the error message the
+    server put in the response headers.
+
+    :param status_code: http status of the response
+    :param headers: response headers (updated with the formatted error)
+    :raise ConnectionRefusedError: if authentication failed
+    :raise ServerError: for any other failure
+    """
+    # this code replaces the line breaks(\n) mix with the \\ to
+    # normal line breaks which fixes the issue of the exception
+    # not displaying properly when raised, although it does not
+    # fix the log, also removes brackets at start and end of
+    # error message
+
+    # Another possible solution when the only thing that doesn't
+    # need to be fixed is the error heading:
+    # keys = resp.headers.keys()
+    # for i in resp.headers:
+    #   try:
+    #       resp.headers[keys[i]] = resp.headers[keys[i]].replace(
+    #       "\\n",\n").replace("\\", " ").replace("("
+    #       ,"").replace(")","")
+    #   except TypeError:
+    #       pass
+
+    formatted_str = headers['error'].replace(
+        "\\n", "\n").replace("\\", " ").replace("(", "")\
+        .replace(")", "")
+
+    headers.update({'error': formatted_str})
+
+    if status_code == 401:
+        raise ConnectionRefusedError(headers)
+    else:
+        raise ServerError(headers['error'], status=status_code)
+
+
+class ChecksumError(IOError):
+    """
+    A downloaded file does not match the checksum sent by the server.
+    """
+    pass
+
+
+def _read_part_state(part):
+    """
+    Read what is needed to resume a partial download.
+
+    :param part: name of the partial download file
+    :return: dictionary of encoding and checksum, or None if there is no
+             partial download to resume
+    """
+    if not op.exists(part):
+        return None
+    try:
+        with open(part + STATE_SUFFIX) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def _write_part_state(part, state):
+    with open(part + STATE_SUFFIX, 'w') as f:
+        json.dump(state, f)
+
+
+def _remove_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
 # ======================================================================
 # Functions and class to support login credentials.
 
@@ -136,9 +378,14 @@ class APIRequest(object):
     conversion to/from binary for transmission.
 
     Note that the class is instantiated afresh on each connection so
-    cannot keep any instance variables between connections.
+    cannot keep any instance variables between connections. The
+    underlying http connections are kept in the pool handed in by
+    AssimilaData and survive between requests.
     """
-    def __init__(self, logger, service, url, login=None, pwd=None, sysfile=None):
+    def __init__(self, logger, service, url, login=None, pwd=None, sysfile=None,
+                 pool=None, stream=True, chunk_size=DEFAULT_CHUNK_SIZE,
+                 slice_bytes=DEFAULT_SLICE_BYTES, codecs=None,
+                 retries=DEFAULT_RETRIES):
         """
         Create DQ client http object.
         Ensure user has correct credentials.
@@ -150,6 +397,20 @@ class APIRequest(object):
         :param pwd: user encrypted password
         :param sysfile: optionally provide the system yaml file (required for
                 DASK use)
+        :param pool: ConnectionPool to send requests through. If not given,
+                a single-connection pool is created for this request.
+        :param stream: if True, GET_DATA responses are decompressed and
+                unpickled as they arrive rather than after the whole body
+                has been read into memory.
+        :param chunk_size: number of bytes read from the socket at a time
+                when streaming.
+        :param slice_bytes: approximate size of each block of time steps
+                serialised when uploading data to a server which accepts
+                sliced transfers.
+        :param codecs: names of the compression codecs to offer the server,
+                in order of preference. Defaults to all those installed.
+        :param retries: number of times an interrupted GET_FILE download
+                is resumed before giving up.
         :raise ConnectionRefusedError: for any problem with login details
         :raise ConnectionError: for problems connecting to the server
         :raise Exception: anything else
@@ -159,6 +420,12 @@ class APIRequest(object):
         self.url = url
         self.login = login
         self.pwd = pwd
+        self.pool = pool if pool is not None else ConnectionPool(pool_size=1)
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.slice_bytes = slice_bytes
+        self.codecs = codecs if codecs else compression.available()
+        self.retries = retries
 
         # Specifically for dask use
         wkspace_root = op.join(__file__, '../../../../')
@@ -218,9 +485,9 @@ class APIRequest(object):
         retval = True
         try:
             payload = pickle.dumps(req, protocol=-1)
-            resp = requests.post(self.url,
-                                 auth=(self.login, self.pwd),
-                                 data=payload)
+            resp = self.pool.post(self.url,
+                                  auth=(self.login, self.pwd),
+                                  data=payload)
 
             if resp.status_code == 401:  # a 401 is sent by the authentication
                 retval = False
@@ -244,55 +511,30 @@ class APIRequest(object):
         :raise Exception: for any problems
         """
         try:
+            if self.service == "GET_FILE":
+                self._get_file(req)
+                return
+
             # if not req['params']['use_dask']:
             if not 'use_dask' in req['params'] or \
                 ('use_dask' in req['params'] and not req['params']['use_dask']):
                 # Unless we are using DASK, the message goes through the
                 # http server. It will be a GET_DATA message.
                 payload = pickle.dumps(req, protocol=-1)
-                resp = requests.post(self.url,
-                                     auth=(self.login, self.pwd),
-                                     data=payload)
+                stream = self.stream and self.service == "GET_DATA"
+                resp = self.pool.post(self.url,
+                                      auth=(self.login, self.pwd),
+                                      data=payload,
+                                      headers=request_headers(self.service,
+                                                              self.codecs),
+                                      stream=stream)
 
                 if resp.status_code != 200:
+                    # only the headers are needed; release the connection
+                    resp.close()
+                    raise_response_error(resp.status_code, resp.headers)
 
-                    # this code replaces the line breaks(\n) mix with the \\ to
-                    # normal line breaks which fixes the issue of the exception
-                    # not displaying properly when raised, although it does not
-                    # fix the log, also removes brackets at start and end of
-                    # error message
-
-                    # Another possible solution when the only thing that doesn't
-                    # need to be fixed is the error heading:
-                    # keys = resp.headers.keys()
-                    # for i in resp.headers:
-                    #   try:
-                    #       resp.headers[keys[i]] = resp.headers[keys[i]].replace(
-                    #       "\\n",\n").replace("\\", " ").replace("("
-                    #       ,"").replace(")","")
-                    #   except TypeError:
-                    #       pass
-
-                    formatted_str = resp.headers['error'].replace(
-                        "\\n", "\n").replace("\\", " ").replace("(", "")\
-                        .replace(")", "")
-
-                    resp.headers.update({'error': formatted_str})
-
-                    if resp.status_code == 401:
-                        raise ConnectionRefusedError(resp.headers)
-                    else:
-                        raise Exception(resp.headers['error'])
-
-            if self.service == "GET_FILE":
-                target = req.get("target")
-                resp_unpacked = gzip.decompress(resp.content)
-                with open(target, "wb") as tgt:
-                    # binary content
-                    # tgt.write(resp.content)
-                    tgt.write(resp_unpacked)
-
-            elif self.service == "GET_DATA":
+            if self.service == "GET_DATA":
                 # use the switch in the request to control DASK wiring
                 if 'use_dask' in req['params'] \
                         and req['params']['use_dask']:
@@ -300,9 +542,7 @@ class APIRequest(object):
                     return self.dqif.get_address()
 
                 else:
-                    resp_unpacked = gzip.decompress(resp.content)
-                    # use pickle to de-serialize xarray data
-                    return pickle.loads(resp_unpacked)
+                    return self._decode_data(resp)
 
             elif self.service == "GET_META":
                 return pickle.loads(resp.content)
@@ -314,7 +554,292 @@ class APIRequest(object):
         except Exception:
             raise
 
-    def put_to_dq(self, req, data=None):
+    def get_if_changed(self, req, version=None):
+        """
+        Send a GET_META request, asking the server not to send the answer
+        again if it has not changed since the version the client holds.
+
+        :param req: json request
+        :param version: optional; version stamp of the answer already held
+        :return: (result, version stamp); result is None if the answer is
+                 unchanged. The stamp is None if the server does not send
+                 one, in which case the full answer is always sent.
+        :raise Exception: for any problems
+        """
+        payload = pickle.dumps(req, protocol=-1)
+        headers = {HDR_IF_VERSION: version} if version else {}
+        resp = self.pool.post(self.url,
+                              auth=(self.login, self.pwd),
+                              data=payload,
+                              headers=headers)
+
+        if resp.status_code == 304:
+            return None, version
+
+        if resp.status_code != 200:
+            raise_response_error(resp.status_code, resp.headers)
+
+        return pickle.loads(resp.content), resp.headers.get(HDR_VERSION)
+
+    def _get_file(self, req):
+        """
+        Download the file for a GET_FILE request to req['target'].
+
+        The compressed body is streamed to target + PART_SUFFIX a chunk at
+        a time. If the connection drops, the download is resumed from the
+        end of the partial file with an http Range request, up to
+        self.retries times; a partial file left by an earlier call is also
+        resumed. Once complete, the file is decompressed next to the
+        target, checked against the checksum sent by the server (if any)
+        and renamed into place, so target only ever appears complete.
+
+        :param req: json request including 'target', the local file name
+        :raise ChecksumError: if the file does not match its checksum
+        :raise Exception: for any other problems
+        """
+        target = req.get("target")
+        part = target + PART_SUFFIX
+        payload = pickle.dumps(req, protocol=-1)
+
+        state = _read_part_state(part)
+        attempt = 0
+        while True:
+            try:
+                state = self._fetch_part(payload, part, state)
+                break
+
+            except _TRANSIENT_ERRORS as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                self.logger.warning("GET_FILE download of %s interrupted, "
+                                    "resuming (attempt %d of %d): %s"
+                                    % (target, attempt, self.retries, e))
+                time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+                state = _read_part_state(part)
+
+        self._finish_file(part, target, state)
+
+    def _fetch_part(self, payload, part, state):
+        """
+        Send the GET_FILE request and append the body to the partial
+        download, asking only for the bytes not yet received. A partial
+        download which the server cannot resume is started again, once.
+
+        :param payload: pickled request
+        :param part: name of the partial download file
+        :param state: encoding and checksum of the partial download, or
+                      None to start from the beginning
+        :return: encoding and checksum of the completed download
+        :raise ServerError: if the server will not send the file from the
+                            beginning either
+        """
+        for attempt in range(2):
+            offset = op.getsize(part) if state else 0
+
+            # a resumed body must be in the same encoding as the bytes we
+            # have
+            codecs = [state['encoding']] if state else self.codecs
+            headers = request_headers(self.service, codecs)
+            if offset:
+                headers['Range'] = 'bytes=%d-' % offset
+
+            resp = self.pool.post(self.url,
+                                  auth=(self.login, self.pwd),
+                                  data=payload,
+                                  headers=headers,
+                                  stream=True)
+
+            with closing(resp):
+                if resp.status_code == 416 and offset:
+                    # the server cannot satisfy the range; start again
+                    _remove_files(part, part + STATE_SUFFIX)
+                    state = None
+                    continue
+
+                if resp.status_code not in (200, 206):
+                    raise_response_error(resp.status_code, resp.headers)
+
+                received = {'encoding': resp.headers.get(
+                                HDR_ENCODING, compression.DEFAULT_CODEC),
+                            'checksum': resp.headers.get(HDR_CHECKSUM)}
+
+                if resp.status_code == 206 and received != state:
+                    # the file on the server has changed since the partial
+                    # download was made
+                    _remove_files(part, part + STATE_SUFFIX)
+                    state = None
+                    continue
+
+                # a 200 means the server sent the whole body, either
+                # because none was requested or because it ignored the
+                # Range header
+                mode = "ab" if resp.status_code == 206 else "wb"
+                _write_part_state(part, received)
+                with open(part, mode) as out:
+                    for chunk in resp.iter_content(self.chunk_size):
+                        out.write(chunk)
+
+            return received
+
+        raise ServerError("The server did not send %s from the beginning"
+                          % part[:-len(PART_SUFFIX)])
+
+    def _finish_file(self, part, target, state):
+        """
+        Decompress a completed download next to target, verify its
+        checksum and rename it into place.
+
+        :param part: name of the completed download file
+        :param target: final file name
+        :param state: encoding and checksum sent by the server
+        :raise ChecksumError: if the file does not match its checksum
+        """
+        expected = None
+        digest = None
+        if state['checksum']:
+            algorithm, expected = state['checksum'].split('=', 1)
+            digest = hashlib.new(algorithm.strip().lower())
+
+        codec = compression.get_codec(state['encoding'])
+        handle, tmp = tempfile.mkstemp(dir=op.dirname(op.abspath(target)),
+                                       prefix=op.basename(target) + '.')
+        try:
+            with open(part, "rb") as src, codec.open(src) as content, \
+                    os.fdopen(handle, "wb") as tgt:
+                while True:
+                    chunk = content.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    if digest is not None:
+                        digest.update(chunk)
+                    tgt.write(chunk)
+
+            if digest is not None and \
+                    digest.hexdigest() != expected.strip().lower():
+                # the partial file is no use for resuming either
+                _remove_files(part, part + STATE_SUFFIX)
+                raise ChecksumError("Checksum of %s does not match %s"
+                                    % (target, state['checksum']))
+
+            os.replace(tmp, target)
+        except BaseException:
+            _remove_files(tmp)
+            raise
+
+        _remove_files(part, part + STATE_SUFFIX)
+
+    def _decode_data(self, resp):
+        """
+        De-serialize the xarray data in a GET_DATA response.
+
+        :param resp: requests.Response
+        :return: x-array data
+        """
+        if self.stream:
+            # decompress and de-serialize the body as it arrives,
+            # so neither the compressed nor the decompressed bytes
+            # are ever held in full alongside the xarray
+            source = open_response(resp, self.chunk_size)
+        else:
+            source = io.BytesIO(resp.content)
+
+        with closing(resp):
+            return load_data(source, resp.headers)
+
+    def _upload_codec(self, resp):
+        """
+        Choose the codec for an upload from those the server listed in its
+        reply to the initial POST.
+
+        :param resp: requests.Response to the initial POST
+        :return: compression.Codec
+        """
+        return compression.choose(self.codecs,
+                                  _advertised(resp, HDR_ACCEPT_ENCODING))
+
+    def _encode_data(self, resp, data):
+        """
+        Serialise and compress xarray data for a PUT_DATA upload, using the
+        most memory efficient method the server advertised in its reply to
+        the initial POST.
+
+        :param resp: requests.Response to the initial POST
+        :param data: x-array to upload
+        :return: payload (bytes or generator of bytes) and dictionary of
+                 headers describing it
+        """
+        codec = self._upload_codec(resp)
+        headers = {HDR_ENCODING: codec.name}
+
+        if wire.FORMAT_NAME in _advertised(resp, HDR_ACCEPT_FORMAT):
+            try:
+                # Send the raw array buffers directly from memory; the
+                # encoder never copies the data, and it is compressed a
+                # chunk at a time on its way out.
+                chunks = wire.dump_chunks(data, self.chunk_size)
+                headers[HDR_FORMAT] = wire.FORMAT_NAME
+                return codec.compress_chunks(chunks), headers
+            except wire.WireFormatError as e:
+                self.logger.info("Data cannot be sent in the %s format, "
+                                 "using pickle: %s" % (wire.FORMAT_NAME, e))
+
+        if SLICED_TRANSFER in _advertised(resp, HDR_ACCEPT_TRANSFER):
+            # Pickle and compress one block of time steps at a time and
+            # send them as a chunked transfer, so only one block is ever
+            # serialised in memory.
+            payload = codec.compress_chunks(
+                pickled_slices(data, self.slice_bytes))
+            headers[HDR_TRANSFER] = SLICED_TRANSFER
+            return payload, headers
+
+        # For ERA5 registration, the below line caused a
+        # spike of 7.2GB of memory usage from a 1.4GB array
+        payload_pickled = pickle.dumps(data, protocol=-1)
+        return codec.compress(payload_pickled), headers
+
+    @contextmanager
+    def _file_payload(self, resp, source, codec, progress=None):
+        """
+        Open a local file as the compressed body of a PUT_FILE upload,
+        holding only one chunk of it in memory at a time.
+
+        If the server accepts chunked transfers the file is compressed as
+        it is sent. Otherwise it is compressed into a temporary file first
+        so the body can be sent with its length. Uncompressed files are
+        sent as they are.
+
+        :param resp: requests.Response to the initial POST
+        :param source: name of the local file
+        :param codec: compression.Codec to compress the file with
+        :param progress: optional function called as progress(sent, total)
+                         with the number of bytes of the body sent so far
+                         and its total size (None if not known)
+        :return: context manager giving the body to send
+        """
+        with open(source, 'rb') as f_in:
+            if isinstance(codec, compression.NoCodec):
+                size = os.fstat(f_in.fileno()).st_size
+                yield ProgressFile(f_in, size, progress) if progress else f_in
+                return
+
+            chunks = codec.compress_chunks(read_chunks(f_in, self.chunk_size))
+
+            accepted = _advertised(resp, HDR_ACCEPT_TRANSFER)
+            if CHUNKED_TRANSFER in accepted or SLICED_TRANSFER in accepted:
+                yield report_progress(chunks, progress) if progress \
+                    else chunks
+                return
+
+            with tempfile.TemporaryFile() as spool:
+                for chunk in chunks:
+                    spool.write(chunk)
+                size = spool.tell()
+                spool.seek(0)
+                yield ProgressFile(spool, size, progress) if progress \
+                    else spool
+
+    def put_to_dq(self, req, data=None, progress=None):
         """
         Upload information, data or file to the datacube.
         The service asked for is used to determine the upload location
@@ -322,6 +847,9 @@ class APIRequest(object):
 
         :param req: json request
         :param data: optional x-array to upload
+        :param progress: optional function called as progress(sent, total)
+                         while a PUT_FILE upload is sent, with the bytes
+                         sent so far and the total (None if not known)
 
         :return: no return
 
@@ -335,19 +863,10 @@ class APIRequest(object):
         try:
             # for metadata and registration, this request contains ALL info.
             payload = pickle.dumps(req, protocol=-1)
-            resp_1 = requests.post(self.url, auth=(self.login, self.pwd), data=payload)
+            resp_1 = self.pool.post(self.url, auth=(self.login, self.pwd), data=payload)
 
             if resp_1.status_code != 200:
-                formatted_str = resp_1.headers['error'].replace(
-                        "\\n", "\n").replace("\\", " ").replace("(", "") \
-                    .replace(")", "")
-
-                resp_1.headers.update({'error': formatted_str})
-
-                if resp_1.status_code == 401:
-                    raise ConnectionRefusedError(resp_1.headers)
-                else:
-                    raise Exception(resp_1.headers['error'])
+                raise_response_error(resp_1.status_code, resp_1.headers)
 
             # extract the response's text for PUT_FILE and PUT_DATA only.
             if self.service == "PUT_FILE":
@@ -359,13 +878,16 @@ class APIRequest(object):
                     # have made it a payload  instead. If anyone else can
                     # get it to work... please do :)
 
-                    # convert contents of file to bytes and compress
-                    with open(req.get('source'), 'rb') as f_in:
-                        payload = gzip.compress(f_in.read())
-
-                    resp_2 = requests.put(put_url,
-                                          auth=(self.login, self.pwd),
-                                          data=payload)
+                    # compress the contents of the file a chunk at a time
+                    # on their way to the server
+                    codec = self._upload_codec(resp_1)
+                    with self._file_payload(resp_1, req.get('source'), codec,
+                                            progress) as payload:
+                        resp_2 = self.pool.put(put_url,
+                                               auth=(self.login, self.pwd),
+                                               data=payload,
+                                               headers={HDR_ENCODING:
+                                                        codec.name})
                     if resp_2.status_code != 200:
                         raise Exception(resp_2.headers)
                 else:
@@ -376,15 +898,12 @@ class APIRequest(object):
             elif self.service == "PUT_DATA":
                 put_url = self.url + resp_1.text
                 if data is not None:  # data is xarray
+                    payload, headers = self._encode_data(resp_1, data)
 
-                    # For ERA5 registration, the below line caused a
-                    # spike of 7.2GB of memory usage from a 1.4GB array
-                    payload_pickled = pickle.dumps(data, protocol=-1)
-                    payload = gzip.compress(payload_pickled)
-
-                    resp_2 = requests.put(put_url,
-                                          auth=(self.login, self.pwd),
-                                          data=payload)
+                    resp_2 = self.pool.put(put_url,
+                                           auth=(self.login, self.pwd),
+                                           data=payload,
+                                           headers=headers)
 
                     if resp_2.status_code != 200:
                         raise Exception(resp_2.headers)
@@ -418,9 +937,23 @@ class AssimilaData(object):
     server's do_GET() handler.
     Subsequent requests are handled by do_POST() and do_PUT() where the
     command sent in the request determines the behaviour.
+
+    All clients talking to the same server as the same user share one
+    keep-alive ConnectionPool, so Connect objects created by Dataset,
+    Search, Register etc. re-use the same open connections.
     """
+    # Connection pools, keyed on (server address, login).
+    _pools = {}
+    _pools_lock = threading.Lock()
+    # Servers found not to understand batched GET_META requests.
+    _no_batch = set()
+
     def __init__(self, url=None, port=None, pwd=None, login=None,
-                 identfile=None, sysfile=None, test=False):
+                 identfile=None, sysfile=None, test=False,
+                 pool_size=10, keep_alive=True, stream=True,
+                 chunk_size=DEFAULT_CHUNK_SIZE,
+                 slice_bytes=DEFAULT_SLICE_BYTES, codecs=None,
+                 retries=DEFAULT_RETRIES):
         """
         Create the DQ client API object.
         Connection information may be provided. If none, or some is
@@ -434,6 +967,22 @@ class AssimilaData(object):
         :param identfile: optional; location of user's credentials file
         :param sysfile: optional; location of the deployed system's yaml file for DASK use
         :param test: optional; to control creation of on-the-fly log filename
+        :param pool_size: optional; maximum number of connections held open
+                          to the server. Only used when the first client for
+                          this server and login creates the shared pool.
+        :param keep_alive: optional; set False to close the connection after
+                           every request.
+        :param stream: optional; set False to read GET_DATA responses fully
+                       into memory before decoding them.
+        :param chunk_size: optional; bytes read from the socket at a time
+                           when streaming.
+        :param slice_bytes: optional; approximate size of each block of time
+                            steps serialised when uploading data.
+        :param codecs: optional; compression codecs to offer the server, in
+                       order of preference. Defaults to all those installed
+                       (see compression.available()).
+        :param retries: optional; number of times an interrupted file
+                        download is resumed before giving up.
         """
         # set up the logging output filename here so that no changes are
         # needed in its configuration file to account for where the code
@@ -468,6 +1017,15 @@ class AssimilaData(object):
         self.full_url = self.url + ':' + self.port
         self.sysfile = sysfile
 
+        self.pool = AssimilaData._get_pool(self.full_url, self.login,
+                                           pool_size, keep_alive)
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.slice_bytes = slice_bytes
+        self.codecs = [compression.get_codec(name).name
+                       for name in codecs] if codecs else None
+        self.retries = retries
+
         # self.logger.info(f"HTTP Client initialised with identification file: {identfile}")
         self.logger.info("HTTP Client initialised with identification file: %s"
                          % identfile)
@@ -475,6 +1033,52 @@ class AssimilaData(object):
     def __del__(self):
         logging.shutdown()
 
+    @classmethod
+    def _get_pool(cls, full_url, login, pool_size, keep_alive):
+        """
+        Find the shared connection pool for this server and user, creating
+        it if this is the first client.
+
+        :return: ConnectionPool
+        """
+        key = (full_url, login)
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(pool_size=pool_size,
+                                      keep_alive=keep_alive)
+                cls._pools[key] = pool
+        return pool
+
+    def _api_request(self, service, codec=None):
+        """
+        Create the http client object for a single request.
+
+        :param service: command from user
+        :param codec: optional; name of the only compression codec to offer
+                      for this request, overriding self.codecs
+        :return: APIRequest
+        """
+        codecs = [compression.get_codec(codec).name] if codec else self.codecs
+        return APIRequest(self.logger, service,
+                          self.full_url, self.login, self.pwd,
+                          self.sysfile, pool=self.pool,
+                          stream=self.stream, chunk_size=self.chunk_size,
+                          slice_bytes=self.slice_bytes, codecs=codecs,
+                          retries=self.retries)
+
+    def connection_stats(self):
+        """
+        Connection re-use statistics for the shared pool.
+
+        :return: dictionary with 'totals' (requests, new_connections,
+                 reused_connections, reuse_ratio for all requests made
+                 through the pool) and 'last_request' (the most recent
+                 request made from the calling thread).
+        """
+        return {'totals': self.pool.stats(),
+                'last_request': self.pool.last_request()}
+
     def check(self, req):
         """
         Confirm that the provided credentials are accepted by the server.
@@ -485,9 +1089,7 @@ class AssimilaData(object):
         :raise ConnectionRefusedError: if authentication fails
         """
         try:
-            c = APIRequest(self.logger, req,
-                           self.full_url, self.login, self.pwd,
-                           self.sysfile)
+            c = self._api_request(req)
 
             return c.check_auth(req)
 
@@ -501,11 +1103,13 @@ class AssimilaData(object):
             raise
 
 
-    def get(self, req):
+    def get(self, req, codec=None):
         """
         Retrieve requested information from the datacube.
 
         :param req: json formatted command
+        :param codec: optional; compression codec to ask the server to use
+                      for this request (the server may still choose gzip)
 
         :return: xarray data, or metadata. No return if file requested.
 
@@ -513,9 +1117,7 @@ class AssimilaData(object):
         :raise Exception: for any other problem
         """
         try:
-            c = APIRequest(self.logger, req.get('command'),
-                           self.full_url, self.login, self.pwd,
-                           self.sysfile)
+            c = self._api_request(req.get('command'), codec)
 
             if req.get('command') == 'GET_FILE':
                 c.get_from_dq(req)
@@ -531,12 +1133,93 @@ class AssimilaData(object):
             self.logger.warning("Error in client get : %s" % e.__repr__())
             raise
 
-    def put(self, req, data=None):
+    def get_if_changed(self, req, version=None):
+        """
+        Retrieve metadata unless it is unchanged since the given version.
+
+        :param req: json formatted GET_META command
+        :param version: optional; version stamp of the copy already held
+        :return: (metadata or None if unchanged, version stamp)
+
+        :raise ConnectionRefusedError: if authentication fails
+        :raise Exception: for any other problem
+        """
+        try:
+            c = self._api_request(req.get('command'))
+
+            return c.get_if_changed(req, version)
+
+        except ConnectionRefusedError as e:
+            self.logger.warning("User not authorised : %s" % e.args)
+            raise
+        except Exception as e:
+            self.logger.warning("Error in client get : %s" % e.__repr__())
+            raise
+
+    def get_many(self, reqs):
+        """
+        Send several GET_META requests in as few round trips as possible,
+        packing up to MAX_BATCH_SIZE of them into each batch request. If
+        the server does not understand batches, the requests are sent one
+        at a time instead.
+
+        :param reqs: list of json formatted GET_META commands
+        :return: list of results in the same order as reqs; a request which
+                 failed has a BatchItemError in place of its result
+
+        :raise ConnectionRefusedError: if authentication fails
+        """
+        for req in reqs:
+            if req.get('command') != 'GET_META':
+                raise ValueError("Only GET_META requests can be batched")
+
+        results = []
+        for start in range(0, len(reqs), MAX_BATCH_SIZE):
+            block = reqs[start:start + MAX_BATCH_SIZE]
+
+            if len(block) > 1 and self.full_url not in self._no_batch:
+                try:
+                    replies = self.get({'command': 'GET_META',
+                                        'action': BATCH_ACTION,
+                                        'params': {'requests': block}})
+                    results.extend(
+                        reply['result'] if 'error' not in reply
+                        else BatchItemError(req, reply['error'])
+                        for req, reply in zip(block, replies))
+                    continue
+                except ServerError as e:
+                    # Only stop batching if the server rejected the batch
+                    # itself; anything else (e.g. a 503) may pass
+                    if _rejects_batch(e):
+                        self.logger.info("Server does not accept batched "
+                                         "requests, sending them one at a "
+                                         "time: %s" % e)
+                        self._no_batch.add(self.full_url)
+                    else:
+                        self.logger.warning("Batched request failed, sending "
+                                            "the requests one at a time: %s"
+                                            % e)
+
+            for req in block:
+                try:
+                    results.append(self.get(req))
+                except ConnectionRefusedError:
+                    raise
+                except Exception as e:
+                    results.append(BatchItemError(req, e))
+
+        return results
+
+    def put(self, req, data=None, codec=None, progress=None):
         """
         Store given information in the datacube.
 
         :param req: json formatted command
         :param data: optional xarray data
+        :param codec: optional; compression codec to use for the upload if
+                      the server accepts it (otherwise gzip)
+        :param progress: optional; function called as progress(sent, total)
+                         with the bytes of a file upload sent so far
 
         :return: no return
 
@@ -544,14 +1227,12 @@ class AssimilaData(object):
         :raise Exception: for any other problem
         """
         try:
-            c = APIRequest(self.logger, req.get('command'),
-                           self.full_url, self.login, self.pwd,
-                           self.sysfile)
+            c = self._api_request(req.get('command'), codec)
 
             if req.get('command') == 'PUT_DATA':
                 c.put_to_dq(req, data=data)
             else:
-                c.put_to_dq(req)
+                c.put_to_dq(req, progress=progress)
 
         except ConnectionRefusedError as e:
             # print("User not authorised : %s" % e.strerror)
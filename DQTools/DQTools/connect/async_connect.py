@@ -0,0 +1,307 @@
+"""
+asyncio client for the DataCube.
+
+AsyncConnect mirrors the read-only methods of Connect, but every method
+is a coroutine, so many GET_META and GET_DATA requests can be in flight
+at once from a single process or notebook kernel:
+
+    async with AsyncConnect() as conn:
+        results = await gather(*[conn.get_subproduct_meta(p, s)
+                                 for p, s in pairs])
+
+The number of requests sent at the same time is bounded by
+max_concurrency; further requests wait their turn. Requests are ordinary
+asyncio tasks and can be cancelled or given a timeout with
+asyncio.wait_for().
+
+Connections stay open until the async with block ends, or close() is
+awaited, in the event loop which made the requests.
+
+Requires the aiohttp package.
+"""
+import asyncio
+import io
+import logging
+import os.path as op
+import pickle
+
+try:
+    import aiohttp
+    from multidict import CIMultiDict
+except ImportError:
+    aiohttp = None
+
+from .connect import Connect
+from .DQclient import get_dqident_values, request_headers, load_data, \
+    raise_response_error
+from . import compression
+
+
+async def gather(*aws):
+    """
+    Run awaitables concurrently, like asyncio.gather(), but if one of them
+    fails, cancel the rest before raising its exception, so that no
+    requests are left running in the background.
+
+    :param aws: coroutines or futures
+    :return: list of results, in the order given
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+class AsyncConnect:
+    """
+    Concurrent, non-blocking handshake and data transfer with the DataCube.
+    """
+
+    def __init__(self, identfile=None, max_concurrency=10, codecs=None,
+                 timeout=None):
+        """
+        Prepare a connection to the DataCube. No request is made until a
+        method is awaited.
+
+        :param identfile: optional; location of user's credentials file
+        :param max_concurrency: optional; maximum number of requests sent to
+                                the server at the same time. This is also
+                                the number of connections kept open.
+        :param codecs: optional; compression codecs to offer the server, in
+                       order of preference. Defaults to all those installed.
+        :param timeout: optional; seconds allowed for each request, including
+                        reading the response. Default is no limit.
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncConnect requires the aiohttp package")
+
+        if not identfile:
+            identfile = op.join(op.dirname(__file__), ".assimila_dq")
+
+        pwd, url, port, login = get_dqident_values(identfile)
+        self.full_url = url + ':' + port
+        self.login = login
+        self._auth = aiohttp.BasicAuth(login=login, password=pwd)
+
+        self.max_concurrency = max_concurrency
+        self.codecs = [compression.get_codec(name).name
+                       for name in codecs] if codecs else \
+            compression.available()
+        self.timeout = timeout
+
+        self.logger = logging.getLogger("__main__")
+
+        # The session and semaphore belong to an event loop, so are only
+        # created once we are running in one.
+        self._loop = None
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """
+        Close all open connections. A session left from another event loop
+        is closed on that loop (see _discard_session()).
+        """
+        if self._loop is not asyncio.get_event_loop():
+            self._discard_session()
+            return
+
+        session = self._session
+        self._session = self._semaphore = self._loop = None
+        if session is not None and not session.closed:
+            await session.close()
+
+    def _get_session(self):
+        """
+        The http session for the running event loop, created on first use.
+        A new session is created if the client is used from another loop
+        (e.g. a second asyncio.run()), and the session of the previous
+        loop is closed on that loop (see _discard_session()).
+
+        :return: aiohttp.ClientSession
+        """
+        loop = asyncio.get_event_loop()
+        if self._session is None or self._loop is not loop \
+                or self._session.closed:
+            self._discard_session()
+
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                auth=self._auth, connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._session
+
+    def _discard_session(self):
+        """
+        Close the session of a previous event loop, if it is still open and
+        its loop can still run it (straight away if the loop is running in
+        another thread, otherwise when it next runs).
+        """
+        session, loop = self._session, self._loop
+        self._session = self._semaphore = self._loop = None
+        if session is None or session.closed or loop is None \
+                or loop.is_closed():
+            return
+
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+        else:
+            loop.create_task(session.close())
+
+    async def _post(self, req, headers=None):
+        """
+        Send one request, waiting for a free slot if max_concurrency
+        requests are already in flight.
+
+        :param req: request dictionary
+        :param headers: optional; extra request headers
+        :return: (status, response headers, response body)
+        """
+        session = self._get_session()
+        payload = pickle.dumps(req, protocol=-1)
+
+        async with self._semaphore:
+            async with session.post(self.full_url, data=payload,
+                                    headers=headers) as resp:
+                body = await resp.read()
+                return resp.status, CIMultiDict(resp.headers), body
+
+    async def get(self, req, codec=None):
+        """
+        Retrieve requested information from the datacube.
+
+        The response body is read in full before it is decoded; GET_DATA
+        payloads are decompressed and de-serialized in a worker thread so
+        the event loop is free to handle other requests meanwhile.
+
+        :param req: json formatted GET_META or GET_DATA command
+        :param codec: optional; compression codec to ask the server to use
+                      for this request
+
+        :return: xarray data, or metadata
+
+        :raise ConnectionRefusedError: if authentication fails
+        :raise Exception: for any other problem
+        """
+        service = req.get('command')
+        if service not in ('GET_META', 'GET_DATA'):
+            raise ValueError("AsyncConnect cannot send %s requests" % service)
+
+        codecs = [compression.get_codec(codec).name] if codec else self.codecs
+
+        try:
+            status, headers, body = await self._post(
+                req, headers=request_headers(service, codecs))
+
+            if status != 200:
+                raise_response_error(status, headers)
+
+            if service == 'GET_DATA':
+                loop = asyncio.get_event_loop()
+                return await loop.run_in_executor(None, load_data,
+                                                  io.BytesIO(body), headers)
+            return pickle.loads(body)
+
+        except ConnectionRefusedError as e:
+            self.logger.warning("User not authorised : %s" % e.args)
+            raise
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.warning("Error in async client get : %s"
+                                % e.__repr__())
+            raise
+
+    async def check_ident(self):
+        """
+        Check the identity of a user.
+
+        :return: True if all OK, false otherwise
+        """
+        status, headers, body = await self._post({'command': 'GET_AUTH'})
+
+        # a 401 is sent by the authentication
+        return status != 401
+
+    async def get_product_subproducts(self, product):
+        """
+        Get the sub-products of this product.
+
+        :param product: The name of the product
+
+        :return: list of sub-products
+        """
+        result = await self.get(Connect._product_subproducts_request(product))
+
+        return Connect._subproduct_names(result)
+
+    async def get_product_meta(self, product):
+        """
+        Extract all available metadata for this product and its sub-products.
+
+        :param product: The name of the product
+
+        :return:
+        """
+        return await self.get(Connect._product_meta_request(product))
+
+    async def get_subproduct_meta(self, product, subproduct, bounds=None,
+                                  tile=None):
+        """
+        Extract all available metadata for this product & sub-product and
+        specific region or tile if requested.
+
+        :param product: The name of the product
+        :param subproduct: The name of the sub-product
+        :param bounds: dictionary of n-s-e-w bounds
+        :param tile: tilename (must match tile registered in DataCube)
+        :return:
+        """
+        return await self.get(
+            Connect._subproduct_meta_request(product, subproduct,
+                                             bounds=bounds, tile=tile))
+
+    async def get_subproduct_data(self, product, subproduct,
+                                  start, stop, use_dask,
+                                  bounds, res, tile, country, latlon,
+                                  projection, codec=None):
+        """
+        Extract and return an xarray of data from the datacube. See
+        Connect.get_subproduct_data() for the parameters.
+
+        DASK pointers are only available through the blocking Connect, so
+        use_dask must be False.
+
+        :return: list of xarray Datasets
+        """
+        if use_dask:
+            raise ValueError("AsyncConnect cannot return DASK pointers, use "
+                             "Connect for use_dask requests")
+
+        return await self.get(
+            Connect._subproduct_data_request(product, subproduct,
+                                             start, stop, use_dask,
+                                             bounds, res, tile, country,
+                                             latlon, projection),
+            codec=codec)
+
+    async def get_all_table_data(self, tablename):
+        """
+        Return everything in a single table.
+
+        :param tablename: The name of the DataCube database table
+        :return:
+        """
+        return await self.get(Connect._table_request(tablename))
@@ -0,0 +1,130 @@
+"""
+In-process cache of DataCube metadata.
+
+The catalog (products, sub-products, tiles) changes rarely, so the
+answers to GET_META requests are kept for a while and shared by every
+Connect object in the process. Each entry expires after a time to live
+which depends on the kind of metadata; writes made through Connect clear
+the cache for that server.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds for which metadata is kept, unless the action is listed in
+# ACTION_TTLS.
+DEFAULT_TTL = 3600
+
+# Sub-product metadata includes the last time step and last gold, which
+# move whenever data are ingested, so it is refreshed sooner.
+ACTION_TTLS = {'get_subproduct_metadata_for_dqtools': 300}
+
+# Number of entries kept; the least recently used are dropped first.
+DEFAULT_MAX_ENTRIES = 256
+
+
+class MetadataCache(object):
+    """
+    Thread-safe store of results with per-entry expiry times.
+
+    Values are deep copied on the way in and out, so a caller changing a
+    result (e.g. a pandas DataFrame) cannot change what later callers get.
+    """
+
+    def __init__(self, default_ttl=DEFAULT_TTL, action_ttls=None,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param default_ttl: seconds an entry is kept for
+        :param action_ttls: optional; dictionary of GET_META action to
+                            seconds, overriding default_ttl. A ttl of 0
+                            means that action is never cached.
+        :param max_entries: maximum number of entries kept
+        """
+        self.default_ttl = default_ttl
+        self.action_ttls = dict(ACTION_TTLS if action_ttls is None
+                                else action_ttls)
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def ttl_for(self, request):
+        """
+        :param request: GET_META request dictionary
+        :return: seconds the result of this request may be kept
+        """
+        return self.action_ttls.get(request.get('action'), self.default_ttl)
+
+    def get(self, key):
+        """
+        Look up an entry, counting the hit or miss.
+
+        :param key: tuple identifying the request
+        :return: (True, copy of the value) if present and not expired,
+                 otherwise (False, None)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            value = entry[1]
+
+        return True, copy.deepcopy(value)
+
+    def put(self, key, value, ttl=None):
+        """
+        Store an entry.
+
+        :param key: tuple identifying the request
+        :param value: the result to keep
+        :param ttl: optional; seconds to keep it for, default_ttl if None
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *prefix, match=None):
+        """
+        Drop cached entries.
+
+        :param prefix: optional; leading items of the keys to drop (e.g.
+                       the server address). Everything is dropped if
+                       neither this nor match is given.
+        :param match: optional; function of a key, true for the
+                      keys to drop among those with the prefix
+        """
+        with self._lock:
+            if not prefix and match is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries
+                        if key[:len(prefix)] == prefix
+                        and (match is None or match(key))]:
+                del self._entries[key]
+
+    def stats(self):
+        """
+        :return: dictionary of hits, misses and entries
+        """
+        with self._lock:
+            return {'hits': self._hits,
+                    'misses': self._misses,
+                    'entries': len(self._entries)}
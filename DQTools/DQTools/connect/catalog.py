@@ -0,0 +1,338 @@
+"""
+Persistent local copy of the DataCube catalog tables.
+
+The product, sub-product and tile tables are kept in a SQLite file so a
+new process can use them straight away instead of downloading them. Each
+time a stored table is used it is revalidated in a background thread
+(at most once every revalidate_interval seconds): the server is sent the
+version stamp of the stored copy and only sends the table again if it
+has changed. Servers which do not send version stamps always send the
+table, so the stored copy is simply refreshed.
+
+Rows are also stored individually with indexes on their name, product
+id and tile id, so single entries can be looked up without loading the
+whole table.
+
+The file is ~/.dqtools/catalog.sqlite unless the DQTOOLS_CATALOG
+environment variable names another. Stored tables are read back with
+pickle, so the file must not be writable by anyone else; it is only used
+when asked for (e.g. Search(use_catalog=True)).
+"""
+import logging
+import os
+import os.path as op
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+CATALOG_ENV = 'DQTOOLS_CATALOG'
+DEFAULT_PATH = op.join(op.expanduser('~'), '.dqtools', 'catalog.sqlite')
+
+# Minimum seconds between background revalidations of the same table.
+REVALIDATE_INTERVAL = 60
+
+# Columns which can be used with CatalogStore.find()
+INDEXED_COLUMNS = ('name', 'idproduct', 'idtile')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog_table (
+    server TEXT NOT NULL,
+    tablename TEXT NOT NULL,
+    version TEXT,
+    fetched REAL NOT NULL,
+    columns BLOB NOT NULL,
+    frame BLOB NOT NULL,
+    PRIMARY KEY (server, tablename)
+);
+CREATE TABLE IF NOT EXISTS catalog_row (
+    server TEXT NOT NULL,
+    tablename TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name,
+    idproduct,
+    idtile,
+    row BLOB NOT NULL,
+    PRIMARY KEY (server, tablename, position)
+);
+CREATE INDEX IF NOT EXISTS catalog_row_name
+    ON catalog_row (server, tablename, name);
+CREATE INDEX IF NOT EXISTS catalog_row_idproduct
+    ON catalog_row (server, tablename, idproduct);
+CREATE INDEX IF NOT EXISTS catalog_row_idtile
+    ON catalog_row (server, tablename, idtile);
+"""
+
+
+def _server_key(conn):
+    """
+    The stored tables are kept separately for each server and user.
+    """
+    return '%s|%s' % (conn.http_client.full_url, conn.http_client.login)
+
+
+def _sql_value(value):
+    """
+    Convert numpy scalars and missing values for use as SQLite parameters.
+    """
+    if value is None:
+        return None
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+class CatalogStore(object):
+    """
+    SQLite store of catalog tables, safe to use from several threads and
+    processes at once.
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, path=None):
+        """
+        The store for a catalog file, created on first use and shared
+        within the process.
+
+        :param path: optional; catalog file, see module documentation
+        :return: CatalogStore
+        """
+        path = path or os.environ.get(CATALOG_ENV) or DEFAULT_PATH
+        with cls._shared_lock:
+            store = cls._shared.get(path)
+            if store is None:
+                store = cls._shared[path] = cls(path)
+        return store
+
+    @classmethod
+    def forget_shared(cls, conn):
+        """
+        Delete the tables stored for a server from the stores in use in
+        this process, e.g. after registering products or tiles there, so
+        they are downloaded again when next needed.
+
+        :param conn: Connect to the DataCube
+        """
+        with cls._shared_lock:
+            stores = list(cls._shared.values())
+        for store in stores:
+            store.forget(conn)
+
+    def __init__(self, path, revalidate_interval=REVALIDATE_INTERVAL):
+        """
+        :param path: catalog file, created if necessary
+        :param revalidate_interval: minimum seconds between revalidations
+                                    of the same table
+        """
+        self.path = path
+        self.revalidate_interval = revalidate_interval
+        self.logger = logging.getLogger("__main__")
+
+        folder = op.dirname(op.abspath(path))
+        if not op.isdir(folder):
+            os.makedirs(folder)
+
+        with self._db() as db:
+            # lets readers carry on while a revalidation writes
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+
+        self._lock = threading.Lock()
+        self._checked = {}
+
+    @contextmanager
+    def _db(self):
+        """
+        A connection for one transaction. sqlite3 connections cannot be
+        shared between threads, so each operation opens its own.
+        """
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def table(self, conn, tablename):
+        """
+        Return a whole catalog table: the stored copy if there is one
+        (revalidated in the background), otherwise downloaded now.
+
+        :param conn: Connect to the DataCube
+        :param tablename: 'product', 'subproduct', 'tile' etc.
+        :return: pandas DataFrame
+        """
+        server = _server_key(conn)
+        with self._db() as db:
+            stored = db.execute(
+                "SELECT frame, version FROM catalog_table "
+                "WHERE server = ? AND tablename = ?",
+                (server, tablename)).fetchone()
+
+        if stored is None:
+            return self._refresh(conn, server, tablename, None)
+
+        self._revalidate_later(conn, server, tablename, stored[1])
+        return pickle.loads(stored[0])
+
+    def find(self, conn, tablename, **criteria):
+        """
+        Look up rows of a catalog table using the indexed columns, e.g.
+        find(conn, 'subproduct', idproduct=3, name='skt').
+
+        If nothing matches in a stored table, the table is revalidated
+        straight away and looked up again, so entries added to the
+        DataCube since it was stored are found.
+
+        :param conn: Connect to the DataCube
+        :param tablename: 'product', 'subproduct', 'tile' etc.
+        :param criteria: column=value pairs, columns from INDEXED_COLUMNS
+        :return: pandas DataFrame of the matching rows, in table order
+        """
+        for column in criteria:
+            if column not in INDEXED_COLUMNS:
+                raise ValueError("Cannot look up catalog rows by %s, choose "
+                                 "from %s" % (column, INDEXED_COLUMNS))
+
+        server = _server_key(conn)
+        with self._db() as db:
+            stored = db.execute(
+                "SELECT columns, version FROM catalog_table "
+                "WHERE server = ? AND tablename = ?",
+                (server, tablename)).fetchone()
+
+        if stored is None:
+            self._refresh(conn, server, tablename, None)
+        columns, rows = self._rows(server, tablename, criteria)
+
+        if stored is not None:
+            if not rows:
+                # The entry may have been added since the table was stored:
+                # check now rather than in the background
+                if self._refresh(conn, server, tablename,
+                                 stored[1]) is not None:
+                    columns, rows = self._rows(server, tablename, criteria)
+            else:
+                self._revalidate_later(conn, server, tablename, stored[1])
+
+        return pd.DataFrame(rows, columns=columns)
+
+    def _rows(self, server, tablename, criteria):
+        """
+        The stored rows matching criteria (see find()).
+
+        :return: (list of column names, list of row dictionaries)
+        """
+        where = ''.join(" AND %s = ?" % column for column in criteria)
+        with self._db() as db:
+            columns = pickle.loads(db.execute(
+                "SELECT columns FROM catalog_table "
+                "WHERE server = ? AND tablename = ?",
+                (server, tablename)).fetchone()[0])
+            rows = db.execute(
+                "SELECT row FROM catalog_row "
+                "WHERE server = ? AND tablename = ?" + where +
+                " ORDER BY position",
+                [server, tablename] +
+                [_sql_value(value) for value in criteria.values()]).fetchall()
+
+        return columns, [pickle.loads(row[0]) for row in rows]
+
+    def clear(self):
+        """
+        Delete all stored tables.
+        """
+        with self._db() as db:
+            db.execute("DELETE FROM catalog_row")
+            db.execute("DELETE FROM catalog_table")
+        with self._lock:
+            self._checked.clear()
+
+    def forget(self, conn):
+        """
+        Delete the tables stored for a server.
+
+        :param conn: Connect to the DataCube
+        """
+        server = _server_key(conn)
+        with self._db() as db:
+            db.execute("DELETE FROM catalog_row WHERE server = ?", (server,))
+            db.execute("DELETE FROM catalog_table WHERE server = ?",
+                       (server,))
+        with self._lock:
+            for key in [key for key in self._checked if key[0] == server]:
+                del self._checked[key]
+
+    def _refresh(self, conn, server, tablename, version):
+        """
+        Download the table if it has changed since version, and store it.
+
+        :return: the new table, or None if unchanged
+        """
+        with self._lock:
+            self._checked[(server, tablename)] = time.monotonic()
+
+        frame, version = conn.get_table_if_changed(tablename, version)
+        if frame is None:
+            return None
+
+        self._store(server, tablename, frame, version)
+        return frame
+
+    def _store(self, server, tablename, frame, version):
+        indexed = [column if column in frame.columns else None
+                   for column in INDEXED_COLUMNS]
+
+        rows = []
+        for position, record in enumerate(frame.to_dict('records')):
+            keys = [_sql_value(record[column]) if column else None
+                    for column in indexed]
+            rows.append([server, tablename, position] + keys +
+                        [pickle.dumps(record, protocol=-1)])
+
+        with self._db() as db:
+            db.execute("DELETE FROM catalog_row "
+                       "WHERE server = ? AND tablename = ?",
+                       (server, tablename))
+            db.executemany("INSERT INTO catalog_row (server, tablename, "
+                           "position, name, idproduct, idtile, row) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            db.execute("INSERT OR REPLACE INTO catalog_table (server, "
+                       "tablename, version, fetched, columns, frame) "
+                       "VALUES (?, ?, ?, ?, ?, ?)",
+                       (server, tablename, version, time.time(),
+                        pickle.dumps(list(frame.columns), protocol=-1),
+                        pickle.dumps(frame, protocol=-1)))
+
+    def _revalidate_later(self, conn, server, tablename, version):
+        """
+        Start a background revalidation of a stored table, unless one was
+        started recently.
+        """
+        key = (server, tablename)
+        now = time.monotonic()
+        with self._lock:
+            last = self._checked.get(key)
+            if last is not None and now - last < self.revalidate_interval:
+                return
+            self._checked[key] = now
+
+        thread = threading.Thread(target=self._revalidate,
+                                  args=(conn, server, tablename, version))
+        thread.daemon = True
+        thread.start()
+
+    def _revalidate(self, conn, server, tablename, version):
+        try:
+            if self._refresh(conn, server, tablename, version) is not None:
+                self.logger.info("Catalog table %s updated." % tablename)
+        except Exception as e:
+            self.logger.warning("Unable to revalidate catalog table %s.\n%s"
+                                % (tablename, e))
@@ -0,0 +1,208 @@
+"""
+Compression codecs for data and file transfers.
+
+gzip is always available and is what the server uses unless told
+otherwise. zstd and lz4 are used if the zstandard and lz4 packages are
+installed, and 'none' sends the payload uncompressed, which is usually
+quickest on a fast local link.
+
+The client lists the codecs it can read in the X-DQ-Accept-Encoding
+request header and the server names the one it chose in X-DQ-Encoding.
+For uploads the server lists the codecs it accepts in its reply to the
+initial POST.
+"""
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Codec the server uses when it does not name one
+DEFAULT_CODEC = 'gzip'
+
+
+class Codec(object):
+    """
+    Base class for a compression codec. Sub-classes provide an
+    incremental compressor and a decompressing file reader, so payloads
+    never need to be compressed or decompressed in one piece.
+    """
+    name = None
+
+    def compressor(self):
+        """
+        :return: object with compress(bytes) and flush() methods
+        """
+        raise NotImplementedError
+
+    def open(self, fileobj):
+        """
+        Wrap a binary file so that reads return decompressed bytes.
+
+        :param fileobj: binary file-like object of compressed data
+        :return: binary file-like object
+        """
+        raise NotImplementedError
+
+    def compress_chunks(self, chunks):
+        """
+        Compress an iterable of byte chunks one chunk at a time.
+
+        :param chunks: iterable yielding bytes-like objects
+        :return: generator of compressed bytes
+        """
+        compressor = self.compressor()
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        tail = compressor.flush()
+        if tail:
+            yield tail
+
+    def compress(self, data):
+        """
+        Compress a complete payload.
+
+        :param data: bytes
+        :return: bytes
+        """
+        return b''.join(self.compress_chunks([data]))
+
+
+class _Passthrough(object):
+    """
+    Compressor which returns its input unchanged.
+    """
+    def compress(self, data):
+        return bytes(data)
+
+    def flush(self):
+        return b''
+
+
+class NoCodec(Codec):
+    name = 'none'
+
+    def compressor(self):
+        return _Passthrough()
+
+    def open(self, fileobj):
+        return fileobj
+
+
+class GzipCodec(Codec):
+    name = 'gzip'
+
+    def __init__(self, level=9):
+        # level 9 matches gzip.compress, which was used before codecs
+        # were negotiable
+        self.level = level
+
+    def compressor(self):
+        # wbits of 16 + MAX_WBITS writes the gzip header and trailer
+        return zlib.compressobj(self.level, zlib.DEFLATED,
+                                16 + zlib.MAX_WBITS)
+
+    def open(self, fileobj):
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+
+
+class ZstdCodec(Codec):
+    name = 'zstd'
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def compressor(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def open(self, fileobj):
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+
+class _LZ4Compressor(object):
+    """
+    Adapt lz4.frame.LZ4FrameCompressor to the compress()/flush() interface
+    used by zlib.
+    """
+    def __init__(self):
+        self._compressor = lz4.frame.LZ4FrameCompressor()
+        self._header = self._compressor.begin()
+
+    def compress(self, data):
+        compressed = self._compressor.compress(bytes(data))
+        if self._header:
+            compressed = self._header + compressed
+            self._header = b''
+        return compressed
+
+    def flush(self):
+        return self._header + self._compressor.flush()
+
+
+class LZ4Codec(Codec):
+    name = 'lz4'
+
+    def compressor(self):
+        return _LZ4Compressor()
+
+    def open(self, fileobj):
+        return lz4.frame.LZ4FrameFile(fileobj, mode='rb')
+
+
+def available():
+    """
+    Names of the codecs installed on this client, fastest first.
+
+    :return: list of codec names
+    """
+    names = []
+    if zstandard is not None:
+        names.append(ZstdCodec.name)
+    if lz4 is not None:
+        names.append(LZ4Codec.name)
+    names.extend([GzipCodec.name, NoCodec.name])
+    return names
+
+
+def get_codec(name):
+    """
+    Look up a codec by name.
+
+    :param name: one of the names returned by available()
+    :return: Codec instance
+    :raise ValueError: if the codec is unknown or its package is not
+                       installed
+    """
+    name = (name or DEFAULT_CODEC).strip().lower()
+    if name not in available():
+        raise ValueError("Compression codec '%s' is not available, choose "
+                         "from %s" % (name, available()))
+
+    return {ZstdCodec.name: ZstdCodec,
+            LZ4Codec.name: LZ4Codec,
+            GzipCodec.name: GzipCodec,
+            NoCodec.name: NoCodec}[name]()
+
+
+def choose(preferred, accepted):
+    """
+    Pick the codec for an upload: the first of ours that the server said
+    it accepts, or gzip if the server did not say.
+
+    :param preferred: list of codec names in our order of preference
+    :param accepted: list of codec names advertised by the server
+    :return: Codec instance
+    """
+    for name in preferred:
+        if name in accepted:
+            return get_codec(name)
+    return get_codec(DEFAULT_CODEC)
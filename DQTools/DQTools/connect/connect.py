@@ -1,27 +1,359 @@
+import copy
 import os.path as op
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from .DQclient import AssimilaData
+from .DQclient import AssimilaData, BatchItemError
+from .cache import MetadataCache
+from .catalog import CatalogStore
+from .planner import plan, stitch, DEFAULT_WORKERS
+
+
+def _canonical(obj):
+    """
+    Hashable form of a request which is the same for equal requests,
+    whatever the order of their dictionary keys.
+    """
+    if isinstance(obj, dict):
+        return tuple(sorted((str(key), _canonical(value))
+                            for key, value in obj.items()))
+    if isinstance(obj, (list, tuple)):
+        return tuple(_canonical(value) for value in obj)
+    try:
+        hash(obj)
+        return obj
+    except TypeError:
+        return pickle.dumps(obj, protocol=-1)
+
+
+class _Flight:
+    """
+    A request on its way to the server, and the result for each caller
+    which asked for the same thing meanwhile.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiting = 0
+        self.results = []
+        self.error = None
 
 
 class Connect:
     """
     Establish handshake and data transfer with the DataCube.
 
+    Identical GET_META and GET_DATA requests made at the same time, from
+    any thread or Connect object, are sent to the server once; the other
+    callers wait for that request and are given their own copy of its
+    result.
+
+    GET_META results are kept in metadata_cache, shared by all Connect
+    objects, for a time depending on the kind of metadata (see
+    connect.cache). Call Connect.metadata_cache.invalidate() to force
+    fresh answers; writes made through Connect do this for their server.
     """
+    # Metadata answers, keyed on server, user and canonical request.
+    metadata_cache = MetadataCache()
+
+    # Requests currently being sent, keyed on server, user, codec and
+    # canonical request.
+    _in_flight = {}
+    _in_flight_lock = threading.Lock()
+    _coalesced = 0
 
-    def __init__(self, identfile=None, sysfile=None):
+    def __init__(self, identfile=None, sysfile=None, pool_size=10,
+                 keep_alive=True):
         """
         Make connection to the DataCube.
 
         :param identfile: optional; location of user's credentials file
         :param sysfile: optional; location of the deployed system's yaml file for DASK use
+        :param pool_size: optional; maximum number of http connections kept
+                          open to the server (shared by all Connect objects
+                          for the same server and user)
+        :param keep_alive: optional; set False to close the connection after
+                           every request
 
         """
 
         if not identfile:
             identfile = op.join(op.dirname(__file__), ".assimila_dq")
 
-        self.http_client = AssimilaData(identfile=identfile, sysfile=sysfile)
+        self.http_client = AssimilaData(identfile=identfile, sysfile=sysfile,
+                                        pool_size=pool_size,
+                                        keep_alive=keep_alive)
+
+    def connection_stats(self):
+        """
+        Report how well http connections to the DataCube are being re-used.
+
+        :return: dictionary of pool totals and last request statistics
+        """
+        stats = self.http_client.connection_stats()
+        with Connect._in_flight_lock:
+            stats['coalesced_requests'] = Connect._coalesced
+        stats['metadata_cache'] = Connect.metadata_cache.stats()
+        return stats
+
+    def _cache_key(self, request):
+        return (self.http_client.full_url, self.http_client.login,
+                _canonical(request))
+
+    def _get(self, request, codec=None):
+        """
+        Answer a GET request from the metadata cache if possible, otherwise
+        send it.
+
+        :param request: GET_META or GET_DATA request dictionary
+        :param codec: optional; compression codec to ask the server to use
+        :return: the result
+        """
+        if request.get('command') != 'GET_META':
+            return self._get_once(request, codec=codec)
+
+        key = self._cache_key(request)
+        hit, result = Connect.metadata_cache.get(key)
+        if hit:
+            return result
+
+        result = self._get_once(request, codec=codec)
+        Connect.metadata_cache.put(key, result,
+                                   Connect.metadata_cache.ttl_for(request))
+        return result
+
+    def _get_once(self, request, codec=None):
+        """
+        Send a GET request, unless an identical one is already on its way
+        to the server, in which case wait for that one's result instead.
+
+        :param request: GET_META or GET_DATA request dictionary
+        :param codec: optional; compression codec to ask the server to use
+        :return: the result; a caller which did not send the request gets
+                 a deep copy, so it can be changed without affecting the
+                 other callers
+        """
+        key = (self.http_client.full_url, self.http_client.login, codec,
+               _canonical(request))
+
+        with Connect._in_flight_lock:
+            flight = Connect._in_flight.get(key)
+            sending = flight is None
+            if sending:
+                flight = Connect._in_flight[key] = _Flight()
+            else:
+                flight.waiting += 1
+                Connect._coalesced += 1
+
+        if not sending:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.results.pop()
+
+        try:
+            result = self.http_client.get(request, codec=codec)
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+
+        self._land(key, flight, result=result)
+        return result
+
+    @staticmethod
+    def _land(key, flight, result=None, error=None):
+        """
+        Hand the result of a request, or the error it raised, to the
+        callers waiting for it.
+        """
+        # No-one else can join once the request is removed from the
+        # in-flight table, so exactly enough copies are made, and they are
+        # made before the sender's caller has a chance to change the
+        # original.
+        with Connect._in_flight_lock:
+            del Connect._in_flight[key]
+            waiting = flight.waiting
+
+        if error is None and waiting:
+            try:
+                flight.results = [copy.deepcopy(result)
+                                  for _ in range(waiting)]
+            except Exception as e:
+                error = e
+
+        flight.error = error
+        flight.done.set()
+
+    # ------------------------------------------------------------------
+    # Request builders, shared with AsyncConnect.
+
+    @staticmethod
+    def _product_subproducts_request(product):
+        return {'command': 'GET_META',
+                'action': 'search_metadata',
+                'params': {
+                    'search_terms': {'name': product},
+                    'recurse': 'True'}}
+
+    @staticmethod
+    def _subproduct_names(result):
+        retval = list()
+        for item in result['subproducts']:
+            retval.append(item['name'])
+
+        return retval
+
+    @staticmethod
+    def _product_meta_request(product):
+        return {'command': 'GET_META',
+                'action': 'get_metadata_product_and_children',
+                'params': {'product': product}}
+
+    @staticmethod
+    def _subproduct_meta_request(product, subproduct, bounds=None, tile=None):
+        return {'command': 'GET_META',
+                'action': 'get_subproduct_metadata_for_dqtools',
+                'params': {'product': product,
+                           'subproduct': subproduct,
+                           'bounds': bounds,
+                           'tile': tile}}
+
+    @staticmethod
+    def _table_request(tablename):
+        return {'command': 'GET_META',
+                'action': 'get_table_contents',
+                'params': {'table': tablename}}
+
+    @staticmethod
+    def _subproduct_data_request(product, subproduct, start, stop, use_dask,
+                                 bounds, res, tile, country, latlon,
+                                 projection):
+        """
+        Build the GET_DATA request for get_subproduct_data().
+
+        :return: request dictionary
+        :raise Exception: if zonal statistics are asked for without a tile
+        """
+        # Several sub-products of the product can be fetched together
+        if not isinstance(subproduct, (list, tuple)):
+            subproduct = [subproduct]
+
+        # Prepare the product metadata
+        get_request_params = {
+            'product': product,
+            'subproduct': list(subproduct),
+            'start_date': start,
+            'end_date': stop,
+            'use_dask': use_dask
+            }
+
+        # If a resolution or projection has been provided then warp
+        if res or projection:
+            warp_params = dict()
+            if res: warp_params = {'xRes': res, 'yRes': res}
+            # this next line will add to the dict if 'res' has already
+            # populated it or will make a new entry anyway
+            if projection: warp_params['dstSRS'] = projection
+            get_request_params['warp'] = warp_params
+            get_request_params['warptobounds'] = True
+
+        if country:
+            if tile:
+                action = 'get_zonal_data'
+                get_request_params['tile'] = tile
+                get_request_params["zonal_stats"] = country
+                # we don't need the DASK option for this method
+                get_request_params.pop('use_dask', None)
+            else:
+                # One cannot expect zonal stats without having a tile
+                # TODO Support bounds for zonal stats in future
+                raise Exception('A tile must be specified to calculate '
+                                'zonal statistics.')
+
+        # Add in area information if specified
+        if tile and not country:
+            action = 'get_tile_data'
+            get_request_params['tile'] = tile
+        elif bounds:
+            action = 'get_area_data'
+            get_request_params['north'] = bounds.north
+            get_request_params['south'] = bounds.south
+            get_request_params['east'] = bounds.east
+            get_request_params['west'] = bounds.west
+        elif latlon:
+            action = 'get_position_data'
+            get_request_params['lat'] = latlon[0]
+            get_request_params['lon'] = latlon[1]
+        # else:
+        #     # get global data
+        #     action = 'get_area_data'
+        #     get_request_params['north'] = 90
+        #     get_request_params['south'] = -90
+        #     get_request_params['east'] = 180
+        #     get_request_params['west'] = -180
+
+        return {'command': 'GET_DATA',
+                'action': action,
+                'params': get_request_params}
+
+    def get_meta_many(self, requests):
+        """
+        Send several GET_META requests together, in one round trip if the
+        server supports it. Any already in the metadata cache are answered
+        from there. batch() is usually more convenient.
+
+        :param requests: list of GET_META request dictionaries
+        :return: list of results in the same order; a request which failed
+                 has a BatchItemError in place of its result
+        """
+        results = [None] * len(requests)
+        missing = []
+        for i, request in enumerate(requests):
+            hit, results[i] = Connect.metadata_cache.get(
+                self._cache_key(request))
+            if not hit:
+                missing.append(i)
+
+        if missing:
+            fetched = self.http_client.get_many([requests[i]
+                                                 for i in missing])
+            for i, result in zip(missing, fetched):
+                results[i] = result
+                if not isinstance(result, BatchItemError):
+                    Connect.metadata_cache.put(
+                        self._cache_key(requests[i]), result,
+                        Connect.metadata_cache.ttl_for(requests[i]))
+
+        return results
+
+    def _put(self, request, data=None, codec=None, progress=None):
+        """
+        Send a PUT request, then forget all cached metadata for this server
+        as the write may have changed it, and the catalog tables kept for
+        it if products or tiles were registered.
+        """
+        try:
+            self.http_client.put(request, data, codec=codec,
+                                 progress=progress)
+        finally:
+            Connect.metadata_cache.invalidate(self.http_client.full_url)
+            if request.get('action', '').startswith('register'):
+                CatalogStore.forget_shared(self)
+
+    def batch(self):
+        """
+        Collect metadata queries and send them together when the with
+        block ends:
+
+            with conn.batch() as batch:
+                products = batch.get_all_table_data('product')
+                subproducts = batch.get_all_table_data('subproduct')
+            products = products.result()
+
+        :return: MetaBatch
+        """
+        return MetaBatch(self)
 
     def check_ident(self):
         """
@@ -49,17 +381,10 @@ class Connect:
         """
         try:
 
-            result = self.http_client.get({'command': 'GET_META',
-                                           'action': 'search_metadata',
-                                           'params': {
-                                               'search_terms': {'name': product},
-                                               'recurse': 'True'}})
+            result = self._get(
+                self._product_subproducts_request(product))
 
-            retval = list()
-            for item in result['subproducts']:
-                retval.append(item['name'])
-
-            return retval
+            return self._subproduct_names(result)
 
         except Exception as e:
             raise e
@@ -74,10 +399,7 @@ class Connect:
         """
         try:
 
-            result = self.http_client.get({'command': 'GET_META',
-                                           'action':
-                                               'get_metadata_product_and_children',
-                                           'params': {'product': product}})
+            result = self._get(self._product_meta_request(product))
 
             return result
 
@@ -97,27 +419,55 @@ class Connect:
         """
         try:
 
-            result = self.http_client.get(
-                {'command': 'GET_META',
-                 'action': 'get_subproduct_metadata_for_dqtools',
-                 'params': {'product': product,
-                            'subproduct': subproduct,
-                            'bounds': bounds,
-                            'tile': tile}})
+            result = self._get(
+                self._subproduct_meta_request(product, subproduct,
+                                              bounds=bounds, tile=tile))
 
             return result
 
         except Exception as e:
             raise e
 
+    def invalidate_subproduct_meta(self, product, subproduct):
+        """
+        Drop the cached metadata of a sub-product, for every region and
+        tile, so that it is fetched again from the DataCube.
+
+        :param product: The name of the product
+        :param subproduct: The name of the sub-product
+        """
+        action = self._subproduct_meta_request(product, subproduct)['action']
+
+        def match(key):
+            request = dict(key[2])
+            if request.get('action') != action:
+                return False
+            params = dict(request.get('params', ()))
+            return params.get('product') == product and \
+                params.get('subproduct') == subproduct
+
+        Connect.metadata_cache.invalidate(self.http_client.full_url,
+                                          self.http_client.login,
+                                          match=match)
+
     def get_subproduct_data(self, product, subproduct,
                             start, stop, use_dask,
-                            bounds, res, tile, country, latlon, projection):
+                            bounds, res, tile, country, latlon, projection,
+                            codec=None, time_window=None, boxes=None,
+                            max_workers=DEFAULT_WORKERS):
         """
         Extract and return an xarray of data from the datacube
 
+        The data are fetched with one request unless asked otherwise: given
+        a time_window, long periods are fetched as several requests for
+        shorter time windows, and given boxes, areas given by bounds are
+        fetched as a grid of sub-boxes. Up to max_workers of these pieces
+        are fetched at once and joined into the same Dataset a single
+        request would return. See planner.py.
+
         :param product: The name of the product
-        :param subproduct: The name of the sub-product
+        :param subproduct: The name of the sub-product, or a list of names
+        to fetch several sub-products of the product in one request
         :param start: The starting time for extracting data
         :param stop: The ending time for extracting data
         :param use_dask: if True, obtains pointer to vrt file on the server,
@@ -130,79 +480,68 @@ class Connect:
         the DataCube
         :param country: A country over which to carry out zonal averaging
         :param projection: Name or proj4 string to define projection.
-        :return:
+        :param codec: optional; compression codec to ask the server to use
+                      (see compression.available())
+        :param time_window: optional; longest period fetched by one request,
+                            as a datetime.timedelta or pandas frequency
+                            string (e.g. '90D'), such as
+                            planner.DEFAULT_TIME_WINDOW. By default the
+                            period is fetched with a single request.
+        :param boxes: optional; (rows, columns) of sub-boxes to divide the
+                      bounds into. Only used for requests by bounds without
+                      res or projection.
+        :param max_workers: optional; number of pieces fetched at once
+        :return: list of xarray Datasets, one for each sub-product
         """
-        try:
-            # Prepare the product metadata
-            get_request_params = {
-                'product': product,
-                'subproduct': [subproduct],
-                'start_date': start,
-                'end_date': stop,
-                'use_dask': use_dask
-                }
-
-            # If a resolution or projection has been provided then warp
-            if res or projection:
-                warp_params = dict()
-                if res: warp_params = {'xRes': res, 'yRes': res}
-                # this next line will add to the dict if 'res' has already
-                # populated it or will make a new entry anyway
-                if projection: warp_params['dstSRS'] = projection
-                get_request_params['warp'] = warp_params
-                get_request_params['warptobounds'] = True
-
-            if country:
-                if tile:
-                    action = 'get_zonal_data'
-                    get_request_params['tile'] = tile
-                    get_request_params["zonal_stats"] = country
-                    # we don't need the DASK option for this method
-                    get_request_params.pop('use_dask', None)
-                else:
-                    # One cannot expect zonal stats without having a tile
-                    # TODO Support bounds for zonal stats in future
-                    raise Exception('A tile must be specified to calculate '
-                                    'zonal statistics.')
-
-            # Add in area information if specified
-            if tile and not country:
-                action = 'get_tile_data'
-                get_request_params['tile'] = tile
-            elif bounds:
-                action = 'get_area_data'
-                get_request_params['north'] = bounds.north
-                get_request_params['south'] = bounds.south
-                get_request_params['east'] = bounds.east
-                get_request_params['west'] = bounds.west
-            elif latlon:
-                action = 'get_position_data'
-                get_request_params['lat'] = latlon[0]
-                get_request_params['lon'] = latlon[1]
-            # else:
-            #     # get global data
-            #     action = 'get_area_data'
-            #     get_request_params['north'] = 90
-            #     get_request_params['south'] = -90
-            #     get_request_params['east'] = 180
-            #     get_request_params['west'] = -180
-
-            # Request data
-            data = self.http_client.get({
-                'command': 'GET_DATA',
-                'action': action,
-                'params': get_request_params})
-
-            return data
-
-        except Exception as e:
-            raise e
-
-    def put_subproduct_data(self, data):
+        def fetch(piece_start, piece_stop, piece_bounds):
+            return self._get(
+                self._subproduct_data_request(product, subproduct,
+                                              piece_start, piece_stop,
+                                              use_dask, piece_bounds, res,
+                                              tile, country, latlon,
+                                              projection),
+                codec=codec)
+
+        # DASK pointers cannot be joined, and sub-boxes of a warp would be
+        # on different grids
+        if use_dask:
+            return fetch(start, stop, bounds)
+        split_area = bounds is not None and not tile and not res \
+            and not projection
+        pieces = plan(start, stop, bounds if split_area else None,
+                      time_window=time_window,
+                      boxes=boxes if split_area else None)
+
+        if len(pieces) == 1 and len(pieces[0][2]) == 1 \
+                and len(pieces[0][2][0]) == 1:
+            return fetch(start, stop, bounds)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [[[pool.submit(fetch, low, high,
+                                     box if box is not None else bounds)
+                         for box in row]
+                        for row in grid]
+                       for low, high, grid in pieces]
+            try:
+                results = [[[future.result() for future in row]
+                            for row in grid]
+                           for grid in futures]
+            except Exception:
+                for grid in futures:
+                    for row in grid:
+                        for future in row:
+                            future.cancel()
+                raise
+
+        return stitch(results)
+
+    def put_subproduct_data(self, data, codec=None):
         """
         Write sub-product data to the datacube
 
         :param data: an xarray DataSet object to be sent to the DataCube
+        :param codec: optional; compression codec to use if the server
+                      accepts it
         :return:
         """
 
@@ -212,7 +551,7 @@ class Connect:
             'action': 'put_data',
             'params': {'overwrite': 'True'}}
 
-        self.http_client.put(put_request, data)
+        self._put(put_request, data, codec=codec)
 
     def get_all_table_data(self, tablename):
         """
@@ -224,16 +563,23 @@ class Connect:
         :return:
         """
 
-        request = {
-            'command': 'GET_META',
-            'action': 'get_table_contents',
-            'params': {'table': tablename}
-        }
-
-        result = self.http_client.get(request)
+        result = self._get(self._table_request(tablename))
 
         return result
 
+    def get_table_if_changed(self, tablename, version=None):
+        """
+        Return everything in a single table, unless the copy held (of the
+        given version) is still current. Not cached.
+
+        :param tablename: The name of the DataCube database table
+        :param version: optional; version stamp of the copy already held
+        :return: (table or None if unchanged, version stamp or None if the
+                 server does not provide one)
+        """
+        return self.http_client.get_if_changed(self._table_request(tablename),
+                                               version)
+
     def register(self, config_dict):
 
         # Check what is attempting to be registered based on
@@ -258,7 +604,7 @@ class Connect:
             'action': 'register_tile_from_dictionary',
             'params': {'spec': config_dict}}
 
-        self.http_client.put(put_request)
+        self._put(put_request)
 
     def register_product(self, config_dict):
         """
@@ -274,9 +620,9 @@ class Connect:
             'action': 'register_product_from_dictionary',
             'params': {'spec': config_dict}}
 
-        self.http_client.put(put_request)
+        self._put(put_request)
 
-    def register_tiles_from_file(self, filepath):
+    def register_tiles_from_file(self, filepath, progress=None):
         """
         Send a tile yaml file to the server for registration. This does the same
         as register_tile() above but the yaml unpacking is done on the server side.
@@ -285,6 +631,8 @@ class Connect:
         the user will require PUT_NEW permission which equates to Permission.REGISTER.
 
         :param filepath: fully qualified name of the tile definition file.
+        :param progress: optional; function called as progress(sent, total)
+                         with the number of bytes sent so far
         :return: N/A
         """
 
@@ -298,9 +646,10 @@ class Connect:
             'source': filepath
         }
 
-        self.http_client.put(put_request)
+        self._put(put_request, progress=progress)
 
-    def put_file_contents(self, product, subproduct, tile, filepath):
+    def put_file_contents(self, product, subproduct, tile, filepath,
+                          progress=None):
         """
         Transfer the contents of a local file and put it into the DataCube.
         The user must have permission to WRITE for this sub-product, and the file
@@ -310,6 +659,10 @@ class Connect:
         :param tile: known tile
         :param filepath: fully qualified location of file on the client. The file's name
                         MUST be in the standard format for the Assimila DataCube.
+        :param progress: optional; function called as progress(sent, total)
+                         with the number of bytes sent so far. The file is
+                         compressed as it is sent, so total is None unless
+                         the server needs to be told the size in advance.
         """
         # Split out the name of the file
         pathname, filename = op.split(filepath)
@@ -324,7 +677,7 @@ class Connect:
                        'filename': filename},
             'source': filepath
         }
-        self.http_client.put(put_request)
+        self._put(put_request, progress=progress)
 
     def put_native_files(self, product, subproduct, tile, filenames, folder=None):
         """
@@ -348,7 +701,7 @@ class Connect:
                        'filenames': filenames,
                        'location': folder},
         }
-        self.http_client.put(put_request)
+        self._put(put_request)
 
     def put_native_folder(self, product, subproduct, tile, folder=None):
         """
@@ -368,4 +721,95 @@ class Connect:
                        'tile': tile,
                        'location': folder},
         }
-        self.http_client.put(put_request)
+        self._put(put_request)
+
+
+class BatchResult:
+    """
+    Placeholder for the result of a query in a MetaBatch, filled in when
+    the batch is sent.
+    """
+
+    def __init__(self, transform=None):
+        self._transform = transform
+        self._done = False
+        self._value = None
+
+    def _set(self, value):
+        if self._transform and not isinstance(value, BatchItemError):
+            value = self._transform(value)
+        self._value = value
+        self._done = True
+
+    @property
+    def error(self):
+        """
+        The BatchItemError if this query failed, otherwise None.
+        """
+        return self._value if isinstance(self._value, BatchItemError) \
+            else None
+
+    def result(self):
+        """
+        :return: the result of the query
+        :raise BatchItemError: if the query failed
+        :raise RuntimeError: if the batch has not been sent yet
+        """
+        if not self._done:
+            raise RuntimeError("The batch has not been sent yet")
+        if self.error is not None:
+            raise self.error
+        return self._value
+
+
+class MetaBatch:
+    """
+    Collects GET_META queries made through the same methods as Connect so
+    they can be sent to the DataCube together. Each method returns a
+    BatchResult which holds the answer once the batch has been sent.
+    """
+
+    def __init__(self, conn):
+        """
+        :param conn: Connect to send the batch through
+        """
+        self.conn = conn
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.send()
+
+    def _add(self, request, transform=None):
+        item = BatchResult(transform)
+        self._pending.append((request, item))
+        return item
+
+    def get_product_subproducts(self, product):
+        return self._add(Connect._product_subproducts_request(product),
+                         Connect._subproduct_names)
+
+    def get_product_meta(self, product):
+        return self._add(Connect._product_meta_request(product))
+
+    def get_subproduct_meta(self, product, subproduct, bounds=None, tile=None):
+        return self._add(Connect._subproduct_meta_request(
+            product, subproduct, bounds=bounds, tile=tile))
+
+    def get_all_table_data(self, tablename):
+        return self._add(Connect._table_request(tablename))
+
+    def send(self):
+        """
+        Send all the queries collected so far.
+        """
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        results = self.conn.get_meta_many([request for request, _ in pending])
+        for (_, item), result in zip(pending, results):
+            item._set(result)
@@ -0,0 +1,192 @@
+"""
+Splitting large GET_DATA requests into pieces fetched in parallel.
+
+A single request is served by one server worker over one connection.
+plan() divides the period of a request into time windows and, for
+requests by bounds, the area into a grid of sub-boxes; Connect fetches
+the pieces concurrently and stitch() joins them back into one Dataset.
+
+Neighbouring pieces share their boundary (the same time or the same
+line of latitude or longitude), and the repeated time steps and pixels
+are dropped when joining, so the result has the same coordinates as a
+single request would. Pixels are matched to within a fraction of the
+pixel spacing, as their coordinates may differ by rounding.
+
+Splitting is opt-in: Connect.get_subproduct_data only divides a request
+when given a time_window or boxes. Areas are only split when the data are returned
+on their native grid: a warp to a new resolution or projection is
+aligned with the requested bounds, so sub-boxes would not line up.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# A sensible time_window for long requests: a year of data per request
+DEFAULT_TIME_WINDOW = datetime.timedelta(days=366)
+
+# Number of pieces fetched at the same time, by default.
+DEFAULT_WORKERS = 4
+
+
+def time_windows(start, stop, window):
+    """
+    Divide start..stop into consecutive windows.
+
+    :param start: start of the period (datetime.datetime)
+    :param stop: end of the period (datetime.datetime)
+    :param window: length of each window: a datetime.timedelta or a pandas
+                   frequency such as '90D' or 'YS'. The period is not
+                   divided if this is None or 0.
+    :return: list of (start, stop); neighbouring windows share their
+             boundary
+    """
+    if not window or not isinstance(start, datetime.datetime) \
+            or not isinstance(stop, datetime.datetime) or start >= stop:
+        return [(start, stop)]
+
+    edges = pd.date_range(start, stop, freq=window).to_pydatetime().tolist()
+    edges = sorted(set([start] + [edge for edge in edges
+                                  if start < edge < stop] + [stop]))
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def sub_boxes(bounds, boxes):
+    """
+    Divide bounds into a grid of rows x columns sub-boxes.
+
+    :param bounds: named tuple of north, south, east and west bounds
+    :param boxes: (rows, columns), or None to leave the area whole
+    :return: list of rows, north first, each a list of bounds, west first;
+             neighbouring boxes share their edges
+    """
+    if not boxes:
+        return [[bounds]]
+
+    rows, columns = boxes
+    lats = np.linspace(bounds.north, bounds.south, rows + 1)
+    lons = np.linspace(bounds.west, bounds.east, columns + 1)
+    return [[bounds._replace(north=float(lats[row]),
+                             south=float(lats[row + 1]),
+                             west=float(lons[column]),
+                             east=float(lons[column + 1]))
+             for column in range(columns)]
+            for row in range(rows)]
+
+
+def plan(start, stop, bounds=None, time_window=None, boxes=None):
+    """
+    The pieces of a request.
+
+    :param start: start of the period
+    :param stop: end of the period
+    :param bounds: optional; bounds of the area, if requested by bounds
+    :param time_window: optional; see time_windows()
+    :param boxes: optional; see sub_boxes(). Ignored without bounds.
+    :return: list of windows, each (start, stop, grid of bounds)
+    """
+    grid = sub_boxes(bounds, boxes) if bounds is not None else [[None]]
+    return [(low, high, grid)
+            for low, high in time_windows(start, stop, time_window)]
+
+
+def _spacing(values):
+    """
+    The smallest distance between neighbouring coordinate values, or None
+    if there are fewer than two.
+    """
+    steps = np.abs(np.diff(np.asarray(values, dtype=float)))
+    steps = steps[steps > 0]
+    return steps.min() if len(steps) else None
+
+
+def join(pieces, dim):
+    """
+    Concatenate Datasets along a spatial dimension, dropping the line of
+    pixels on each shared edge which both neighbours returned.
+
+    Coordinates are compared to within a tenth of the pixel spacing, so
+    pieces whose coordinates differ by rounding still join.
+
+    :param pieces: list of xarray Datasets, in order
+    :param dim: dimension name
+    :return: xarray Dataset
+    :raise ValueError: if neighbouring pieces leave a gap of a pixel or
+                       more between them
+    """
+    pieces = [piece for piece in pieces if piece.sizes.get(dim)]
+    if len(pieces) == 1:
+        return pieces[0]
+
+    # Pieces a pixel wide give no spacing; their edges must match exactly
+    spacings = [_spacing(piece[dim].values) for piece in pieces]
+    spacings = [spacing for spacing in spacings if spacing is not None]
+    step = min(spacings) if spacings else None
+    tolerance = step / 10. if step else 0.
+
+    kept = [pieces[0]]
+    for piece in pieces[1:]:
+        edge = float(kept[-1][dim].values[-1])
+        values = piece[dim].values.astype(float)
+        repeated = 0
+        while repeated < len(values) \
+                and abs(values[repeated] - edge) <= tolerance:
+            repeated += 1
+        if step and repeated < len(values) \
+                and abs(values[repeated] - edge) > step * 1.5:
+            raise ValueError("Pieces do not line up along %s: a gap from "
+                             "%s to %s" % (dim, edge, values[repeated]))
+        if repeated < len(values):
+            kept.append(piece.isel({dim: slice(repeated, None)}))
+
+    return xr.concat(kept, dim=dim, data_vars='minimal', coords='minimal',
+                     compat='override')
+
+
+def join_times(pieces):
+    """
+    Concatenate Datasets along time, in time order, keeping one of each
+    time step.
+
+    :param pieces: list of xarray Datasets
+    :return: xarray Dataset
+    """
+    data = xr.concat(pieces, dim='time', data_vars='minimal',
+                     coords='minimal', compat='override')
+    _, first = np.unique(data['time'].values, return_index=True)
+    return data.isel(time=first)
+
+
+def _spatial_dims(data):
+    """
+    The (y, x) dimensions of gridded data, in the order they appear.
+    """
+    for var in data.data_vars.values():
+        dims = [dim for dim in var.dims if dim != 'time']
+        if len(dims) == 2:
+            return dims
+    raise ValueError("Cannot join areas of data without a 2D grid")
+
+
+def stitch(results):
+    """
+    Join the pieces fetched for a plan.
+
+    :param results: list of windows, each a grid (list of rows) of the
+                    list of Datasets returned for that piece
+    :return: list of Datasets, as returned for a single request
+    """
+    joined = []
+    for index in range(len(results[0][0][0])):
+        windows = []
+        for grid in results:
+            if len(grid) == 1 and len(grid[0]) == 1:
+                windows.append(grid[0][0][index])
+                continue
+            y, x = _spatial_dims(grid[0][0][index])
+            rows = [join([piece[index] for piece in row], x) for row in grid]
+            windows.append(join(rows, y))
+        joined.append(windows[0] if len(windows) == 1
+                      else join_times(windows))
+    return joined
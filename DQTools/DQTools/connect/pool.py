@@ -0,0 +1,155 @@
+"""
+Long-lived, thread-safe http connection pool shared by the DQ client.
+
+A single requests.Session per DataCube server keeps its TCP (and TLS)
+connections alive between calls, so the many small GET_META requests a
+notebook makes do not each pay for a new handshake.
+
+The urllib3 connection pools are wrapped so that every request records
+whether it was sent down an existing connection or had to open a new one.
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Per-thread record of whether the connection handed out for the current
+# request was already open. A request runs entirely on one thread, so
+# this is accurate even when many threads share the pool.
+_conn_state = threading.local()
+
+
+class _TrackingPoolMixin(object):
+    """
+    Note, when a connection is taken from the pool, whether it already
+    has a live socket (i.e. it is being re-used).
+    """
+    def _get_conn(self, timeout=None):
+        conn = super(_TrackingPoolMixin, self)._get_conn(timeout=timeout)
+        _conn_state.reused = getattr(conn, 'sock', None) is not None
+        return conn
+
+
+class _TrackingHTTPConnectionPool(_TrackingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _TrackingHTTPSConnectionPool(_TrackingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _PooledAdapter(HTTPAdapter):
+    """
+    Transport adapter whose pool manager creates tracking connection pools.
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        super(_PooledAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TrackingHTTPConnectionPool,
+            'https': _TrackingHTTPSConnectionPool}
+
+
+class ConnectionPool(object):
+    """
+    Keep-alive http session with a bounded number of connections.
+
+    The session is safe to share between threads: urllib3 hands each
+    concurrent request its own connection and blocks when all pool_size
+    connections are busy. Statistics are updated under a lock.
+    """
+    def __init__(self, pool_size=10, keep_alive=True):
+        """
+        :param pool_size: maximum number of simultaneous connections kept
+                          open to the server.
+        :param keep_alive: if False, ask the server to close the connection
+                           after each request (the pre-pool behaviour).
+        """
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+
+        self.session = requests.Session()
+        adapter = _PooledAdapter(pool_connections=1, pool_maxsize=pool_size,
+                                 pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+        self._lock = threading.Lock()
+        self._totals = {'requests': 0, 'new_connections': 0,
+                        'reused_connections': 0}
+        self._local = threading.local()
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the pooled session.
+
+        :param method: http method, e.g. 'POST'
+        :param url: full url
+        :param kwargs: passed straight to requests.Session.request
+        :return: requests.Response
+        """
+        _conn_state.reused = False
+        started = time.time()
+
+        resp = self.session.request(method, url, **kwargs)
+
+        reused = bool(getattr(_conn_state, 'reused', False))
+        self._local.last = {'method': method,
+                            'url': url,
+                            'status': resp.status_code,
+                            'reused_connection': reused,
+                            'elapsed': time.time() - started}
+
+        with self._lock:
+            self._totals['requests'] += 1
+            if reused:
+                self._totals['reused_connections'] += 1
+            else:
+                self._totals['new_connections'] += 1
+
+        return resp
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def last_request(self):
+        """
+        Connection statistics for the most recent request made by the
+        calling thread.
+
+        :return: dictionary with method, url, status, reused_connection
+                 and elapsed (seconds), or None if no request made yet.
+        """
+        last = getattr(self._local, 'last', None)
+        return dict(last) if last else None
+
+    def stats(self):
+        """
+        Running totals for all requests made through this pool.
+
+        :return: dictionary of requests, new_connections,
+                 reused_connections and reuse_ratio.
+        """
+        with self._lock:
+            totals = dict(self._totals)
+
+        if totals['requests']:
+            totals['reuse_ratio'] = \
+                totals['reused_connections'] / float(totals['requests'])
+        else:
+            totals['reuse_ratio'] = 0.0
+
+        return totals
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+        self.session.close()
@@ -0,0 +1,167 @@
+"""
+File-like adapters used to move DataCube payloads through the http
+client a chunk at a time rather than as single in-memory byte strings.
+"""
+import io
+import pickle
+
+# Default size of the chunks read from, or written to, the socket.
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Approximate uncompressed size of each block of time steps serialised
+# when uploading data a slice at a time.
+DEFAULT_SLICE_BYTES = 64 * 1024 * 1024
+
+
+class IterStream(io.RawIOBase):
+    """
+    Read-only, file-like view over an iterable of byte chunks, such as
+    requests.Response.iter_content(). Allows decoders which expect a file
+    (gzip.GzipFile, pickle.load) to consume a response as it arrives.
+    """
+    def __init__(self, chunks):
+        """
+        :param chunks: iterable yielding bytes
+        """
+        super(IterStream, self).__init__()
+        self._chunks = iter(chunks)
+        self._current = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        """
+        Fill as much of buffer as the current chunk allows.
+
+        :param buffer: writable bytes-like object
+        :return: number of bytes written, 0 at the end of the stream
+        """
+        while not len(self._current):
+            try:
+                self._current = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+
+        size = min(len(buffer), len(self._current))
+        buffer[:size] = self._current[:size]
+        self._current = self._current[size:]
+        return size
+
+
+def open_response(resp, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Wrap a response sent with stream=True as a buffered binary file.
+
+    :param resp: requests.Response
+    :param chunk_size: number of bytes to read from the socket at a time
+    :return: io.BufferedReader
+    """
+    return io.BufferedReader(IterStream(resp.iter_content(chunk_size)),
+                             buffer_size=chunk_size)
+
+
+def time_slices(data, slice_bytes=DEFAULT_SLICE_BYTES, dim='time'):
+    """
+    Split an xarray object into consecutive blocks along its time
+    dimension, each holding roughly slice_bytes of data. Blocks are views
+    of the original, so no data is copied until they are serialised.
+
+    :param data: xarray Dataset or DataArray
+    :param slice_bytes: target uncompressed size of each block
+    :param dim: name of the dimension to split along
+    :return: generator of xarray objects; just data itself if it has no
+             such dimension
+    """
+    if dim not in data.dims or data.sizes[dim] == 0:
+        yield data
+        return
+
+    steps = data.sizes[dim]
+    step_bytes = max(1, data.nbytes // steps)
+    block = max(1, int(slice_bytes // step_bytes))
+
+    for start in range(0, steps, block):
+        yield data.isel({dim: slice(start, start + block)})
+
+
+def pickled_slices(data, slice_bytes=DEFAULT_SLICE_BYTES, dim='time'):
+    """
+    Serialise an xarray object as a sequence of pickles, one per time
+    block. Only one block is pickled at a time.
+
+    :param data: xarray Dataset or DataArray
+    :param slice_bytes: target uncompressed size of each block
+    :param dim: name of the dimension to split along
+    :return: generator of bytes
+    """
+    for block in time_slices(data, slice_bytes, dim):
+        yield pickle.dumps(block, protocol=-1)
+
+
+def read_chunks(fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read a binary file a chunk at a time.
+
+    :param fileobj: binary file-like object
+    :param chunk_size: maximum number of bytes in each chunk
+    :return: generator of bytes
+    """
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def report_progress(chunks, progress, total=None):
+    """
+    Pass byte chunks through unchanged, calling progress(sent, total) as
+    each one is handed on, so the progress of an upload sent as a chunked
+    transfer can be reported.
+
+    :param chunks: iterable yielding bytes-like objects
+    :param progress: function called with the number of bytes passed on
+                     so far and the total expected (None if not known)
+    :param total: total number of bytes, if known
+    :return: generator of bytes-like objects
+    """
+    sent = 0
+    for chunk in chunks:
+        sent += len(chunk)
+        yield chunk
+        progress(sent, total)
+
+
+class ProgressFile(object):
+    """
+    Read-only wrapper around a binary file of known size which reports
+    how much has been read after every read. requests sends the file with
+    a Content-Length and reads it a block at a time, so this reports the
+    progress of the upload.
+    """
+    def __init__(self, fileobj, size, progress):
+        """
+        :param fileobj: binary file-like object positioned at the start of
+                        the data to send
+        :param size: number of bytes to send
+        :param progress: function called with the number of bytes read so
+                         far and size
+        """
+        self._fileobj = fileobj
+        self._size = size
+        self._progress = progress
+        self._sent = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return read_chunks(self, DEFAULT_CHUNK_SIZE)
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        if data:
+            self._sent += len(data)
+            self._progress(self._sent, self._size)
+        return data
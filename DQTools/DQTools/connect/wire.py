@@ -0,0 +1,309 @@
+"""
+Binary array wire format for xarray payloads.
+
+An alternative to pickling xarray objects for GET_DATA and PUT_DATA. The
+payload is a small JSON header describing every variable (dims, dtype,
+shape, attrs) followed by the raw, C-ordered bytes of each variable's
+array in the order listed in the header:
+
+    b'DQA1' | header length (uint64, little endian) | header | buffers
+
+Buffers are written straight from the arrays' memory and read straight
+into newly allocated numpy arrays, so no intermediate copy of the data is
+made on either side, and the payload does not depend on the Python or
+xarray versions of the sender.
+
+Only fixed-size dtypes can be sent. Anything else (object arrays,
+unsupported attribute types) raises WireFormatError so that the caller
+can fall back to pickle.
+"""
+import datetime
+import json
+import struct
+
+import numpy as np
+import xarray as xr
+
+# Name used to negotiate this format with the server
+FORMAT_NAME = 'dqarray'
+
+_MAGIC = b'DQA1'
+_LENGTH = struct.Struct('<Q')
+
+# Variable name used to carry an unnamed DataArray
+_UNNAMED = '__dataarray__'
+
+
+class WireFormatError(Exception):
+    """
+    The object cannot be represented in, or read from, the wire format.
+    """
+    pass
+
+
+def _encode_attr(value):
+    """
+    JSON encoder hook for attribute values that json cannot handle itself.
+    Types that need to survive the round trip are tagged.
+    """
+    if isinstance(value, np.datetime64):
+        return {'__dq__': 'datetime64', 'value': str(value)}
+    if isinstance(value, datetime.datetime):
+        return {'__dq__': 'datetime', 'value': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__dq__': 'date', 'value': value.isoformat()}
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+        return {'__dq__': 'ndarray', 'dtype': value.dtype.str,
+                'value': value.tolist()}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise WireFormatError("Attribute of type %s cannot be sent in the %s "
+                          "format" % (type(value).__name__, FORMAT_NAME))
+
+
+def _decode_attr(obj):
+    """
+    JSON decoder hook reversing _encode_attr().
+    """
+    tag = obj.get('__dq__')
+    if tag is None:
+        return obj
+    if tag == 'datetime64':
+        return np.datetime64(obj['value'])
+    if tag == 'datetime':
+        return datetime.datetime.fromisoformat(obj['value'])
+    if tag == 'date':
+        return datetime.date.fromisoformat(obj['value'])
+    if tag == 'ndarray':
+        return np.array(obj['value'], dtype=obj['dtype'])
+    raise WireFormatError("Unknown attribute tag %s" % tag)
+
+
+def dumps_attrs(attrs):
+    """
+    Encode a dictionary of xarray attributes as JSON, tagging the types
+    JSON has no representation for.
+
+    :param attrs: dictionary
+    :return: str
+    :raise WireFormatError: if an attribute cannot be represented
+    """
+    try:
+        return json.dumps(attrs, default=_encode_attr)
+    except (TypeError, ValueError) as e:
+        raise WireFormatError(str(e))
+
+
+def loads_attrs(text):
+    """
+    Decode attributes encoded by dumps_attrs().
+
+    :param text: str
+    :return: dictionary
+    """
+    return json.loads(text, object_hook=_decode_attr)
+
+
+def _describe_dataset(ds):
+    """
+    Build the header entry for one xarray Dataset and list the arrays to
+    send after the header.
+
+    :return: (header dict, list of contiguous numpy arrays)
+    """
+    variables = []
+    buffers = []
+    for name, var in ds.variables.items():
+        values = np.ascontiguousarray(var.values)
+        if values.dtype.hasobject:
+            raise WireFormatError("Variable %s has object dtype" % name)
+
+        variables.append({'name': name,
+                          'coord': name in ds.coords,
+                          'dims': list(var.dims),
+                          'dtype': values.dtype.str,
+                          'shape': list(values.shape),
+                          'attrs': dict(var.attrs)})
+        buffers.append(values)
+
+    return {'attrs': dict(ds.attrs), 'variables': variables}, buffers
+
+
+def _describe(obj):
+    """
+    Build the full header and buffer list for an xarray Dataset, DataArray
+    or list of Datasets (as returned for GET_DATA).
+    """
+    if isinstance(obj, (list, tuple)):
+        kind = 'list'
+        datasets = list(obj)
+    elif isinstance(obj, xr.DataArray):
+        kind = 'dataarray'
+        try:
+            datasets = [obj.to_dataset(name=_UNNAMED if obj.name is None
+                                       else obj.name)]
+        except ValueError as e:
+            # e.g. named the same as one of its coordinates
+            raise WireFormatError(str(e))
+    elif isinstance(obj, xr.Dataset):
+        kind = 'dataset'
+        datasets = [obj]
+    else:
+        raise WireFormatError("Cannot send %s in the %s format"
+                              % (type(obj).__name__, FORMAT_NAME))
+
+    entries = []
+    buffers = []
+    for ds in datasets:
+        if not isinstance(ds, xr.Dataset):
+            raise WireFormatError("Cannot send %s in the %s format"
+                                  % (type(ds).__name__, FORMAT_NAME))
+        entry, arrays = _describe_dataset(ds)
+        entries.append(entry)
+        buffers.extend(arrays)
+
+    header = {'kind': kind, 'datasets': entries}
+    try:
+        header_bytes = json.dumps(header, default=_encode_attr).encode('utf-8')
+    except (TypeError, ValueError) as e:
+        raise WireFormatError(str(e))
+
+    return header_bytes, buffers
+
+
+def _iter_chunks(header_bytes, buffers, chunk_size):
+    yield _MAGIC + _LENGTH.pack(len(header_bytes)) + header_bytes
+    for values in buffers:
+        raw = memoryview(values.reshape(-1).view(np.uint8))
+        for start in range(0, len(raw), chunk_size):
+            yield raw[start:start + chunk_size]
+
+
+def dump_chunks(obj, chunk_size=1024 * 1024):
+    """
+    Encode an xarray object as a sequence of byte chunks. The chunks are
+    memoryviews onto the arrays themselves, so nothing is copied here.
+
+    The object is checked before this function returns, so an object
+    which cannot be encoded raises WireFormatError straight away rather
+    than part way through a transfer.
+
+    :param obj: xarray Dataset, DataArray or list of Datasets
+    :param chunk_size: maximum number of bytes in each chunk
+    :return: generator of bytes-like objects
+    :raise WireFormatError: if obj cannot be represented
+    """
+    header_bytes, buffers = _describe(obj)
+    return _iter_chunks(header_bytes, buffers, chunk_size)
+
+
+def dumps(obj):
+    """
+    Encode an xarray object as a single bytes string.
+
+    :param obj: xarray Dataset, DataArray or list of Datasets
+    :return: bytes
+    """
+    return b''.join(bytes(chunk) for chunk in dump_chunks(obj))
+
+
+def _read_exactly(fileobj, size):
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise WireFormatError("Unexpected end of %s payload" % FORMAT_NAME)
+    return data
+
+
+def _readinto_exactly(fileobj, buffer):
+    view = memoryview(buffer)
+    while len(view):
+        count = fileobj.readinto(view)
+        if not count:
+            raise WireFormatError("Unexpected end of %s payload"
+                                  % FORMAT_NAME)
+        view = view[count:]
+
+
+def _read_header(read):
+    if bytes(read(len(_MAGIC))) != _MAGIC:
+        raise WireFormatError("Payload is not in the %s format" % FORMAT_NAME)
+    length, = _LENGTH.unpack(read(_LENGTH.size))
+    return json.loads(bytes(read(length)).decode('utf-8'),
+                      object_hook=_decode_attr)
+
+
+def _build(header, arrays):
+    """
+    Re-assemble the xarray object(s) from the header and decoded arrays.
+    """
+    arrays = iter(arrays)
+    datasets = []
+    for entry in header['datasets']:
+        coords = {}
+        data_vars = {}
+        for var in entry['variables']:
+            target = coords if var['coord'] else data_vars
+            target[var['name']] = (var['dims'], next(arrays), var['attrs'])
+        datasets.append(xr.Dataset(data_vars=data_vars, coords=coords,
+                                   attrs=entry['attrs']))
+
+    if header['kind'] == 'list':
+        return datasets
+    if header['kind'] == 'dataarray':
+        array = datasets[0][list(datasets[0].data_vars)[0]]
+        return array.rename(None) if array.name == _UNNAMED else array
+    return datasets[0]
+
+
+def load(fileobj):
+    """
+    Decode an xarray object from a binary file, reading each variable
+    directly into a newly allocated numpy array.
+
+    :param fileobj: binary file-like object supporting read and readinto
+    :return: xarray Dataset, DataArray or list of Datasets
+    """
+    header = _read_header(lambda size: _read_exactly(fileobj, size))
+
+    arrays = []
+    for entry in header['datasets']:
+        for var in entry['variables']:
+            values = np.empty(var['shape'], dtype=np.dtype(var['dtype']))
+            _readinto_exactly(fileobj, values.reshape(-1).view(np.uint8))
+            arrays.append(values)
+
+    return _build(header, arrays)
+
+
+def loads(buffer):
+    """
+    Decode an xarray object from an in-memory payload. The arrays are
+    created with numpy.frombuffer and so share memory with the buffer;
+    they are writable only if the buffer is (e.g. a bytearray).
+
+    :param buffer: bytes-like object
+    :return: xarray Dataset, DataArray or list of Datasets
+    """
+    view = memoryview(buffer)
+    position = [0]
+
+    def read(size):
+        start = position[0]
+        if start + size > len(view):
+            raise WireFormatError("Unexpected end of %s payload"
+                                  % FORMAT_NAME)
+        position[0] = start + size
+        return view[start:start + size]
+
+    header = _read_header(read)
+
+    arrays = []
+    for entry in header['datasets']:
+        for var in entry['variables']:
+            dtype = np.dtype(var['dtype'])
+            count = int(np.prod(var['shape'], dtype=np.int64))
+            raw = read(count * dtype.itemsize)
+            arrays.append(np.frombuffer(raw, dtype=dtype,
+                                        count=count).reshape(var['shape']))
+
+    return _build(header, arrays)
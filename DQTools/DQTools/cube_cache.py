@@ -0,0 +1,525 @@
+"""
+Local read-through cache of the data returned by Dataset.get_data.
+
+Each cached cube is a chunked, compressed netCDF file. A cache hit reads
+only the time steps asked for, loads them into memory and closes the
+file again, so cubes can be evicted while their data are still in use.
+An SQLite index records each entry's size, when it was last used and the
+sub-product's last_gold and last_timestep when it was fetched. An entry
+is stale, and fetched again, once either of those has moved on. When the
+cache grows past its size budget the least recently used entries are
+deleted.
+
+Cubes are also indexed by the time range they cover, for each request
+made with the same product, sub-product, area and options. A request
+for a longer period then only fetches the time ranges which are not
+already cached, and the pieces are joined along time and stored as one
+cube. Data up to the sub-product's last gold are final, so that part of
+a cube is still used after new data arrive.
+
+The cache is opt-in: pass cube_cache=True (or a CubeCache) to Dataset.
+Files are kept in ~/.dqtools/cubes unless DQTOOLS_CUBE_CACHE names
+another folder.
+
+Compression needs the netCDF4 package; without it cubes are stored
+uncompressed using scipy.
+"""
+import hashlib
+import logging
+import os
+import os.path as op
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import xarray as xr
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+try:
+    import dask
+except ImportError:
+    dask = None
+
+from .connect.connect import _canonical
+from .connect.planner import join_times
+from .connect import wire
+
+CUBE_CACHE_ENV = 'DQTOOLS_CUBE_CACHE'
+DEFAULT_PATH = op.join(op.expanduser('~'), '.dqtools', 'cubes')
+
+# Size budget for all cached cubes, in bytes
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# Approximate uncompressed size of each chunk of a cached variable
+CHUNK_BYTES = 4 * 1024 ** 2
+
+# Attribute holding the original attributes, which netCDF cannot always
+# store as they are (None, dates, nested values)
+_ATTRS = '_dq_attrs'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cube (
+    key TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    tag TEXT,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cube_last_used ON cube (last_used);
+CREATE TABLE IF NOT EXISTS span (
+    key TEXT PRIMARY KEY,
+    series TEXT NOT NULL,
+    start TEXT NOT NULL,
+    stop TEXT NOT NULL,
+    final TEXT
+);
+CREATE INDEX IF NOT EXISTS span_series ON span (series);
+"""
+
+
+def cache_key(server, request):
+    """
+    Key identifying a data request.
+
+    :param server: server address and login, so that servers and users
+                   with different data do not share entries
+    :param request: dictionary of request parameters
+    :return: str
+    """
+    return hashlib.sha256(
+        repr((server, _canonical(request))).encode('utf-8')).hexdigest()
+
+
+def _as_datetime(value):
+    """
+    Convert a time to a naive datetime.datetime, or None if it is not one.
+    """
+    if value is None:
+        return None
+    try:
+        value = pd.Timestamp(value)
+    except (ValueError, TypeError):
+        return None
+    if value is pd.NaT:
+        return None
+    if value.tzinfo is not None:
+        value = value.tz_convert(None)
+    return value.to_pydatetime()
+
+
+def missing_ranges(covered, start, stop):
+    """
+    The parts of start..stop which are not covered.
+
+    Ranges include both ends. A missing range starts and ends at the
+    neighbouring covered times, so fetching it may return the time steps
+    at its ends again.
+
+    :param covered: list of (start, stop) ranges, in any order
+    :param start: start of the range wanted
+    :param stop: end of the range wanted
+    :return: list of (start, stop) ranges, in time order
+    """
+    missing = []
+    position, reached = start, False
+    for low, high in merge_ranges(covered):
+        if high < start:
+            continue
+        if low > stop:
+            break
+        if low > position:
+            missing.append((position, low))
+        position, reached = max(position, high), True
+    if not reached or position < stop:
+        missing.append((position, stop))
+    return missing
+
+
+def merge_ranges(ranges):
+    """
+    Join overlapping and adjacent ranges.
+
+    :param ranges: list of (start, stop) ranges, in any order
+    :return: list of disjoint (start, stop) ranges, in time order
+    """
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def _loaded(data, **selection):
+    """
+    Load (part of) a lazily opened cube into memory and close its file.
+    """
+    try:
+        return data.sel(**selection).load()
+    finally:
+        data.close()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # e.g. still open on Windows; it will be tidied when next evicted
+        pass
+
+
+class CubeCache(object):
+    """
+    Size-bounded, least recently used cache of xarray Datasets on disk,
+    safe to share between threads and processes.
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, path=None):
+        """
+        The cache in a folder, created on first use and shared within the
+        process.
+
+        :param path: optional; cache folder, see module documentation
+        :return: CubeCache
+        """
+        path = path or os.environ.get(CUBE_CACHE_ENV) or DEFAULT_PATH
+        with cls._shared_lock:
+            cache = cls._shared.get(path)
+            if cache is None:
+                cache = cls._shared[path] = cls(path)
+        return cache
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param path: folder for the cached cubes and their index
+        :param max_bytes: size budget for all cached cubes
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger("__main__")
+
+        if not op.isdir(path):
+            os.makedirs(path)
+
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(op.join(self.path, 'index.sqlite'), timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def get(self, key, tag=None):
+        """
+        Read a cached cube.
+
+        :param key: from cache_key()
+        :param tag: what the data depend on besides the request (e.g. the
+                    sub-product's last_gold and last_timestep). An entry
+                    stored with a different tag is stale and is removed.
+        :return: xarray Dataset, or None if not cached
+        """
+        data = self._open_entry(key, None if tag is None else repr(tag))
+        self._count(data is not None)
+        return None if data is None else _loaded(data)
+
+    def _open_entry(self, key, tag):
+        """
+        get(), with the tag as stored and without counting or loading.
+        The caller closes the cube.
+        """
+        with self._db() as db:
+            row = db.execute("SELECT filename, tag FROM cube WHERE key = ?",
+                             (key,)).fetchone()
+            if row is not None:
+                filename = op.join(self.path, row[0])
+                if row[1] != tag or not op.exists(filename):
+                    self._forget(db, [key])
+                    _remove(filename)
+                    row = None
+                else:
+                    db.execute("UPDATE cube SET last_used = ? WHERE key = ?",
+                               (time.time(), key))
+
+        if row is None:
+            return None
+
+        try:
+            return self._open(filename)
+        except (OSError, ValueError) as e:
+            self.logger.warning("Unable to read cached cube %s.\n%s"
+                                % (filename, e))
+            self.discard(key)
+            return None
+
+    def put(self, key, data, tag=None):
+        """
+        Store a cube, then evict the least recently used cubes if over the
+        size budget. Cubes which cannot be written are logged and skipped.
+
+        :param key: from cache_key()
+        :param data: xarray Dataset
+        :param tag: see get()
+        """
+        self._store(key, data, None if tag is None else repr(tag))
+
+    def _store(self, key, data, tag, span=None):
+        """
+        put(), with the tag as stored.
+
+        :param span: optional; (series, start, stop, final) to index the
+                     cube by
+        :return: True if the cube was stored
+        """
+        filename = key + '.nc'
+        handle, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        os.close(handle)
+        try:
+            self._write(data, tmp)
+            size = op.getsize(tmp)
+            if size > self.max_bytes:
+                _remove(tmp)
+                return False
+            os.replace(tmp, op.join(self.path, filename))
+        except Exception as e:
+            self.logger.warning("Unable to cache cube.\n%s" % e)
+            _remove(tmp)
+            return False
+
+        now = time.time()
+        with self._db() as db:
+            self._forget(db, [key])
+            db.execute("INSERT INTO cube (key, filename, size, tag, created, "
+                       "last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                       (key, filename, size, tag, now, now))
+            if span is not None:
+                db.execute("INSERT INTO span (key, series, start, stop, "
+                           "final) VALUES (?, ?, ?, ?, ?)",
+                           (key,) + tuple(None if value is None else str(value)
+                                          for value in span))
+        self._evict()
+        return True
+
+    def get_range(self, series, start, stop, fetch, tag=None, final=None):
+        """
+        Data for a period, fetching only the time ranges which are not
+        already cached. Cached cubes which overlap or touch the period are
+        joined with the new data and stored as one cube.
+
+        :param series: from cache_key(), for the request without its dates
+        :param start: start of the period (datetime.datetime)
+        :param stop: end of the period (datetime.datetime)
+        :param fetch: function (start, stop) returning an xarray Dataset of
+                      that period from the DataCube
+        :param tag: see get(). Cubes stored with a different tag are only
+                    used up to the final time given when they were stored.
+        :param final: optional; time up to which the data will not change,
+                      e.g. the sub-product's last gold
+        :return: xarray Dataset
+        """
+        spans = [span for span in self._spans(series, tag)
+                 if span[1] <= stop and span[2] >= start]
+        missing = missing_ranges([span[1:3] for span in spans], start, stop)
+
+        if len(spans) == 1 and not missing:
+            data = self._open_entry(spans[0][0], spans[0][3])
+            if data is not None:
+                self._count(True)
+                return _loaded(data, time=slice(start, stop))
+        self._count(False)
+
+        # The cached cubes are read lazily, so are only closed once the
+        # joined data have been stored or loaded
+        opened, pieces = [], []
+        try:
+            for key, low, high, stored_tag in spans:
+                cached = self._open_entry(key, stored_tag)
+                if cached is None:
+                    # removed since we looked; fetch its range instead
+                    missing.append((low, high))
+                else:
+                    opened.append(cached)
+                    pieces.append(cached.sel(time=slice(low, high)))
+
+            for low, high in merge_ranges(missing):
+                pieces.append(fetch(low, high))
+
+            if any('time' not in piece.dims for piece in pieces):
+                # a single value rather than a time series; nothing to join
+                return pieces[-1].load()
+            joined = join_times(pieces)
+
+            low = min([start] + [span[1] for span in spans])
+            high = max([stop] + [span[2] for span in spans])
+            key = cache_key(series, (low, high))
+            span = (series, low, high, _as_datetime(final))
+            if not self._store(key, joined,
+                               None if tag is None else repr(tag), span):
+                return joined.sel(time=slice(start, stop)).load()
+        finally:
+            for cached in opened:
+                cached.close()
+
+        for span in spans:
+            if span[0] != key:
+                self.discard(span[0])
+
+        return _loaded(self._open(op.join(self.path, key + '.nc')),
+                       time=slice(start, stop))
+
+    def _spans(self, series, tag):
+        """
+        The cached cubes of a series, with the time range of each which can
+        still be used.
+
+        :return: list of (key, start, stop, tag as stored), in time order
+        """
+        tag = None if tag is None else repr(tag)
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT span.key, span.start, span.stop, span.final, cube.tag "
+                "FROM span JOIN cube ON cube.key = span.key "
+                "WHERE span.series = ? ORDER BY span.start",
+                (series,)).fetchall()
+
+        spans = []
+        for key, low, high, final, stored_tag in rows:
+            low = _as_datetime(low)
+            high = _as_datetime(high)
+            if stored_tag != tag:
+                # only the data which were final then are still current
+                final = _as_datetime(final)
+                if final is None or final < low:
+                    continue
+                high = min(high, final)
+            spans.append((key, low, high, stored_tag))
+        return spans
+
+    def discard(self, key):
+        """
+        Remove one cached cube.
+        """
+        with self._db() as db:
+            row = db.execute("SELECT filename FROM cube WHERE key = ?",
+                             (key,)).fetchone()
+            self._forget(db, [key])
+        if row is not None:
+            _remove(op.join(self.path, row[0]))
+
+    def clear(self):
+        """
+        Remove all cached cubes.
+        """
+        with self._db() as db:
+            rows = db.execute("SELECT filename FROM cube").fetchall()
+            db.execute("DELETE FROM cube")
+            db.execute("DELETE FROM span")
+        for row in rows:
+            _remove(op.join(self.path, row[0]))
+
+    def stats(self):
+        """
+        :return: dictionary of hits and misses in this process, and the
+                 number of entries and bytes in the cache
+        """
+        with self._db() as db:
+            entries, size = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cube").fetchone()
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses,
+                    'entries': entries, 'bytes': size}
+
+    @staticmethod
+    def _forget(db, keys):
+        """
+        Remove index entries, leaving their files to the caller.
+        """
+        db.executemany("DELETE FROM cube WHERE key = ?",
+                       [(key,) for key in keys])
+        db.executemany("DELETE FROM span WHERE key = ?",
+                       [(key,) for key in keys])
+
+    def _evict(self):
+        with self._db() as db:
+            rows = db.execute("SELECT key, filename, size FROM cube "
+                              "ORDER BY last_used DESC").fetchall()
+            total = 0
+            evicted = []
+            for key, filename, size in rows:
+                total += size
+                if total > self.max_bytes:
+                    evicted.append((key, filename))
+            self._forget(db, [key for key, _ in evicted])
+
+        for key, filename in evicted:
+            _remove(op.join(self.path, filename))
+
+    @staticmethod
+    def _write(data, filename):
+        """
+        Write a Dataset as netCDF, compressed and chunked along time if
+        netCDF4 is available.
+        """
+        out = data.copy()
+        out.attrs = {_ATTRS: wire.dumps_attrs(data.attrs)}
+        for name, var in out.variables.items():
+            var.attrs = {_ATTRS: wire.dumps_attrs(data[name].attrs)}
+            var.encoding = {}
+
+        if netCDF4 is None:
+            out.to_netcdf(filename, engine='scipy')
+            return
+
+        encoding = {}
+        for name, var in out.data_vars.items():
+            if var.dtype.kind not in 'biuf' or not var.ndim:
+                continue
+            chunks = list(var.shape)
+            if 'time' in var.dims and var.nbytes:
+                axis = var.dims.index('time')
+                step_bytes = max(1, var.nbytes // max(1, var.shape[axis]))
+                chunks[axis] = max(1, min(var.shape[axis],
+                                          CHUNK_BYTES // step_bytes))
+            encoding[name] = {'zlib': True, 'complevel': 4,
+                              'chunksizes': tuple(max(1, c) for c in chunks)}
+
+        out.to_netcdf(filename, engine='netcdf4', encoding=encoding)
+
+    @staticmethod
+    def _open(filename):
+        """
+        Open a cached cube lazily, as dask arrays if dask is installed.
+        """
+        data = xr.open_dataset(filename, chunks={} if dask else None)
+        data.attrs = wire.loads_attrs(data.attrs.get(_ATTRS, '{}'))
+        for var in data.variables.values():
+            var.attrs = wire.loads_attrs(var.attrs.get(_ATTRS, '{}'))
+        return data
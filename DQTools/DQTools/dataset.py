@@ -9,65 +9,34 @@ import sys
 from .check_datetime import Datetime_checker
 
 from .connect.connect import Connect
+from .cube_cache import CubeCache, cache_key
+from .lazy import grid_centre, lazy_dataset
+from .points import covering_bounds, extract_points
+from .zonal import zonal_stats, zone_bounds
+from .availability import AvailabilityIndex, YEARLY_COMPOSITES, \
+    ideal_timesteps, time_offset
 from .regions import get_bounds
 from .connect.log.setup_logger import SetUpLogger
 
+# Ideal time steps searched for the first with data when a lazy request
+# needs its grid
+TEMPLATE_TRIES = 10
 
-class Dataset:
+
+class BaseDataset:
     """
-    This is the representation of a DataCube Dataset in the DQTools library.
+    The read-only parts of a DataCube Dataset: its metadata, the
+    preparation of data requests and working with the data fetched.
+    Dataset adds the blocking requests and writing to the datacube;
+    AsyncDataset fetches with coroutines and cannot write.
     """
 
-    def __init__(self, product, subproduct, region=None, tile=None, res=None,
-                 identfile=None, sysfile=None):
+    def _set_attributes(self, product, subproduct, region, tile, res,
+                        identfile):
         """
-        Connect to the datacube and extract metadata for this particular
-        product/sub-product.
-
-        Attributes passed from the caller are recorded in self:
-        self.product: name of the product
-        self.subproduct: name of sub-product
-        self.region [optional]: name of region required
-        self.tile [optional]: name of tile required
-
-
-        NOTE: If a region/tile is defined, then metadata pertains only to
-        that region or tile. If no region/tile is defined then metadata is
-        returned for the entire sub-product extent.
-
-        Empty attributes created for
-        - self.data: The xarray DataSet
-        - self.timesteps: The timesteps of data available
-
-        :param product: product name (str)
-
-        :param subproduct: sub-product name (str)
-
-        :param region [optional]: the name of a region for data/metadata,
-                                  as defined in the regions directory
-                                  (NOTE: writing data for regions
-                                  is not possible, unless the bounds
-                                  exactly match a tile... in which case
-                                  just use tile to define our spatial
-                                  extent!)
-
-        :param tile [optional]: the tile to extract data/metadata for
-                                (must match datacube record)
-
-        :param res [optional]: the resolution of the output data
-                               required. This will ultimately enact a
-                               GDAL Warp inside the datacube to give
-                               you the required resolution within the
-                               bounds defined in either tile or region.
-
-        :param identfile: Assimila DQ credentials file required to access the
-                         HTTP server. Allows the file to be in a different
-                         location as used by the QGIS Plugin.
-
-        :param sysfile: location of the deployed system's yaml file. Required
-                        for DASK use.
+        Record the arguments given on creation and create empty attributes
+        for the metadata and data.
         """
-
         # write product & sub-product as attributes
         self.product = product
         self.subproduct = subproduct
@@ -112,44 +81,26 @@ class Dataset:
         self.logger.info("Dataset created with: product %s, subproduct %s,"
                          "region %s, tile %s, resolution %s,  credentials file %s"
                          % (product, subproduct, region, tile, res, identfile))
+
+    def _region_bounds(self):
+        """
+        Bounds of the region given on creation, as a dictionary of n-s-e-w
+        bounds, or None if no region was given.
+        """
         try:
             # Extract the bounds for this region, if provided
             if self.region:
-                bounds = get_bounds(self.region)._asdict()
+                return get_bounds(self.region)._asdict()
             else:
-                bounds = None
+                return None
 
         except RuntimeError as e:
             self.logger.error("Failed to initialise Dataset regions.\n"
                               "%s" % e)
-            print("Failed to initialise Dataset regions, "
-                  "please see logfile for details.")
+            self._report("Failed to initialise Dataset regions, "
+                         "please see logfile for details.")
             sys.exit(1)
 
-        try:
-            # Instantiate the datacube connector
-            self.conn = Connect(identfile=identfile, sysfile=sysfile)
-
-            # Download metadata for this product & sub-product & tile
-            result = self.conn.get_subproduct_meta(product=self.product,
-                                                   subproduct=self.subproduct,
-                                                   bounds=bounds,
-                                                   tile=tile)
-
-            # Extract relevant metadata as attributes.
-            self._extract_metadata(result)
-
-            # self.logger.info(f"Dataset created and metadata available for "
-            #                  f"{self.product} : {self.subproduct}")
-            self.logger.info("Dataset created and metadata available for %s %s"
-                             % (self.product, self.subproduct))
-
-        except Exception as e:
-            self.logger.error("Failed to retrieve Dataset metadata.\n"
-                              "%s" % e)
-            print("Failed to retrieve Dataset metadata, "
-                  "please see logfile for details.")
-
     def __repr__(self):
         """
         User-friendly representation of the dataset object
@@ -216,7 +167,7 @@ Data:
         except Exception as e:
             self.logger.error("Error displaying Dataset metadata.\n"
                               "%s" % e)
-            print("Error displaying Dataset's metadata.")
+            self._report("Error displaying Dataset's metadata.")
 
     def _extract_metadata(self, all_meta):
         """
@@ -250,10 +201,270 @@ Data:
         self.all_subproduct_tiles = all_meta['all_subproduct_tiles']
         self.description = all_meta['description']
 
+    def extract_points(self, points):
+        """
+        Extract the time series of point locations from the data already
+        in self.data, using the nearest pixel to each point.
+
+        :param points:  see get_points()
+
+        :return: xarray with point and time dimensions
+        """
+        return extract_points(self.data, points)
+
+    def zonal_stats(self, zones, stats=('mean',), percentiles=None,
+                    name_field=None):
+        """
+        Statistics of the data already in self.data within each zone.
+        The zones are rasterized on the data's grid once and kept for
+        further use.
+
+        :param zones:   see get_zonal_stats()
+
+        :param stats:   optional - see get_zonal_stats()
+
+        :param percentiles: optional - see get_zonal_stats()
+
+        :param name_field: optional - see get_zonal_stats()
+
+        :return: xarray with zone, time and stat dimensions
+        """
+        return zonal_stats(self.data, zones, stats, percentiles, name_field)
+
+    @staticmethod
+    def _merge_subproducts(data):
+        """
+        Combine the Datasets returned for each sub-product requested into
+        one, keeping the attributes of the first.
+
+        :param data: list of xarray Datasets from get_subproduct_data()
+        :return: xarray Dataset
+        """
+        merged = data[0]
+        for other in data[1:]:
+            merged = merged.merge(other)
+        return merged
+
+    def _prepare_request(self, start, stop, use_dask, region, tile, res,
+                         latlon, country, projection, subproducts=None):
+        """
+        Fill in the region, tile and resolution given on creation and
+        check the dates, giving the arguments for
+        Connect.get_subproduct_data().
+
+        :return: dictionary of keyword arguments
+        """
+        # Extract the bounds information
+        if region:
+            bounds = get_bounds(region)
+        elif self.region:
+            bounds = get_bounds(self.region)
+        else:
+            bounds = None
+
+        # Extract tile info
+        if not tile and self.tile:
+            tile = self.tile
+
+        # Extract res info
+        if not res and self.res:
+            res = self.res
+
+        new_start = Datetime_checker(time=start)
+        start = new_start.c_and_c()
+        new_stop = Datetime_checker(time=stop)
+        stop = new_stop.c_and_c()
+
+        # Ask for any other sub-products in the same request
+        subproduct = self.subproduct
+        if subproducts:
+            subproduct = [self.subproduct] + [name for name in subproducts
+                                              if name != self.subproduct]
+
+        return {'product': self.product,
+                'subproduct': subproduct,
+                'start': start,
+                'stop': stop,
+                'use_dask': use_dask,
+                'bounds': bounds,
+                'res': res,
+                'tile': tile,
+                'country': country,
+                'latlon': latlon,
+                'projection': projection}
+
+    def _report(self, message):
+        """
+        Tell the user about a failure, already logged.
+        """
+        if self.messages is None:
+            print(message)
+        else:
+            self.messages.append(message)
+
+    def _data_error(self, e, use_dask):
+        """
+        Report a failure to retrieve data.
+        """
+        if not use_dask:
+            self.logger.error("Failed to retrieve Dataset sub-product data.\n"
+                              "%s" % e)
+            self._report("Failed to retrieve Dataset sub-product data, "
+                         "please see logfile for details.")
+        else:
+            self.logger.error("Failed to retrieve Dataset sub-product DASK "
+                              "pointer.\n%s" % e)
+            self._report("Failed to retrieve Dataset sub-product DASK "
+                         "pointer, please see logfile for details.")
+
+    def calculate_timesteps(self):
+        """
+        Calculate the time steps available, given the time_resolution of the
+        dataset (as recorded in the sub-product table) and the first and
+        last time steps.
+
+        NOTE: This method calculates ideal timesteps, rather than
+        retrieving the actual timesteps of the data. This method cannot
+        know about any data gaps.
+
+        :return:
+        """
+
+        try:
+            # Generate an array, using the time resolution as the step
+            if self.first_timestep:
+                timesteps = pd.date_range(self.first_timestep,
+                                          self.last_timestep,
+                                          freq=self._time_offset())
+
+                self.timesteps = timesteps.values
+
+            else:
+                self.timesteps = None
+
+        except Exception as e:
+            self.logger.error("Unable to calculate timesteps.\n"
+                              "%s" % e)
+            raise RuntimeError("Unable to calculate timesteps.")
+
+    def _time_offset(self):
+        """
+        The time_resolution of the dataset as a pandas DateOffset.
+        """
+        return time_offset(self.time_resolution)
+
+
+class Dataset(BaseDataset):
+    """
+    This is the representation of a DataCube Dataset in the DQTools library.
+    """
+
+    def __init__(self, product, subproduct, region=None, tile=None, res=None,
+                 identfile=None, sysfile=None, cube_cache=None,
+                 messages=None):
+        """
+        Connect to the datacube and extract metadata for this particular
+        product/sub-product.
+
+        Attributes passed from the caller are recorded in self:
+        self.product: name of the product
+        self.subproduct: name of sub-product
+        self.region [optional]: name of region required
+        self.tile [optional]: name of tile required
+
+
+        NOTE: If a region/tile is defined, then metadata pertains only to
+        that region or tile. If no region/tile is defined then metadata is
+        returned for the entire sub-product extent.
+
+        Empty attributes created for
+        - self.data: The xarray DataSet
+        - self.timesteps: The timesteps of data available
+
+        :param product: product name (str)
+
+        :param subproduct: sub-product name (str)
+
+        :param region [optional]: the name of a region for data/metadata,
+                                  as defined in the regions directory
+                                  (NOTE: writing data for regions
+                                  is not possible, unless the bounds
+                                  exactly match a tile... in which case
+                                  just use tile to define our spatial
+                                  extent!)
+
+        :param tile [optional]: the tile to extract data/metadata for
+                                (must match datacube record)
+
+        :param res [optional]: the resolution of the output data
+                               required. This will ultimately enact a
+                               GDAL Warp inside the datacube to give
+                               you the required resolution within the
+                               bounds defined in either tile or region.
+
+        :param identfile: Assimila DQ credentials file required to access the
+                         HTTP server. Allows the file to be in a different
+                         location as used by the QGIS Plugin.
+
+        :param sysfile: location of the deployed system's yaml file. Required
+                        for DASK use.
+
+        :param cube_cache: optional; keep the results of get_data in a
+                           local on-disk cache, so later requests for the
+                           same area only fetch the time steps which are
+                           not cached, or which may have changed since the
+                           last gold. True for the default cache (see
+                           DQTools.cube_cache) or a CubeCache.
+
+        :param messages: optional; list to add failure messages to rather
+                         than printing them, for a Dataset used in a worker
+                         thread whose caller prints them later
+        """
+
+        self._set_attributes(product, subproduct, region, tile, res,
+                             identfile)
+        self.messages = messages
+        self.cube_cache = CubeCache.shared() if cube_cache is True \
+            else cube_cache
+
+        try:
+            # Instantiate the datacube connector
+            self.conn = Connect(identfile=identfile, sysfile=sysfile)
+
+            self._load_metadata()
+
+            # self.logger.info(f"Dataset created and metadata available for "
+            #                  f"{self.product} : {self.subproduct}")
+            self.logger.info("Dataset created and metadata available for %s %s"
+                             % (self.product, self.subproduct))
+
+        except Exception as e:
+            self.logger.error("Failed to retrieve Dataset metadata.\n"
+                              "%s" % e)
+            self._report("Failed to retrieve Dataset metadata, "
+                         "please see logfile for details.")
+
+    def _load_metadata(self):
+        """
+        Download the metadata for this product & sub-product & tile and
+        record it as attributes.
+        """
+        bounds = self._region_bounds()
+
+        result = self.conn.get_subproduct_meta(product=self.product,
+                                               subproduct=self.subproduct,
+                                               bounds=bounds,
+                                               tile=self.tile)
+
+        # Extract relevant metadata as attributes.
+        self._extract_metadata(result)
+
     def get_data(self, start, stop,
                  use_dask=False,
                  region=None, tile=None, res=None, latlon=None,
-                 country=None, projection=None):
+                 country=None, projection=None, codec=None,
+                 lazy=False, time_chunk=None, subproducts=None,
+                 time_window=None):
         """
         Extract data from the datacube to the specification supplied.
 
@@ -290,6 +501,31 @@ Data:
                         is provided, the system exports data in its native
                         form.
 
+        :param codec:   optional - compression codec to ask the server to use
+                        for this transfer: 'gzip' (the default), 'zstd',
+                        'lz4' or 'none'. 'none' is usually fastest on a
+                        local network.
+
+        :param lazy:    optional - set to True to return the data as dask
+                        arrays which are only fetched when computed, one
+                        request per chunk of time steps. Use this for
+                        periods too large to hold in memory. Only the
+                        time series of one pixel and the first time step
+                        are fetched straight away.
+
+        :param time_chunk: optional - number of time steps in each chunk
+                        when lazy. By default chunks are about 64MB.
+
+        :param subproducts: optional - list of other sub-products of the
+                        same product to fetch in the same request. They are
+                        added to the data as further variables; put() and
+                        the metadata still refer to this sub-product only.
+
+        :param time_window: optional - longest period fetched by one
+                        request, e.g. planner.DEFAULT_TIME_WINDOW. Longer
+                        periods are fetched as several requests at once
+                        and joined. By default one request is made.
+
         :return: xarray of data
         """
         self.logger.info("Dataset get_data args: start %s, stop %s, DASK %s,"
@@ -300,61 +536,241 @@ Data:
                             country, projection))
 
         try:
-            # Extract the bounds information
-            if region:
-                bounds = get_bounds(region)
-            elif self.region:
-                bounds = get_bounds(self.region)
-            else:
-                bounds = None
-
-            # Extract tile info
-            if not tile and self.tile:
-                tile = self.tile
+            request = self._prepare_request(start, stop, use_dask, region,
+                                            tile, res, latlon, country,
+                                            projection, subproducts)
 
-            # Extract res info
-            if not res and self.res:
-                res = self.res
+            if lazy and not use_dask:
+                self.data = self._lazy_data(request, codec, time_chunk)
+                return
 
-            new_start = Datetime_checker(time=start)
-            start = new_start.c_and_c()
-            new_stop = Datetime_checker(time=stop)
-            stop = new_stop.c_and_c()
+            if self.cube_cache is not None and not use_dask:
+                self.data = self._cached_data(request, codec, time_window)
+                return
 
             # Fetch the data from the datacube
-            data = self.conn.get_subproduct_data(product=self.product,
-                                                 subproduct=self.subproduct,
-                                                 start=start,
-                                                 stop=stop,
-                                                 use_dask=use_dask,
-                                                 bounds=bounds,
-                                                 res=res,
-                                                 tile=tile,
-                                                 country=country,
-                                                 latlon=latlon,
-                                                 projection=projection)
-
-            self.data = data[0]
+            data = self.conn.get_subproduct_data(**request, codec=codec,
+                                                 time_window=time_window)
+
+            # A DASK request gives the pointer to the vrt file, which is
+            # not merged
+            self.data = data[0] if use_dask else \
+                self._merge_subproducts(data)
 
         except Exception as e:
-            if not use_dask:
-                self.logger.error("Failed to retrieve Dataset sub-product data.\n"
-                                  "%s" % e)
-                print("Failed to retrieve Dataset sub-product data, "
-                      "please see logfile for details.")
-            else:
-                self.logger.error("Failed to retrieve Dataset sub-product DASK "
-                                  "pointer.\n%s" % e)
-                print("Failed to retrieve Dataset sub-product DASK pointer, "
-                      "please see logfile for details.")
+            self._data_error(e, use_dask)
+
+    def get_points(self, points, start, stop, res=None, codec=None,
+                   subproducts=None, margin=0.25):
+        """
+        Extract the time series of many point locations with one request
+        for the area covering them all (or for the Dataset's tile, if it
+        has one), rather than one request per point.
+
+        Note the whole covering area is downloaded, so this suits points
+        which are reasonably close together, e.g. farms or stations in one
+        region. The area is kept in self.data, and extract_points() can
+        take further points from it without another request.
+
+        :param points:  pandas DataFrame with latitude and longitude
+                        columns, whose index labels the points, or a list
+                        of (latitude, longitude) pairs
+
+        :param start:   Start datetime for dataset
+
+        :param stop:    Stop datetime for dataset
+
+        :param res:     optional - resolution required
+
+        :param codec:   optional - see get_data()
+
+        :param subproducts: optional - see get_data()
+
+        :param margin:  optional - degrees added around the points, so
+                        those at the edge of the area have their nearest
+                        pixel. Not used for a tile.
 
-    def put(self, tile=None):
+        :return: xarray with point and time dimensions, or None if the
+                 request failed
+        """
+        region = None if self.tile else covering_bounds(points, margin)
+
+        self.data = None
+        self.get_data(start, stop, region=region, res=res, codec=codec,
+                      subproducts=subproducts)
+
+        if self.data is None:
+            return None
+        return self.extract_points(points)
+
+    def get_zonal_stats(self, zones, start, stop, stats=('mean',),
+                        percentiles=None, name_field=None, res=None,
+                        codec=None, subproducts=None):
+        """
+        Statistics of the data within each of a set of polygons, worked
+        out here rather than by the server, so any polygons can be used.
+        The area covering all the zones (or the Dataset's tile, if it has
+        one) is fetched with one request.
+
+        The data are kept in self.data, and zonal_stats() can summarise
+        them over other zones without another request.
+
+        :param zones:   path to a GeoJSON file or shapefile, or GeoJSON
+                        (FeatureCollection, Feature, geometry or list of
+                        Features), in longitude/latitude
+
+        :param start:   Start datetime for dataset
+
+        :param stop:    Stop datetime for dataset
+
+        :param stats:   optional - any of 'mean', 'sum', 'count', 'min'
+                        and 'max'
+
+        :param percentiles: optional - list of percentiles (0 to 100)
+
+        :param name_field: optional - property naming each zone, which
+                        are otherwise numbered in order
+
+        :param res:     optional - resolution required. Zones smaller than
+                        a pixel may have no pixels at the native
+                        resolution.
+
+        :param codec:   optional - see get_data()
+
+        :param subproducts: optional - see get_data()
+
+        :return: xarray with zone, time and stat dimensions, or None if the
+                 request failed
+        """
+        region = None if self.tile else zone_bounds(zones)
+
+        self.data = None
+        self.get_data(start, stop, region=region, res=res, codec=codec,
+                      subproducts=subproducts)
+
+        if self.data is None:
+            return None
+        return self.zonal_stats(zones, stats, percentiles, name_field)
+
+    def _lazy_data(self, request, codec, time_chunk):
+        """
+        Get the data as dask arrays, fetched a chunk at a time.
+
+        The chunks are planned on the time steps the datacube has, read
+        from the time series of one pixel of the area. Requests by
+        country have no grid, so their chunks are planned on the ideal
+        time steps, and a chunk with others fails when computed.
+
+        :param request: from _prepare_request()
+        :return: xarray of data
+        """
+        def fetch(start, stop, **changes):
+            return self._merge_subproducts(self.conn.get_subproduct_data(
+                **dict(request, start=start, stop=stop, **changes),
+                codec=codec))
+
+        start, stop = request['start'], request['stop']
+
+        template = None
+        point = request['latlon']
+        bounds = request['bounds']
+        if request['tile'] or point is None and bounds is None:
+            # The grid of the first time step gives a pixel to read
+            template = self._lazy_template(fetch, start, stop)
+            point = grid_centre(template)
+        elif point is None:
+            point = ((bounds.north + bounds.south) / 2.,
+                     (bounds.east + bounds.west) / 2.)
+
+        if point is not None and not request['country']:
+            series = fetch(start, stop, latlon=point, bounds=None, tile=None,
+                           country=None, res=None, projection=None)
+            times = series['time'].values
+            if not len(times):
+                raise ValueError("No data of %s %s between %s and %s"
+                                 % (self.product, self.subproduct, start,
+                                    stop))
+        else:
+            times = self._timesteps_between(start, stop)
+        if template is None:
+            template = fetch(times[0], times[0])
+
+        return lazy_dataset(fetch, times, template, time_chunk=time_chunk)
+
+    def _lazy_template(self, fetch, start, stop):
+        """
+        The first time step with data. The periods between the first
+        TEMPLATE_TRIES ideal time steps are searched in turn, as the
+        datacube's time steps need not fall on the ideal ones.
+
+        :param fetch: function (start, stop) returning an xarray of data
+        :param start: start of the period requested
+        :param stop: end of the period requested
+        :return: xarray of data
+        """
+        times = self._timesteps_between(start, stop)
+        edges = [start] + list(times[:TEMPLATE_TRIES]) + [stop]
+        for low, high in zip(edges[:-1], edges[1:TEMPLATE_TRIES + 1]):
+            data = fetch(low, high)
+            if data.sizes.get('time'):
+                return data.isel(time=[0])
+        raise ValueError("No data of %s %s in the %d time steps from %s"
+                         % (self.product, self.subproduct, TEMPLATE_TRIES,
+                            start))
+
+    def _timesteps_between(self, start, stop):
+        """
+        The ideal time steps from start to stop (see
+        availability.ideal_timesteps).
+
+        :return: numpy datetime64 array
+        """
+        if not self.first_timestep:
+            raise RuntimeError("The time steps of %s %s are not known"
+                               % (self.product, self.subproduct))
+
+        timesteps = AvailabilityIndex(ideal_timesteps(
+            self.first_timestep, self.last_timestep, self.time_resolution,
+            yearly=self.product in YEARLY_COMPOSITES)).between(start, stop)
+        if not len(timesteps):
+            raise ValueError("No time steps of %s %s between %s and %s"
+                             % (self.product, self.subproduct, start, stop))
+        return timesteps
+
+    def _cached_data(self, request, codec, time_window=None):
+        """
+        Get the data through self.cube_cache, fetching from the datacube
+        only the time ranges which are not cached or have changed since.
+
+        :param request: from _prepare_request()
+        :param time_window: see get_data()
+        :return: xarray of data
+        """
+        def fetch(start, stop):
+            return self._merge_subproducts(self.conn.get_subproduct_data(
+                **dict(request, start=start, stop=stop), codec=codec,
+                time_window=time_window))
+
+        # Everything but the dates identifies the cached series
+        series = cache_key((self.conn.http_client.full_url,
+                            self.conn.http_client.login),
+                           dict(request, start=None, stop=None))
+
+        return self.cube_cache.get_range(
+            series, request['start'], request['stop'], fetch,
+            tag=(str(self.last_gold), str(self.last_timestep)),
+            final=self.last_gold)
+
+    def put(self, tile=None, codec=None):
         """
         Prepare self.data and metadata, then send to the datacube.
         :param tile: Optionally provide the tile for the data. If not present,
                      the tile specified in the Dataset creation will be used.
                      The tile name will be checked against those for which the
                      Dataset is registered.
+        :param codec: Optionally name the compression codec for the upload
+                      ('gzip', 'zstd', 'lz4' or 'none'). It is only used if
+                      the server accepts it.
         :return:
         """
 
@@ -397,22 +813,20 @@ Data:
             for x in self.data.attrs:
                 self.data[self.subproduct].attrs[x] = self.data.attrs[x]
 
-            # Instantiate the datacube connector
-            conn = Connect()
-
-            # Put the data into the datacube
-            conn.put_subproduct_data(data=self.data)
+            # Put the data into the datacube, re-using this Dataset's
+            # connection
+            self.conn.put_subproduct_data(data=self.data, codec=codec)
 
         except Exception as e:
             self.logger.error("Failed to write data to the datacube.\n"
                               "%s" % e)
-            print("Failed to write data to the datacube.")
+            self._report("Failed to write data to the datacube.")
 
     def update(self, script, params=None):
         """
         Update this dataset using the update method in the script
-        supplied. Following the calculation, re-initialise from the
-        DataCube to update the metadata.
+        supplied. Following the calculation, reload the metadata from the
+        DataCube.
 
         :param script: The python script for updating this dataset
         :param params: A dictionary of keyword arguments to be passed
@@ -429,52 +843,21 @@ Data:
             else:
                 script.update()
 
-            # Re-initialise dataset information after update
-            self.__init__(self.product, self.subproduct, region=self.region,
-                          tile=self.tile)
+            # Refresh the metadata after the update. The data held are out
+            # of date, so are dropped. The connection, resolution and cube
+            # cache given on creation are kept. The metadata cached before
+            # the update are out of date too.
+            self.data = None
+            self.timesteps = None
+            self.conn.invalidate_subproduct_meta(self.product,
+                                                 self.subproduct)
+            self._load_metadata()
 
         except Exception as e:
             self.logger.error("Failed to update the Dataset from script %s.\n"
                               "%s" % (e, script))
-            print("Failed to update the Dataset from script %s" % script)
-
-    def calculate_timesteps(self):
-        """
-        Calculate the time steps available, given the time_resolution of the
-        dataset (as recorded in the sub-product table) and the first and
-        last time steps.
-
-        NOTE: This method calculates ideal timesteps, rather than
-        retrieving the actual timesteps of the data. This method cannot
-        know about any data gaps.
-
-        :return:
-        """
-
-        try:
-            # split the numpy timedelta into its component parts (e.g.
-            # ['year', 1])
-            bf_fq_vals = self.time_resolution.__str__().split(' ')
-
-            # Create a pandas DataOffset object which represents this
-            # time_resolution
-            time_resolution = pd.DateOffset(**{bf_fq_vals[1]: int(bf_fq_vals[0])})
-
-            # Generate an array, using this as the step
-            if self.first_timestep:
-                timesteps = pd.date_range(self.first_timestep,
-                                          self.last_timestep,
-                                          freq=time_resolution)
-
-                self.timesteps = timesteps.values
-
-            else:
-                self.timesteps = None
-
-        except Exception as e:
-            self.logger.error("Unable to calculate timesteps.\n"
-                              "%s" % e)
-            raise RuntimeError("Unable to calculate timesteps.")
+            self._report("Failed to update the Dataset from script %s"
+                         % script)
 
     def set_last_gold(self, date_time):
         """
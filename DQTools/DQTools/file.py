@@ -35,7 +35,7 @@ class File:
             raise
 
     def put_contents_of_local_file(self, product, subproduct, tile,
-                                   path):
+                                   path, progress=None):
         """
         Transfer the contents of a local geotiff file to the server.
         The user must have permission to WRITE for this sub-product, and the file
@@ -47,13 +47,16 @@ class File:
         :param tile: known tile
         :param path: fully qualified location of file on the client. The file's name
                      MUST be in the standard format for the Assimila DataCube.
+        :param progress: optional function called as progress(sent, total) with
+                         the number of bytes sent so far and the total if known
         :return:
         """
         try:
             # Instantiate the datacube connector
             conn = Connect(identfile=self.identfile)
 
-            conn.put_file_contents(product, subproduct, tile, path)
+            conn.put_file_contents(product, subproduct, tile, path,
+                                   progress=progress)
 
         except Exception as e:
             self.logger.error("Failed to write file data to the datacube.\n"
@@ -0,0 +1,119 @@
+"""
+Lazily loaded DataCube data.
+
+lazy_dataset() builds an xarray Dataset whose variables are dask arrays
+split into chunks of consecutive time steps. Each chunk is its own
+GET_DATA request, sent only when that chunk is computed, so reductions
+such as .mean('time') stream through the data a few chunks at a time
+and selections only fetch the chunks they touch.
+
+Requires the dask package.
+"""
+import numpy as np
+import xarray as xr
+
+try:
+    import dask
+    import dask.array as da
+except ImportError:
+    dask = None
+
+# Approximate size of each chunk, in bytes, if the number of time steps
+# per chunk is not given
+CHUNK_BYTES = 64 * 1024 ** 2
+
+
+def chunk_timesteps(template, chunk_bytes=CHUNK_BYTES):
+    """
+    Number of time steps which fit in a chunk of about chunk_bytes.
+
+    :param template: xarray Dataset of a single time step
+    :return: int
+    """
+    step_bytes = sum(var.nbytes // max(1, var.sizes.get('time', 1))
+                     for var in template.data_vars.values()
+                     if 'time' in var.dims)
+    return max(1, chunk_bytes // max(1, step_bytes))
+
+
+def grid_centre(data):
+    """
+    The pixel in the middle of gridded data.
+
+    :param data: xarray Dataset
+    :return: (latitude, longitude), or None if the data have no
+             latitude/longitude grid
+    """
+    for lat, lon in (('latitude', 'longitude'), ('lat', 'lon')):
+        if lat in data.coords and lon in data.coords \
+                and data[lat].size and data[lon].size:
+            lat = data[lat].values.ravel()
+            lon = data[lon].values.ravel()
+            return float(lat[len(lat) // 2]), float(lon[len(lon) // 2])
+    return None
+
+
+def _fetch_chunk(fetch, times, names):
+    """
+    Fetch one chunk, checking it has the planned time steps so every chunk
+    has the shape dask was promised.
+    """
+    data = fetch(times[0], times[-1])
+    fetched = np.asarray(data['time'].values, dtype='datetime64[ns]')
+    if not np.array_equal(fetched, times):
+        raise ValueError("Expected %d time steps from %s to %s but the "
+                         "DataCube returned %d"
+                         % (len(times), times[0], times[-1], len(fetched)))
+    return dict((name, data[name].values) for name in names)
+
+
+def lazy_dataset(fetch, times, template, time_chunk=None):
+    """
+    Build a Dataset backed by one GET_DATA request per chunk of time steps.
+
+    :param fetch: function (start, stop) returning an xarray Dataset of the
+                  time steps from start to stop inclusive
+    :param times: the time steps of the Dataset, in order (numpy
+                  datetime64 array). These must be the time steps the
+                  DataCube has, as a chunk returning others is an error.
+    :param template: xarray Dataset of a single time step, giving the
+                     variables, their types and the other coordinates
+    :param time_chunk: optional; time steps per chunk, chosen from
+                       CHUNK_BYTES if not given
+    :return: xarray Dataset of dask arrays
+    """
+    if dask is None:
+        raise ImportError("Lazy loading requires the dask package")
+
+    times = np.asarray(times, dtype='datetime64[ns]')
+    if not len(times):
+        raise ValueError("No time steps in the requested period")
+
+    if not time_chunk:
+        time_chunk = chunk_timesteps(template)
+
+    names = [name for name, var in template.data_vars.items()
+             if 'time' in var.dims]
+
+    pieces = dict((name, []) for name in names)
+    for first in range(0, len(times), time_chunk):
+        chunk_times = times[first:first + time_chunk]
+        chunk = dask.delayed(_fetch_chunk, pure=True)(
+            fetch, chunk_times, names)
+        for name in names:
+            var = template[name]
+            shape = tuple(len(chunk_times) if dim == 'time' else size
+                          for dim, size in zip(var.dims, var.shape))
+            pieces[name].append(da.from_delayed(
+                chunk[name], shape=shape, dtype=var.dtype))
+
+    data = template.drop_vars(names).drop_dims('time', errors='ignore')
+    data = data.assign_coords(time=times)
+    for name in names:
+        var = template[name]
+        data[name] = xr.Variable(
+            var.dims,
+            da.concatenate(pieces[name], axis=var.dims.index('time')),
+            attrs=var.attrs)
+    data.attrs = template.attrs
+    return data
@@ -0,0 +1,186 @@
+"""
+Extracting the time series of many point locations from gridded data.
+
+Rather than one position request per point, the area covering all the
+points is fetched once and each point is matched to its nearest pixel.
+PointIndex does the matching for a grid: on a regular grid it is simple
+arithmetic, otherwise a binary search, and the index for each grid is
+kept so repeated extractions from the same data cost little per point.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Number of grids whose PointIndex is kept
+MAX_INDEXES = 32
+
+Points = namedtuple('Points', ['lat', 'lon', 'labels'])
+
+
+def as_points(points):
+    """
+    Read point locations.
+
+    :param points: pandas DataFrame with latitude and longitude (or lat and
+                   lon) columns, whose index labels the points, or a
+                   sequence of (latitude, longitude) pairs
+    :return: Points of latitude and longitude arrays and point labels
+    """
+    if isinstance(points, pd.DataFrame):
+        columns = dict((column.lower(), column) for column in points.columns)
+        try:
+            lat = columns.get('latitude', columns.get('lat'))
+            lon = columns.get('longitude', columns.get('lon'))
+            return Points(points[lat].values.astype(float),
+                          points[lon].values.astype(float),
+                          points.index.values)
+        except KeyError:
+            raise ValueError("Points need latitude and longitude columns")
+
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    return Points(points[:, 0], points[:, 1], np.arange(len(points)))
+
+
+def covering_bounds(points, margin=0.0):
+    """
+    The smallest area containing all the points.
+
+    :param points: see as_points()
+    :param margin: optional; degrees to add on each side, so that points at
+                   the edge still have their nearest pixel
+    :return: [north, east, south, west], as used for a Dataset region
+    """
+    points = as_points(points)
+    return [float(points.lat.max() + margin), float(points.lon.max() + margin),
+            float(points.lat.min() - margin), float(points.lon.min() - margin)]
+
+
+class _AxisIndex(object):
+    """
+    Nearest position along one coordinate axis.
+    """
+
+    def __init__(self, values):
+        values = np.asarray(values, dtype=float)
+        self.size = len(values)
+        self.start = values[0] if self.size else 0.0
+        self.step = None
+
+        steps = np.diff(values)
+        if self.size > 1 and np.allclose(steps, steps[0]) and steps[0]:
+            self.step = steps[0]
+            return
+
+        # Irregular: search the values in increasing order
+        self.order = np.argsort(values, kind='stable')
+        self.sorted = values[self.order]
+
+    def lookup(self, targets):
+        if self.step is not None:
+            positions = np.rint((targets - self.start) / self.step)
+            return np.clip(positions, 0, self.size - 1).astype(int)
+
+        if self.size == 1:
+            return np.zeros(len(targets), dtype=int)
+
+        right = np.clip(np.searchsorted(self.sorted, targets), 1,
+                        self.size - 1)
+        left = right - 1
+        nearer_left = (targets - self.sorted[left]) <= \
+            (self.sorted[right] - targets)
+        return self.order[np.where(nearer_left, left, right)]
+
+
+class PointIndex(object):
+    """
+    Nearest-pixel index of a latitude/longitude grid.
+    """
+    _indexes = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def for_grid(cls, lat, lon):
+        """
+        The index for a grid, reused if the same grid was indexed recently.
+
+        :param lat: latitude coordinate values
+        :param lon: longitude coordinate values
+        :return: PointIndex
+        """
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        key = (lat.tobytes(), lon.tobytes())
+        with cls._lock:
+            index = cls._indexes.get(key)
+            if index is not None:
+                cls._indexes.move_to_end(key)
+                return index
+
+        index = cls(lat, lon)
+        with cls._lock:
+            cls._indexes[key] = index
+            while len(cls._indexes) > MAX_INDEXES:
+                cls._indexes.popitem(last=False)
+        return index
+
+    def __init__(self, lat, lon):
+        """
+        :param lat: latitude coordinate values, in any order
+        :param lon: longitude coordinate values, in any order
+        """
+        self._lat = _AxisIndex(lat)
+        self._lon = _AxisIndex(lon)
+
+    def lookup(self, lat, lon):
+        """
+        Positions of the pixels nearest the points.
+
+        :param lat: array of latitudes
+        :param lon: array of longitudes
+        :return: (latitude positions, longitude positions)
+        """
+        return (self._lat.lookup(np.asarray(lat, dtype=float)),
+                self._lon.lookup(np.asarray(lon, dtype=float)))
+
+
+def _grid_dims(data):
+    """
+    The (latitude, longitude) dimensions of gridded data.
+    """
+    for var in data.data_vars.values():
+        dims = [dim for dim in var.dims if dim != 'time']
+        if len(dims) == 2:
+            return dims
+    raise ValueError("Points can only be extracted from data on a 2D grid")
+
+
+def extract_points(data, points):
+    """
+    The time series of each point's nearest pixel.
+
+    :param data: xarray Dataset on a latitude/longitude grid
+    :param points: see as_points()
+    :return: xarray Dataset with a point dimension (and time, if the data
+             have it). The requested locations are the point_latitude and
+             point_longitude coordinates; the latitude and longitude
+             coordinates are those of the pixels used.
+    """
+    points = as_points(points)
+    lat_dim, lon_dim = _grid_dims(data)
+
+    index = PointIndex.for_grid(data[lat_dim].values, data[lon_dim].values)
+    rows, columns = index.lookup(points.lat, points.lon)
+
+    out = data.isel({lat_dim: xr.DataArray(rows, dims='point'),
+                     lon_dim: xr.DataArray(columns, dims='point')})
+    out = out.assign_coords(point=points.labels,
+                            point_latitude=('point', points.lat),
+                            point_longitude=('point', points.lon))
+    if 'time' in out.dims:
+        out = out.transpose('point', 'time',
+                            *[dim for dim in out.dims
+                              if dim not in ('point', 'time')])
+    return out
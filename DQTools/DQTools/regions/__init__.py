@@ -1,30 +1,229 @@
 import os.path as op
+import threading
 import yaml
 from collections import namedtuple
 
+import numpy as np
+
+# Bounding box of a region, in degrees
+Bounds = namedtuple('Bounds', 'north south east west')
+
+# Number of regions in each leaf of the spatial index
+LEAF_SIZE = 16
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+class _BoxTree(object):
+    """
+    Static R-tree of bounding boxes, packed by sort-tile-recursive: the
+    boxes are sorted into vertical slices by longitude, then by latitude
+    within each slice, and cut into leaves of LEAF_SIZE. A query tests
+    the bounds of every leaf at once, then the boxes of the leaves hit.
+    """
+
+    def __init__(self, boxes, ids):
+        """
+        :param boxes: array of [north, south, east, west] rows, with west
+                      <= east
+        :param ids: array of the id of each box
+        """
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        ids = np.asarray(ids)
+
+        leaves = max(1, int(np.ceil(len(boxes) / float(LEAF_SIZE))))
+        slices = max(1, int(np.ceil(np.sqrt(leaves))))
+        per_slice = slices * LEAF_SIZE
+
+        order = np.argsort((boxes[:, 2] + boxes[:, 3]) / 2, kind='stable')
+        self.leaf_boxes = []
+        self.leaf_ids = []
+        for first in range(0, len(order), per_slice):
+            chunk = order[first:first + per_slice]
+            chunk = chunk[np.argsort((boxes[chunk, 0] + boxes[chunk, 1]) / 2,
+                                     kind='stable')]
+            for leaf in range(0, len(chunk), LEAF_SIZE):
+                members = chunk[leaf:leaf + LEAF_SIZE]
+                self.leaf_boxes.append(boxes[members])
+                self.leaf_ids.append(ids[members])
+
+        self.node_boxes = np.array(
+            [[leaf[:, 0].max(), leaf[:, 1].min(),
+              leaf[:, 2].max(), leaf[:, 3].min()]
+             for leaf in self.leaf_boxes]).reshape(-1, 4)
+
+    @staticmethod
+    def _overlaps(boxes, north, south, east, west):
+        return (boxes[:, 1] <= north) & (boxes[:, 0] >= south) & \
+            (boxes[:, 3] <= east) & (boxes[:, 2] >= west)
+
+    def query(self, north, south, east, west):
+        """
+        :return: set of the ids of boxes which touch the given box
+        """
+        found = set()
+        for leaf in np.flatnonzero(self._overlaps(self.node_boxes, north,
+                                                  south, east, west)):
+            hit = self._overlaps(self.leaf_boxes[leaf], north, south, east,
+                                 west)
+            found.update(self.leaf_ids[leaf][hit].tolist())
+        return found
+
+
+class RegionRegistry(object):
+    """
+    The named regions, with a spatial index of their bounds.
+    """
+
+    def __init__(self, regions):
+        """
+        :param regions: dictionary of region name to Bounds, or sequence of
+                        (name, Bounds) pairs, in order
+        """
+        regions = list(regions.items() if isinstance(regions, dict)
+                       else regions)
+        self._bounds = dict(regions)
+        self._names = [name for name, _ in regions]
+
+        # Regions crossing the antimeridian (west > east) are indexed as
+        # two boxes, one each side
+        boxes, ids = [], []
+        for number, name in enumerate(self._names):
+            north, south, east, west = self._bounds[name]
+            if west > east:
+                boxes.extend([[north, south, 180.0, west],
+                              [north, south, east, -180.0]])
+                ids.extend([number, number])
+            else:
+                boxes.append([north, south, east, west])
+                ids.append(number)
+        self._tree = _BoxTree(boxes, ids)
+
+        self._areas = np.array([(b.north - b.south) *
+                                ((b.east - b.west) % 360)
+                                for b in (self._bounds[name]
+                                          for name in self._names)])
+
+    @classmethod
+    def from_yaml(cls, filename):
+        """
+        Read a regions file of name: {north, south, east, west}.
+
+        :return: RegionRegistry
+        """
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        with open(filename) as f:
+            data = yaml.load(f, Loader=loader)
+
+        return cls((name, Bounds(**dict((key, float(value))
+                                        for key, value in bounds.items())))
+                   for name, bounds in data.items())
+
+    def __contains__(self, name):
+        return name in self._bounds
+
+    def __len__(self):
+        return len(self._names)
+
+    def names(self):
+        """
+        :return: list of region names, in file order
+        """
+        return list(self._names)
+
+    def bounds(self, name):
+        """
+        :return: Bounds of a region
+        :raise KeyError: if there is no such region
+        """
+        return self._bounds[name]
+
+    def _named(self, ids):
+        # smallest first, so the most specific region leads
+        return [self._names[number]
+                for number in sorted(ids, key=lambda n: (self._areas[n], n))]
+
+    def containing(self, latitude, longitude):
+        """
+        Regions whose bounds contain a point.
+
+        :return: list of region names, smallest first
+        """
+        if not -180.0 <= longitude <= 180.0:
+            longitude = (longitude + 180.0) % 360.0 - 180.0
+        return self._named(self._tree.query(latitude, latitude,
+                                            longitude, longitude))
+
+    def intersecting(self, north, east, south, west):
+        """
+        Regions whose bounds overlap a bounding box. A box with west > east
+        crosses the antimeridian.
+
+        :return: list of region names, smallest first
+        """
+        if west > east:
+            ids = self._tree.query(north, south, 180.0, west) | \
+                self._tree.query(north, south, east, -180.0)
+        else:
+            ids = self._tree.query(north, south, east, west)
+        return self._named(ids)
+
+
+def get_registry():
+    """
+    The regions defined in regions.yaml, read once and then shared.
+
+    :return: RegionRegistry
+    :raise RuntimeError: if the regions file cannot be read
+    """
+    if not _registry:
+        with _registry_lock:
+            if not _registry:
+                try:
+                    # The regions file sits in the same directory as this
+                    # file
+                    path = op.abspath(op.dirname(__file__))
+                    _registry.append(RegionRegistry.from_yaml(
+                        op.join(path, "regions.yaml")))
+
+                except (OSError, FileNotFoundError) as e:
+                    # raise RuntimeError(f"Failed to load regions file.\n{e}")
+                    raise RuntimeError("Failed to load regions file.\n%s" % e)
+    return _registry[0]
+
 
 def get_country_names():
     """
-    Parse the regions.yaml file and extract the 
-    country names as list.
+    Extract the country names from the regions.yaml file as list.
     """
-    try:
-        # Define the directory that this file is sitting in
-        path = op.abspath(op.dirname(__file__))
+    # Converts the regions to list of country names
+    return get_registry().names()
+
+
+def regions_containing(latitude, longitude):
+    """
+    Names of the regions in regions.yaml whose bounds contain a point.
+
+    :param latitude: latitude of the point
+    :param longitude: longitude of the point
+    :return: list of region names, smallest region first
+    """
+    return get_registry().containing(latitude, longitude)
 
-        # Open the config file in the same directory and extract all
-        # the bounds data
-        with open(op.join(path, "regions.yaml")) as f:
-            data = yaml.load(f)
 
-        # Converts the dictionary to list of country names
-        country_names = list(data)
+def regions_intersecting(north, east, south, west):
+    """
+    Names of the regions in regions.yaml whose bounds overlap a box.
 
-        return country_names
+    :param north: northern latitude
+    :param east: eastern longitude
+    :param south: southern latitude
+    :param west: western longitude
+    :return: list of region names, smallest region first
+    """
+    return get_registry().intersecting(north, east, south, west)
 
-    except (OSError, FileNotFoundError) as e:
-        # raise RuntimeError(f"Failed to load regions file.\n{e}")
-        raise RuntimeError("Failed to load regions file.\n%s" % e)
 
 def get_bounds(region):
     """
@@ -45,17 +244,9 @@ def get_bounds(region):
     try:
         if isinstance(region, str):
 
-            # Define the directory that this file is sitting in
-            path = op.abspath(op.dirname(__file__))
-
-            # Open the config file in the same directory and extract all
-            # the bounds data
-            with open(op.join(path, "regions.yaml")) as f:
-                bounds_data = yaml.load(f)
-
             # Extract the bounds for this region
             try:
-                bounds_dict = bounds_data[region]
+                return get_registry().bounds(region)
             except KeyError:
                 #raise KeyError(f'Region {region} does not exist in regions.yaml')
                 raise KeyError("Region %s does not exist in regions.yaml" % region)
@@ -71,9 +262,6 @@ def get_bounds(region):
             raise ValueError("Regions kwarg must be list of [NESW] or string of a "
                              "valid region in regions.yaml")
 
-        # Set up structure of named tuple to hold the information
-        Bounds = namedtuple('Bounds', 'north south east west')
-
         # Add bounds to named tuple instance
         region_bounds = Bounds(**bounds_dict)
 
@@ -70,7 +70,7 @@ class Register:
             print("Unable to create Registration object, "
                   "please see logfile for details.")
 
-    def register_tiles_from_local_file(self, filepath):
+    def register_tiles_from_local_file(self, filepath, progress=None):
         """
         Transfer the contents of a local tile definition file to the server and
         use it to register its contents.
@@ -79,13 +79,15 @@ class Register:
         The name of the file will be used but held in temporary storage.
         :param path: fully qualified location of file on the client. The file's name
                      MUST be in the standard format for the Assimila DataCube.
+        :param progress: optional function called as progress(sent, total) with
+                         the number of bytes sent so far and the total if known
         :return:
         """
         try:
             # Instantiate the datacube connector
             conn = Connect(identfile=self.identfile)
 
-            conn.register_tiles_from_file(filepath)
+            conn.register_tiles_from_file(filepath, progress=progress)
 
         except Exception as e:
             self.logger.error("Failed to register tile(s) with the datacube.\n"
@@ -1,7 +1,9 @@
 import logging
 import datetime
 import os.path as op
+import sqlite3
 from .connect.connect import Connect
+from .connect.catalog import CatalogStore
 from .connect.log.setup_logger import SetUpLogger
 
 
@@ -14,15 +16,22 @@ class Search:
     class in the DataCube at: src/datacube/dq_database/db_view.py
     """
 
-    def __init__(self, identfile=None):
+    def __init__(self, identfile=None, use_catalog=False):
         """
         Set up logging.
 
         :param identfile: Assimila DQ credentials file required to access the
                  HTTP server. Allows the file to be in a different location.
+        :param use_catalog: optional; if True, the tile, product and
+                 sub-product tables are kept in the local catalog file (see
+                 connect.catalog) so they are available immediately and
+                 brought up to date in the background. The file is read
+                 with pickle, so only use a catalog file which no-one else
+                 can write to.
         """
         try:
             self.identfile = identfile
+            self.use_catalog = use_catalog
             base, extension = op.splitext('./connect/log/search.log')
             today = datetime.datetime.today()
             log_filename = "{}{}{}".format(base,
@@ -49,7 +58,7 @@ class Search:
             conn = Connect(identfile=self.identfile)
 
             # extract a dataframe of the tile table
-            df = conn.get_all_table_data("tile")
+            df = self._table(conn, "tile")
 
             self.logger.info("Retrieved all tiles.")
 
@@ -70,7 +79,7 @@ class Search:
             conn = Connect(identfile=self.identfile)
 
             # extract a dataframe of the product table
-            df = conn.get_all_table_data("product")
+            df = self._table(conn, "product")
 
             self.logger.info("Retrieved all products.")
 
@@ -91,7 +100,7 @@ class Search:
             conn = Connect(identfile=self.identfile)
 
             # extract a dataframe of the sub-product table
-            df = conn.get_all_table_data("subproduct")
+            df = self._table(conn, "subproduct")
 
             self.logger.info("Retrieved all sub-products.")
 
@@ -102,6 +111,24 @@ class Search:
             print("Unable to get sub-products, "
                   "please see logfile for details.")
 
+    def _table(self, conn, tablename):
+        """
+        Return a catalog table, from the local catalog file if enabled.
+
+        :param conn: Connect to the DataCube
+        :param tablename: The name of the DataCube database table
+        :return: pandas DataFrame
+        """
+        if self.use_catalog:
+            try:
+                return CatalogStore.shared().table(conn, tablename)
+            except (OSError, sqlite3.Error) as e:
+                self.logger.warning("Local catalog unavailable, "
+                                    "downloading %s table.\n%s"
+                                    % (tablename, e))
+
+        return conn.get_all_table_data(tablename)
+
     def get_subproduct_list_of_product(self, product):
         """
         Return a list of sub-products based on product selected
@@ -0,0 +1,348 @@
+"""
+Zonal statistics of gridded data over any set of polygons.
+
+The zones (GeoJSON features or a shapefile, in longitude/latitude) are
+rasterized once per grid into a label grid giving the zone of each pixel,
+and the grid is kept, so the same zones over the same data cost little
+the next time. The statistics of every zone and time step are then worked
+out together: counts, sums and means with one numpy bincount over all
+pixels and time steps, minima and maxima with one reduceat over the
+pixels sorted by zone, and percentiles a zone at a time over all time
+steps.
+
+A pixel belongs to a zone if its centre is inside the polygon. Where zones
+overlap, a pixel is counted in the first of them only.
+
+Reading shapefiles requires GDAL's ogr module; GeoJSON needs nothing more.
+"""
+import hashlib
+import json
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import xarray as xr
+
+from .points import _grid_dims
+
+try:
+    import ogr
+except ImportError:
+    try:
+        from osgeo import ogr
+    except ImportError:
+        ogr = None
+
+# Number of label grids kept
+MAX_GRIDS = 16
+
+# The statistics available, besides percentiles
+STATISTICS = ('mean', 'sum', 'count', 'min', 'max')
+
+
+def _read_shapefile(path):
+    """
+    The features of a shapefile, as GeoJSON.
+    """
+    if ogr is None:
+        raise ImportError("Reading shapefiles requires GDAL (ogr); convert "
+                          "them to GeoJSON with Data.shape_to_geojson")
+
+    source = ogr.Open(path)
+    if source is None:
+        raise ValueError("Unable to open %s" % path)
+    layer = source.GetLayer(0)
+    return [json.loads(feature.ExportToJson()) for feature in layer]
+
+
+def read_zones(zones, name_field=None):
+    """
+    Read zones.
+
+    :param zones: path to a GeoJSON file or shapefile, a GeoJSON
+                  FeatureCollection, Feature or geometry, or a list of
+                  Features
+    :param name_field: optional; property naming each zone. Zones are
+                       numbered in order if not given.
+    :return: list of (name, geometry)
+    """
+    if isinstance(zones, str):
+        if zones.lower().endswith('.shp'):
+            zones = _read_shapefile(zones)
+        else:
+            with open(zones) as f:
+                zones = json.load(f)
+
+    if isinstance(zones, dict):
+        if zones.get('type') == 'FeatureCollection':
+            zones = zones['features']
+        elif zones.get('type') == 'Feature':
+            zones = [zones]
+        else:
+            zones = [{'type': 'Feature', 'geometry': zones}]
+
+    read = []
+    for number, feature in enumerate(zones):
+        name = number
+        if name_field is not None:
+            try:
+                name = feature['properties'][name_field]
+            except (KeyError, TypeError):
+                raise ValueError("Zone %d has no %s property"
+                                 % (number, name_field))
+        read.append((name, feature.get('geometry')))
+    return read
+
+
+def _rings(geometry):
+    """
+    The rings of a Polygon or MultiPolygon geometry, as arrays of
+    (longitude, latitude).
+    """
+    if not geometry:
+        return []
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    elif geometry['type'] == 'GeometryCollection':
+        return [ring for part in geometry['geometries']
+                for ring in _rings(part)]
+    else:
+        raise ValueError("Zones must be polygons, not %s" % geometry['type'])
+
+    return [np.asarray(ring, dtype=float)[:, :2]
+            for polygon in polygons for ring in polygon if len(ring) > 2]
+
+
+def zone_bounds(zones, margin=0.0):
+    """
+    The smallest area containing all the zones.
+
+    :param zones: see read_zones()
+    :param margin: optional; degrees to add on each side
+    :return: [north, east, south, west], as used for a Dataset region
+    """
+    rings = [ring for _, geometry in read_zones(zones)
+             for ring in _rings(geometry)]
+    if not rings:
+        raise ValueError("The zones have no polygons")
+    points = np.concatenate(rings)
+    return [float(points[:, 1].max() + margin),
+            float(points[:, 0].max() + margin),
+            float(points[:, 1].min() - margin),
+            float(points[:, 0].min() - margin)]
+
+
+def _inside(rings, lat, lon):
+    """
+    Which points of the grid are inside the polygon rings, by the even-odd
+    rule, so holes and the parts of multi-polygons are handled alike.
+
+    Each row of the grid is scanned once: the longitudes where the row
+    crosses the rings are found for all edges together, and a pixel is
+    inside if an odd number of them are to its west.
+
+    :return: boolean array (latitude, longitude)
+    """
+    inside = np.zeros((len(lat), len(lon)), dtype=bool)
+    if not rings:
+        return inside
+
+    x0 = np.concatenate([ring[:, 0] for ring in rings])
+    y0 = np.concatenate([ring[:, 1] for ring in rings])
+    x1 = np.concatenate([np.roll(ring[:, 0], -1) for ring in rings])
+    y1 = np.concatenate([np.roll(ring[:, 1], -1) for ring in rings])
+
+    rows = np.nonzero((lat >= y0.min()) & (lat <= y0.max()))[0]
+    columns = np.nonzero((lon >= x0.min()) & (lon <= x0.max()))[0]
+    if not len(rows) or not len(columns):
+        return inside
+    lon_in = lon[columns]
+
+    for row in rows:
+        y = lat[row]
+        crossing = (y0 <= y) != (y1 <= y)
+        if not crossing.any():
+            continue
+        xa, ya = x0[crossing], y0[crossing]
+        xb, yb = x1[crossing], y1[crossing]
+        crossings = np.sort(xa + (y - ya) * (xb - xa) / (yb - ya))
+        west = np.searchsorted(crossings, lon_in, side='right')
+        inside[row, columns] = (west % 2).astype(bool)
+    return inside
+
+
+class ZoneGrid(object):
+    """
+    The zone of each pixel of a latitude/longitude grid.
+    """
+    _grids = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def for_grid(cls, zones, lat, lon):
+        """
+        The label grid of zones on a grid, reused if the same zones were
+        rasterized on the same grid recently.
+
+        :param zones: list of (name, geometry), see read_zones()
+        :param lat: latitude coordinate values
+        :param lon: longitude coordinate values
+        :return: ZoneGrid
+        """
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        shapes = json.dumps(zones, sort_keys=True, default=str)
+        key = (lat.tobytes(), lon.tobytes(),
+               hashlib.sha256(shapes.encode('utf-8')).hexdigest())
+
+        with cls._lock:
+            grid = cls._grids.get(key)
+            if grid is not None:
+                cls._grids.move_to_end(key)
+                return grid
+
+        grid = cls(zones, lat, lon)
+        with cls._lock:
+            cls._grids[key] = grid
+            while len(cls._grids) > MAX_GRIDS:
+                cls._grids.popitem(last=False)
+        return grid
+
+    def __init__(self, zones, lat, lon):
+        """
+        :param zones: list of (name, geometry), see read_zones()
+        :param lat: latitude coordinate values
+        :param lon: longitude coordinate values
+        """
+        self.names = [name for name, _ in zones]
+
+        # -1 where a pixel is in no zone
+        labels = np.full((len(lat), len(lon)), -1, dtype=np.int32)
+        for number, (_, geometry) in enumerate(zones):
+            inside = _inside(_rings(geometry), lat, lon)
+            labels[inside & (labels < 0)] = number
+        self.labels = labels
+
+        # The pixels of each zone, together: zone z is
+        # order[starts[z]:starts[z] + counts[z]]
+        flat = labels.ravel()
+        self.order = np.argsort(flat, kind='stable')
+        self.order = self.order[flat[self.order] >= 0]
+        self.counts = np.bincount(flat[flat >= 0], minlength=len(zones))
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _zone_statistics(values, grid, stats, percentiles):
+    """
+    Statistics of each zone and time step.
+
+    :param values: array (time, pixels)
+    :return: dict of statistic name to array (zone, time)
+    """
+    steps = values.shape[0]
+    zones = len(grid)
+    flat_labels = grid.labels.ravel()
+    in_zone = flat_labels >= 0
+
+    out = {}
+    if set(stats) & {'mean', 'sum', 'count'}:
+        # One bincount over every pixel in a zone at every time step
+        zoned = values[:, in_zone]
+        bins = (np.arange(steps)[:, None] * zones
+                + flat_labels[in_zone][None, :]).ravel()
+        valid = np.isfinite(zoned).ravel()
+        count = np.bincount(bins[valid], minlength=steps * zones)
+        total = np.bincount(bins[valid], weights=zoned.ravel()[valid],
+                            minlength=steps * zones)
+        count = count.reshape(steps, zones).T
+        total = total.reshape(steps, zones).T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(count > 0, total / count, np.nan)
+        sums = np.where(count > 0, total, np.nan)
+        for stat, result in (('mean', means), ('sum', sums),
+                             ('count', count.astype(float))):
+            if stat in stats:
+                out[stat] = result
+
+    filled = grid.counts > 0
+    if set(stats) & {'min', 'max'} or percentiles:
+        by_zone = values[:, grid.order]
+        starts = grid.starts[filled]
+
+    for stat, reduce in (('min', np.fmin), ('max', np.fmax)):
+        if stat in stats:
+            result = np.full((zones, steps), np.nan)
+            if filled.any():
+                result[filled] = reduce.reduceat(by_zone, starts, axis=1).T
+            out[stat] = result
+
+    for q in percentiles or ():
+        out['p%g' % q] = np.full((zones, steps), np.nan)
+    if percentiles:
+        for zone in np.nonzero(filled)[0]:
+            start = grid.starts[zone]
+            pixels = by_zone[:, start:start + grid.counts[zone]]
+            # Time steps with no data in the zone give NaN, with a warning
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                result = np.nanpercentile(pixels, percentiles, axis=1)
+            for q, row in zip(percentiles, result):
+                out['p%g' % q][zone] = row
+    return out
+
+
+def zonal_stats(data, zones, stats=('mean',), percentiles=None,
+                name_field=None):
+    """
+    Statistics of the pixels within each zone, at each time step.
+
+    :param data: xarray Dataset on a longitude/latitude grid
+    :param zones: see read_zones()
+    :param stats: optional; any of STATISTICS
+    :param percentiles: optional; list of percentiles (0 to 100), given as
+                        statistics named e.g. 'p90'
+    :param name_field: optional; see read_zones()
+    :return: xarray Dataset of each variable with zone, time (if the data
+             have it) and stat dimensions. The number of pixels in each
+             zone is the pixels coordinate.
+    """
+    unknown = set(stats) - set(STATISTICS)
+    if unknown:
+        raise ValueError("Unknown statistics %s, choose from %s"
+                         % (sorted(unknown), STATISTICS))
+    percentiles = list(percentiles or [])
+
+    zones = read_zones(zones, name_field)
+    lat_dim, lon_dim = _grid_dims(data)
+    grid = ZoneGrid.for_grid(zones, data[lat_dim].values,
+                             data[lon_dim].values)
+    names = list(stats) + ['p%g' % q for q in percentiles]
+
+    out = xr.Dataset(coords={'zone': grid.names, 'stat': names,
+                             'pixels': ('zone', grid.counts)})
+    for name, var in data.data_vars.items():
+        if lat_dim not in var.dims or lon_dim not in var.dims:
+            continue
+        timed = 'time' in var.dims
+        var = var.transpose(*((['time'] if timed else [])
+                              + [lat_dim, lon_dim]))
+        values = np.asarray(var.values, dtype=float)
+        values = values.reshape(values.shape[0] if timed else 1, -1)
+
+        result = _zone_statistics(values, grid, stats, percentiles)
+        result = np.stack([result[stat] for stat in names], axis=-1)
+        if timed:
+            out[name] = (('zone', 'time', 'stat'), result)
+        else:
+            out[name] = (('zone', 'stat'), result[:, 0])
+        out[name].attrs = var.attrs
+
+    if 'time' in data.coords:
+        out = out.assign_coords(time=data['time'].values)
+    return out
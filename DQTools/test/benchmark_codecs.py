@@ -0,0 +1,106 @@
+"""
+Measure data transfer throughput for each compression codec.
+
+The first part times compression and decompression of a synthetic cube
+on this machine only. The second part times Dataset.get_data end to end
+against the DataCube server named in the credentials file, once per
+codec. Throughput is reported in MB/s of decoded xarray data.
+
+Usage:
+    python benchmark_codecs.py [product subproduct tile start stop]
+"""
+import datetime as dt
+import io
+import pickle
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from DQTools import Dataset
+from DQTools.connect import compression, wire
+
+REPEATS = 3
+
+
+def synthetic_cube(steps=48, size=500):
+    times = pd.date_range('2018-01-01', periods=steps, freq='D')
+    lat = np.linspace(10., 0., size)
+    lon = np.linspace(30., 40., size)
+    # smooth field plus noise, similar in compressibility to ERA5 skt
+    field = 280. + 10. * np.sin(np.add.outer(lat, lon))
+    data = (field[np.newaxis] +
+            np.random.normal(0., 0.5, (steps, size, size))).astype('float32')
+    return xr.Dataset({'skt': (('time', 'latitude', 'longitude'), data)},
+                      coords={'time': times, 'latitude': lat,
+                              'longitude': lon})
+
+
+def local_benchmark():
+    cube = synthetic_cube()
+    megabytes = cube.nbytes / 1e6
+    print("Local codec benchmark, %.1f MB cube" % megabytes)
+    print("%-8s %-8s %10s %12s %12s" % ('codec', 'format', 'ratio',
+                                         'comp MB/s', 'decomp MB/s'))
+
+    encoders = [('pickle', lambda: pickle.dumps(cube, protocol=-1),
+                 pickle.load),
+                ('dqarray', lambda: wire.dumps(cube), wire.load)]
+
+    for name in compression.available():
+        codec = compression.get_codec(name)
+        for fmt, dump, load in encoders:
+            payload = dump()
+
+            started = time.time()
+            for _ in range(REPEATS):
+                compressed = codec.compress(payload)
+            compress_time = (time.time() - started) / REPEATS
+
+            started = time.time()
+            for _ in range(REPEATS):
+                with codec.open(io.BytesIO(compressed)) as body:
+                    load(body)
+            decompress_time = (time.time() - started) / REPEATS
+
+            print("%-8s %-8s %10.2f %12.1f %12.1f"
+                  % (name, fmt, len(payload) / float(len(compressed)),
+                     megabytes / compress_time, megabytes / decompress_time))
+
+
+def server_benchmark(product, subproduct, tile, start, stop):
+    ds = Dataset(product=product, subproduct=subproduct, tile=tile)
+    print("\nEnd to end Dataset.get_data benchmark: %s %s %s %s to %s"
+          % (product, subproduct, tile, start, stop))
+    print("%-8s %10s %10s %10s" % ('codec', 'MB', 'seconds', 'MB/s'))
+
+    for name in compression.available():
+        elapsed = []
+        for _ in range(REPEATS):
+            ds.data = None
+            started = time.time()
+            ds.get_data(start=start, stop=stop, codec=name)
+            elapsed.append(time.time() - started)
+
+        if ds.data is None:
+            print("%-8s failed, see logfile" % name)
+            continue
+
+        megabytes = ds.data.nbytes / 1e6
+        best = min(elapsed)
+        print("%-8s %10.1f %10.2f %10.1f"
+              % (name, megabytes, best, megabytes / best))
+
+
+if __name__ == '__main__':
+    local_benchmark()
+
+    if len(sys.argv) == 6:
+        server_benchmark(sys.argv[1], sys.argv[2], sys.argv[3],
+                         dt.datetime.strptime(sys.argv[4], '%Y-%m-%d'),
+                         dt.datetime.strptime(sys.argv[5], '%Y-%m-%d'))
+    else:
+        server_benchmark('era5', 'skt', 'ken_prise',
+                         dt.datetime(2019, 1, 1), dt.datetime(2019, 1, 7))
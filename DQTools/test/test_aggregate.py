@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from DQTools.aggregate import aggregate_time
+
+
+def synthetic(nan_fraction=0.2):
+    """
+    Daily data over a small area, with some pixels missing.
+    """
+    random = np.random.RandomState(1)
+    times = pd.date_range('2019-11-20', '2020-03-10')
+    values = random.randn(len(times), 4, 5)
+    values[random.rand(*values.shape) < nan_fraction] = np.nan
+    # A pixel with data only in some months
+    values[:40, 0, 0] = np.nan
+    return xr.DataArray(values, dims=('time', 'latitude', 'longitude'),
+                        coords={'time': times,
+                                'latitude': np.arange(4.),
+                                'longitude': np.arange(5.)},
+                        name='skt')
+
+
+@pytest.mark.parametrize('frequency,freq', [('days', '1D'), ('months', '1MS'),
+                                            ('7D', '7D')])
+def test_by_pixel_matches_resample(frequency, freq):
+    data = synthetic()
+    result = aggregate_time(data, frequency, stats=('mean', 'min', 'max'),
+                            time_chunk=9)
+    resampled = data.resample(time=freq)
+
+    xr.testing.assert_allclose(result.periods['mean'],
+                               resampled.mean('time').rename(None),
+                               check_dim_order=False)
+    xr.testing.assert_allclose(result.periods['max'],
+                               resampled.max('time').rename(None),
+                               check_dim_order=False)
+    np.testing.assert_allclose(result.overall['mean'],
+                               resampled.mean('time').mean('time'))
+    np.testing.assert_allclose(result.overall['min'], data.min('time'))
+
+
+@pytest.mark.parametrize('frequency,freq', [('days', '1D'),
+                                            ('months', '1MS')])
+def test_by_area_matches_resample(frequency, freq):
+    data = synthetic()
+    result = aggregate_time(data, frequency, dims=['latitude', 'longitude'],
+                            time_chunk=13)
+    # The reduction average_subproduct has always used for areas
+    expected = data.resample(time=freq).mean('time') \
+        .mean(['longitude', 'latitude'])
+
+    np.testing.assert_allclose(result.periods['mean'], expected)
+    assert float(result.overall['mean']) == \
+        pytest.approx(float(expected.mean('time')))
+
+
+def test_lazy_data():
+    dask = pytest.importorskip('dask')
+    data = synthetic()
+    eager = aggregate_time(data, 'months', stats=('mean', 'std', 'count'))
+    lazy = aggregate_time(data.chunk({'time': 10}), 'months',
+                          stats=('mean', 'std', 'count'))
+    xr.testing.assert_allclose(lazy.overall, eager.overall)
+    xr.testing.assert_allclose(lazy.periods, eager.periods)
+    np.testing.assert_allclose(eager.overall['std'], data.std('time'))
+    np.testing.assert_allclose(eager.overall['count'], data.count('time'))
+
+
+def test_unknown_statistic():
+    with pytest.raises(ValueError):
+        aggregate_time(synthetic(), 'days', stats=('median',))
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import pickle
+import socket
+import threading
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web
+
+from DQTools.async_dataset import AsyncDataset
+from DQTools.connect.async_connect import AsyncConnect
+from DQTools.dataset import BaseDataset, Dataset
+
+
+@pytest.fixture(scope='module')
+def identfile(tmp_path_factory):
+    """
+    A credentials file for a server which echoes each request's command.
+    """
+    async def echo(request):
+        req = pickle.loads(await request.read())
+        return web.Response(body=pickle.dumps({'echo': req['command']}))
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    started = threading.Event()
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_post('/', echo)
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(
+            web.TCPSite(runner, '127.0.0.1', port).start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    started.wait(5)
+
+    path = tmp_path_factory.mktemp('ident') / 'ident.json'
+    path.write_text(json.dumps({'url': 'http://127.0.0.1', 'port': str(port),
+                                'pwd': 'x', 'login': 'me'}))
+    return str(path)
+
+
+def test_use_dask_rejected(identfile):
+    conn = AsyncConnect(identfile=identfile)
+    with pytest.raises(ValueError):
+        asyncio.run(conn.get_subproduct_data(
+            'era5', 'skt', None, None, use_dask=True, bounds=None, res=None,
+            tile='africa', country=None, latlon=None, projection=None))
+
+
+def test_async_dataset_is_read_only():
+    assert issubclass(AsyncDataset, BaseDataset)
+    assert not issubclass(AsyncDataset, Dataset)
+    assert not hasattr(AsyncDataset, 'put')
+    assert not hasattr(AsyncDataset, 'update')
+
+
+def test_get_meta(identfile):
+    async def run():
+        async with AsyncConnect(identfile=identfile) as conn:
+            result = await conn.get_subproduct_meta('era5', 'skt')
+            session = conn._session
+        return result, session
+
+    result, session = asyncio.run(run())
+    assert result == {'echo': 'GET_META'}
+    assert session.closed
+
+
+def test_session_per_loop(identfile):
+    conn = AsyncConnect(identfile=identfile)
+
+    async def run():
+        async with conn:
+            await conn.get_subproduct_meta('era5', 'skt')
+            return conn._session
+
+    first = asyncio.run(run())
+    assert first.closed and conn._session is None
+
+    # A second loop gets a new session, closed in turn
+    second = asyncio.run(run())
+    assert second is not first
+    assert second.closed
+
+
+def test_close_without_requests(identfile):
+    conn = AsyncConnect(identfile=identfile)
+    asyncio.run(conn.close())
+    assert conn._session is None
+
+
+def test_async_dataset_closes_own_connection(identfile):
+    shared = AsyncConnect(identfile=identfile)
+
+    async def run():
+        async with AsyncDataset('era5', 'skt', identfile=identfile) as own, \
+                AsyncDataset('era5', 'skt', conn=shared) as given:
+            await own.conn.get_subproduct_meta('era5', 'skt')
+            await given.conn.get_subproduct_meta('era5', 'skt')
+        sessions = own.conn._session, shared._session
+        await shared.close()
+        return sessions
+
+    own_session, shared_session = asyncio.run(run())
+    assert own_session is None
+    assert shared_session is not None
+
+
+def test_session_of_idle_loop_closed_on_it(identfile):
+    conn = AsyncConnect(identfile=identfile)
+    first_loop = asyncio.new_event_loop()
+    try:
+        first_loop.run_until_complete(
+            conn.get_subproduct_meta('era5', 'skt'))
+        first = conn._session
+
+        async def run():
+            async with conn:
+                await conn.get_subproduct_meta('era5', 'skt')
+
+        asyncio.run(run())
+        assert not first.closed
+
+        # Closed when its loop next runs
+        first_loop.run_until_complete(asyncio.sleep(0.1))
+        assert first.closed
+    finally:
+        first_loop.close()
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from DQTools.availability import AvailabilityIndex, ideal_timesteps
+
+
+class FakeConnect(object):
+    """
+    Serves the metadata of a sub-product and the time axis of one pixel.
+    """
+    class http_client(object):
+        full_url = 'http://127.0.0.1:1'
+        login = 'me'
+
+    def __init__(self, first, last, resolution, times=None):
+        self.meta = {'first_timestep': first, 'last_timestep': last,
+                     'time_resolution': resolution}
+        self.times = times
+        self.reads = 0
+
+    def get_subproduct_meta(self, product, subproduct):
+        return dict(self.meta)
+
+    def get_subproduct_data(self, **request):
+        self.reads += 1
+        if self.times is None:
+            raise IOError('no data')
+        return [xr.Dataset(coords={'time': self.times})]
+
+
+def dates(*values):
+    return list(pd.to_datetime(values).values)
+
+
+def test_ideal_timesteps():
+    daily = ideal_timesteps('2020-02-27', '2020-03-02', '1 days')
+    assert list(daily) == dates('2020-02-27', '2020-02-28', '2020-02-29',
+                                '2020-03-01', '2020-03-02')
+
+    # Dekads carry on across the year
+    dekads = ideal_timesteps('2019-12-11', '2020-01-20', '10 days')
+    assert list(dekads) == dates('2019-12-11', '2019-12-21', '2019-12-31',
+                                 '2020-01-10', '2020-01-20')
+
+    # MODIS 16 day composites restart on 1st January
+    modis = ideal_timesteps('2019-12-01', '2020-01-20', '16 days',
+                            yearly=True)
+    assert list(modis) == dates('2019-12-03', '2019-12-19', '2020-01-01',
+                                '2020-01-17')
+
+
+def test_index_lookups():
+    index = AvailabilityIndex(dates('2020-01-21', '2020-01-01', '2020-01-11',
+                                    '2020-01-01'))
+    assert len(index) == 3
+    assert index.first == pd.Timestamp('2020-01-01')
+    assert index.last == pd.Timestamp('2020-01-21')
+    assert '2020-01-11' in index and '2020-01-12' not in index
+    assert index.earlier('2020-01-12') == pd.Timestamp('2020-01-11')
+    assert index.later('2020-01-12') == pd.Timestamp('2020-01-21')
+    assert index.earlier('2019-12-31') is None
+    assert index.later('2020-02-01') is None
+    assert list(index.between('2020-01-01', '2020-01-11')) == \
+        dates('2020-01-01', '2020-01-11')
+    assert not index.complete
+
+
+def test_from_metadata_keeps_the_ends():
+    # The first time step is not on the ideal calendar
+    conn = FakeConnect('2020-01-03', '2020-02-14', '5 days')
+    index = AvailabilityIndex.for_subproduct(conn, 'chirps', 'rfe')
+    assert index.first == pd.Timestamp('2020-01-03')
+    assert index.last == pd.Timestamp('2020-02-14')
+    assert not index.exact and not index.complete
+
+    modis = AvailabilityIndex.for_subproduct(
+        FakeConnect('2020-01-01', '2020-02-02', '16 days'), 'MOD13A2', 'ndvi')
+    assert modis.complete
+    assert '2020-01-17' in modis and '2020-01-18' not in modis
+
+
+def test_read_at_a_pixel():
+    times = pd.to_datetime(['2020-01-01', '2020-01-02', '2020-01-05'])
+    conn = FakeConnect('2020-01-01', '2020-01-05', '1 days', times=times)
+    index = AvailabilityIndex.for_subproduct(conn, 'era5', 'skt',
+                                             latlon=[0, 0])
+    assert index.exact and index.complete
+    assert '2020-01-03' not in index
+
+    # Shared until the last time step moves on
+    assert AvailabilityIndex.for_subproduct(conn, 'era5', 'skt') is index
+    conn.meta['last_timestep'] = '2020-01-06'
+    conn.times = times.append(pd.to_datetime(['2020-01-06']))
+    index = AvailabilityIndex.for_subproduct(conn, 'era5', 'skt',
+                                             latlon=[0, 0])
+    assert index.last == pd.Timestamp('2020-01-06')
+    assert conn.reads == 2
+
+
+def test_unreadable_pixel_falls_back():
+    conn = FakeConnect('2020-01-01', '2020-01-05', '1 days')
+    index = AvailabilityIndex.for_subproduct(conn, 'tamsat', 'rfe',
+                                             latlon=[0, 0])
+    assert not index.exact
+    assert len(index) == 5
+    assert isinstance(index.timesteps, np.ndarray)
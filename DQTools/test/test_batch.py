@@ -0,0 +1,63 @@
+import pytest
+
+from DQTools.connect.DQclient import AssimilaData, BATCH_ACTION, \
+    BatchItemError, ServerError
+
+
+def client(port, batch_error=None):
+    """
+    An AssimilaData whose get() answers batches (or fails them with
+    batch_error) and single requests without a server.
+    """
+    data = AssimilaData(url='http://127.0.0.1', port=str(port), pwd='x',
+                        login='me')
+    data.batches = 0
+
+    def get(req, codec=None):
+        if req.get('action') == BATCH_ACTION:
+            data.batches += 1
+            if batch_error is not None:
+                raise batch_error
+            return [{'result': r['params']['n']}
+                    for r in req['params']['requests']]
+        if req['params']['n'] < 0:
+            raise ServerError('no such thing', status=500)
+        return req['params']['n']
+
+    data.get = get
+    return data
+
+
+def requests(*ns):
+    return [{'command': 'GET_META', 'params': {'n': n}} for n in ns]
+
+
+def test_batched():
+    data = client(9001)
+    assert data.get_many(requests(1, 2, 3)) == [1, 2, 3]
+    assert data.batches == 1
+
+
+def test_single_failures_returned_in_place():
+    data = client(9002, batch_error=ServerError('Unknown action', 500))
+    results = data.get_many(requests(1, -1, 3))
+    assert results[0] == 1 and results[2] == 3
+    assert isinstance(results[1], BatchItemError)
+
+
+@pytest.mark.parametrize('error', [
+    ServerError('Bad request', status=400),
+    ServerError("Unknown action 'batch'", status=500)])
+def test_rejected_batches_not_retried(error):
+    data = client(9003 + (error.status == 500), batch_error=error)
+    assert data.get_many(requests(1, 2)) == [1, 2]
+    assert data.get_many(requests(1, 2)) == [1, 2]
+    assert data.batches == 1
+
+
+def test_transient_failure_keeps_batching():
+    data = client(9010, batch_error=ServerError('Service unavailable', 503))
+    assert data.get_many(requests(1, 2)) == [1, 2]
+    assert data.get_many(requests(1, 2)) == [1, 2]
+    assert data.batches == 2
+    assert data.full_url not in AssimilaData._no_batch
@@ -0,0 +1,84 @@
+import json
+
+import pandas as pd
+
+from DQTools.connect.catalog import CatalogStore
+from DQTools.connect.connect import Connect
+
+
+class FakeConnect(object):
+    """
+    Serves a product table whose version is its number of rows.
+    """
+    class http_client(object):
+        full_url = 'http://127.0.0.1:1'
+        login = 'me'
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.downloads = 0
+
+    def get_table_if_changed(self, tablename, version):
+        current = str(len(self.names))
+        if version == current:
+            return None, version
+        self.downloads += 1
+        return pd.DataFrame({'idproduct': range(len(self.names)),
+                             'name': self.names}), current
+
+
+def test_find(tmp_path):
+    store = CatalogStore(str(tmp_path / 'catalog.sqlite'))
+    conn = FakeConnect(['era5', 'chirps'])
+
+    found = store.find(conn, 'product', name='chirps')
+    assert list(found.idproduct) == [1]
+    assert conn.downloads == 1
+
+    # Found in the stored table
+    assert list(store.find(conn, 'product', name='era5').idproduct) == [0]
+
+
+def test_find_new_entry(tmp_path):
+    store = CatalogStore(str(tmp_path / 'catalog.sqlite'))
+    conn = FakeConnect(['era5'])
+    store.table(conn, 'product')
+
+    # Added to the DataCube after the table was stored
+    conn.names.append('tamsat')
+    found = store.find(conn, 'product', name='tamsat')
+    assert list(found.idproduct) == [1]
+
+
+def test_find_missing(tmp_path):
+    store = CatalogStore(str(tmp_path / 'catalog.sqlite'))
+    conn = FakeConnect(['era5'])
+    store.table(conn, 'product')
+
+    found = store.find(conn, 'product', name='nothing')
+    assert found.empty
+    assert list(found.columns) == ['idproduct', 'name']
+    assert conn.downloads == 1
+
+
+def test_registration_forgets_tables(tmp_path, monkeypatch):
+    store = CatalogStore(str(tmp_path / 'catalog.sqlite'))
+    monkeypatch.setattr(CatalogStore, '_shared', {'test': store})
+    ident = tmp_path / 'ident.json'
+    ident.write_text(json.dumps({'url': 'http://127.0.0.1', 'port': '1',
+                                 'pwd': 'x', 'login': 'me'}))
+    conn = Connect(identfile=str(ident))
+    conn.http_client.put = lambda *args, **kwargs: None
+    server = FakeConnect(['era5'])
+    conn.get_table_if_changed = server.get_table_if_changed
+    store.table(conn, 'product')
+
+    conn._put({'command': 'PUT_DATA', 'action': 'put_data'})
+    store.table(conn, 'product')
+    assert server.downloads == 1
+
+    conn.register_product({'name': 'tamsat'})
+    server.names.append('tamsat')
+    # Downloaded straight away rather than revalidated in the background
+    assert list(store.table(conn, 'product').name) == ['era5', 'tamsat']
+    assert server.downloads == 2
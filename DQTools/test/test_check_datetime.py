@@ -0,0 +1,80 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from DQTools import check_datetime
+from DQTools.check_datetime import Datetime_checker, FORMATS
+
+WHEN = dt.datetime(2020, 3, 4, 5, 6, 7)
+# WHEN written in each accepted format
+STRINGS = [WHEN.strftime(fmt) for fmt in FORMATS]
+
+
+@pytest.fixture(autouse=True)
+def no_last_format(monkeypatch):
+    monkeypatch.setattr(check_datetime, '_last_format', [None])
+
+
+def scalar(value):
+    """
+    c_and_c() of a value, as c_and_c_array() gives it.
+    """
+    converted = Datetime_checker(time=value).c_and_c()
+    if converted is None:
+        return np.datetime64('NaT')
+    return np.datetime64(converted, 'ns')
+
+
+def check(values):
+    result = Datetime_checker(time=values).c_and_c_array()
+    assert result.dtype == np.dtype('datetime64[ns]')
+    np.testing.assert_array_equal(result, [scalar(value) for value in values])
+    return result
+
+
+def test_each_format():
+    result = check(STRINGS)
+    assert not np.isnat(result).any()
+
+
+def test_mixed_values():
+    values = [STRINGS[2], np.datetime64('2020-01-02T03:04:05.678'),
+              dt.date(2020, 1, 2), WHEN, pd.Timestamp('2021-06-30 12:00'),
+              STRINGS[0], '31/02/2020', 'tomorrow', '', None, 20200102,
+              STRINGS[5], '2020-1-2']
+    result = check(values)
+    assert np.isnat(result[6:11]).all()
+    # Fractions of a second of numpy datetimes are dropped
+    assert result[1] == np.datetime64('2020-01-02T03:04:05')
+
+
+def test_containers():
+    series = pd.Series(STRINGS[:3])
+    np.testing.assert_array_equal(
+        Datetime_checker(time=series).c_and_c_array(),
+        Datetime_checker(time=list(series)).c_and_c_array())
+
+    times = np.array(['2020-01-01T10:00:00.5', 'NaT'], dtype='datetime64[ms]')
+    result = Datetime_checker(time=times).c_and_c_array()
+    assert result[0] == np.datetime64('2020-01-01T10:00:00')
+    assert np.isnat(result[1])
+    assert len(Datetime_checker(time=[]).c_and_c_array()) == 0
+
+
+def test_last_format_kept_between_batches():
+    days = ['%02d/03/2020' % day for day in range(1, 29)]
+    check(days)
+    assert check_datetime._last_format[0] == '%d/%m/%Y'
+
+    # A batch in another format finds its own, and mixed batches still
+    # parse every value as c_and_c() does
+    check(['2020-03-%02d' % day for day in range(1, 29)])
+    assert check_datetime._last_format[0] == '%Y-%m-%d'
+    check(days[:3] + STRINGS)
+    assert check_datetime._last_format[0] == '%d/%m/%Y'
+
+    # A batch whose first value matches no format leaves it alone
+    check(['never'] + STRINGS)
+    assert check_datetime._last_format[0] == '%d/%m/%Y'
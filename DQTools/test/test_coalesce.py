@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+
+import pytest
+
+from DQTools.connect.connect import Connect
+
+REQUEST = {'command': 'GET_DATA', 'params': {'product': 'era5',
+                                             'subproduct': 'skt'}}
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = tmp_path / 'ident.json'
+    path.write_text(json.dumps({'url': 'http://127.0.0.1', 'port': '1',
+                                'pwd': 'x', 'login': 'me'}))
+    conn = Connect(identfile=str(path))
+    conn.calls = []
+    conn.release = threading.Event()
+    conn.error = None
+
+    def get(request, codec=None):
+        conn.calls.append(request)
+        assert conn.release.wait(5)
+        if conn.error is not None:
+            raise conn.error
+        return {'values': [1, 2, 3], 'request': request}
+
+    conn.http_client.get = get
+    yield conn
+    conn.release.set()
+
+
+def waiting(count):
+    """
+    Wait until count callers are waiting for requests already sent.
+    """
+    for _ in range(500):
+        with Connect._in_flight_lock:
+            if sum(flight.waiting
+                   for flight in Connect._in_flight.values()) >= count:
+                return
+        time.sleep(0.01)
+    raise AssertionError("Callers did not join the request")
+
+
+def run(callers):
+    """
+    Start a thread for each caller, returning a function which joins them
+    and gives each caller's result or error in order.
+    """
+    outcomes = [None] * len(callers)
+
+    def call(i):
+        try:
+            outcomes[i] = callers[i]()
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,))
+               for i in range(len(callers))]
+    for thread in threads:
+        thread.start()
+
+    def join():
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+    return join
+
+
+def test_identical_requests_sent_once(conn):
+    join = run([lambda: conn._get(dict(REQUEST))] * 8)
+    waiting(7)
+    conn.release.set()
+    results = join()
+
+    assert len(conn.calls) == 1
+    assert all(result == results[0] for result in results)
+    # Each caller has its own copy
+    assert len(set(id(result) for result in results)) == 8
+    assert Connect._in_flight == {}
+
+
+def test_error_reaches_every_caller(conn):
+    conn.error = IOError('server down')
+    join = run([lambda: conn._get(dict(REQUEST))] * 4)
+    waiting(3)
+    conn.release.set()
+    assert all(outcome is conn.error for outcome in join())
+    assert len(conn.calls) == 1
+    assert Connect._in_flight == {}
+
+    # The error is not kept: the next request is sent again
+    conn.error = None
+    assert conn._get(dict(REQUEST))['values'] == [1, 2, 3]
+    assert len(conn.calls) == 2
+
+
+def test_different_requests_not_merged(conn):
+    other = dict(REQUEST, params={'product': 'era5', 'subproduct': 't2m'})
+    join = run([lambda: conn._get(dict(REQUEST)),
+                lambda: conn._get(other),
+                lambda: conn._get_once(dict(REQUEST), codec='zstd')])
+    for _ in range(500):
+        if len(conn.calls) == 3:
+            break
+        time.sleep(0.01)
+    conn.release.set()
+    results = join()
+
+    assert len(conn.calls) == 3
+    assert [result['request'] for result in results] == \
+        [REQUEST, other, REQUEST]
+    assert Connect._in_flight == {}
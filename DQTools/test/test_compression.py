@@ -0,0 +1,32 @@
+import io
+
+import pytest
+
+from DQTools.connect import compression
+
+PAYLOAD = b''.join(b'%d,' % n for n in range(100000))
+
+
+@pytest.mark.parametrize('name', compression.available())
+def test_round_trip(name):
+    codec = compression.get_codec(name)
+    compressed = b''.join(codec.compress_chunks(
+        PAYLOAD[start:start + 4096] for start in range(0, len(PAYLOAD), 4096)))
+    assert codec.open(io.BytesIO(compressed)).read() == PAYLOAD
+    if name != 'none':
+        assert len(compressed) < len(PAYLOAD)
+
+
+def test_get_codec():
+    assert compression.get_codec(None).name == compression.DEFAULT_CODEC
+    assert compression.get_codec(' GZIP ').name == 'gzip'
+    with pytest.raises(ValueError):
+        compression.get_codec('brotli')
+
+
+def test_choose():
+    assert compression.choose(['none', 'gzip'], ['gzip']).name == 'gzip'
+    assert compression.choose(['none', 'gzip'], ['none', 'gzip']).name == \
+        'none'
+    # The server did not say which it accepts
+    assert compression.choose(['none'], []).name == compression.DEFAULT_CODEC
@@ -0,0 +1,123 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from DQTools.cube_cache import CubeCache, cache_key
+
+DAYS = pd.date_range('2020-01-01', '2020-03-31')
+
+
+def cube(start, stop):
+    """
+    Synthetic daily data, the same whichever period is asked for.
+    """
+    times = DAYS[(DAYS >= start) & (DAYS <= stop)]
+    values = np.arange(len(DAYS), dtype='float32')[DAYS.isin(times)]
+    return xr.Dataset({'skt': (('time',), values)}, coords={'time': times})
+
+
+class Fetches(object):
+    def __init__(self):
+        self.ranges = []
+
+    def __call__(self, start, stop):
+        self.ranges.append((start, stop))
+        return cube(start, stop)
+
+
+def tracked(cache):
+    """
+    Record which of the cubes opened by the cache are closed again.
+    """
+    handles = []
+    _open = cache._open
+
+    def open_tracked(filename):
+        data = _open(filename)
+        closer = data._close
+        state = {'closed': False}
+
+        def close():
+            state['closed'] = True
+            if closer is not None:
+                closer()
+
+        data.set_close(close)
+        handles.append(state)
+        return data
+
+    cache._open = open_tracked
+    return handles
+
+
+def test_cache_key_stable():
+    assert cache_key('s', {'a': 1, 'b': 2}) == cache_key('s', {'b': 2, 'a': 1})
+    assert cache_key('s', {'a': 1}) != cache_key('s', {'a': 2})
+
+
+def test_put_get(tmp_path):
+    cache = CubeCache(str(tmp_path))
+    cache.put('k', cube(DAYS[0], DAYS[9]), tag='gold')
+
+    assert cache.get('k', tag='gold').skt.values.tolist() == list(range(10))
+    # Stale once the tag moves on
+    assert cache.get('k', tag='new gold') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_get_range_fetches_missing(tmp_path):
+    cache = CubeCache(str(tmp_path))
+    fetch = Fetches()
+
+    first = cache.get_range('s', datetime(2020, 1, 10), datetime(2020, 1, 20),
+                            fetch)
+    xr.testing.assert_equal(first.load(), cube(DAYS[9], DAYS[19]))
+
+    handles = tracked(cache)
+    start, stop = datetime(2020, 1, 1), datetime(2020, 2, 10)
+    data = cache.get_range('s', start, stop, fetch)
+    xr.testing.assert_equal(data.load(), cube(start, stop))
+
+    # Only the ranges either side of the cached cube are fetched
+    assert fetch.ranges[1:] == [(start, datetime(2020, 1, 10)),
+                                (datetime(2020, 1, 20), stop)]
+    assert cache.stats()['entries'] == 1
+    assert handles[0]['closed']
+
+
+def test_get_range_store_failure(tmp_path):
+    cache = CubeCache(str(tmp_path))
+    fetch = Fetches()
+    cache.get_range('s', datetime(2020, 1, 10), datetime(2020, 1, 20), fetch)
+
+    handles = tracked(cache)
+    cache._store = lambda *args, **kwargs: False
+    start, stop = datetime(2020, 1, 5), datetime(2020, 1, 25)
+    data = cache.get_range('s', start, stop, fetch)
+
+    xr.testing.assert_equal(data, cube(start, stop))
+    assert handles and all(handle['closed'] for handle in handles)
+
+
+def test_evict_while_in_use(tmp_path):
+    cache = CubeCache(str(tmp_path))
+    handles = tracked(cache)
+    cache.put('k', cube(DAYS[0], DAYS[9]))
+    data = cache.get('k')
+    fetch = Fetches()
+    span = cache.get_range('s', datetime(2020, 1, 10), datetime(2020, 1, 20),
+                           fetch)
+    assert handles and all(handle['closed'] for handle in handles)
+
+    # Room for one cube only: storing another evicts the ones in use
+    cache.max_bytes = cache.stats()['bytes'] // 2
+    cache.put('other', cube(DAYS[30], DAYS[39]))
+    assert cache.get('k') is None
+    assert not [name for name in os.listdir(str(tmp_path))
+                if name.endswith('.nc') and not name.startswith('other')]
+
+    xr.testing.assert_equal(data, cube(DAYS[0], DAYS[9]))
+    xr.testing.assert_equal(span, cube(DAYS[9], DAYS[19]))
@@ -0,0 +1,84 @@
+import json
+
+import DQTools.dataset as dataset
+from DQTools.connect.connect import Connect
+from DQTools.cube_cache import CubeCache
+
+
+class FakeConnect(Connect):
+    """
+    Serves sub-product metadata whose last gold moves on with each
+    update, through the metadata cache shared by all Connect objects.
+    """
+    last_gold = '2020-01-01'
+
+    def __init__(self, identfile=None, sysfile=None):
+        super(FakeConnect, self).__init__(identfile=identfile,
+                                          sysfile=sysfile)
+        self.http_client.get = self.get
+
+    def get(self, request, codec=None):
+        return {'time_resolution': '1 days',
+                'first_timestep': '2000-01-01',
+                'last_timestep': FakeConnect.last_gold,
+                'last_gold': FakeConnect.last_gold,
+                'fill_value': -999,
+                'all_subproduct_tiles': ['africa'],
+                'description': request['params']['subproduct']}
+
+
+class Script(object):
+    @staticmethod
+    def update():
+        FakeConnect.last_gold = '2020-02-01'
+
+
+def test_update_keeps_options(monkeypatch, tmp_path):
+    monkeypatch.setattr(dataset, 'Connect', FakeConnect)
+    monkeypatch.setattr(FakeConnect, 'last_gold', '2020-01-01')
+    Connect.metadata_cache.invalidate()
+    ident = tmp_path / 'ident.json'
+    ident.write_text(json.dumps({'url': 'http://127.0.0.1', 'port': '1',
+                                 'pwd': 'x', 'login': 'me'}))
+    cache = CubeCache(str(tmp_path))
+
+    ds = dataset.Dataset('era5', 'skt', tile='africa', res=0.1,
+                         identfile=str(ident), cube_cache=cache)
+    other = dataset.Dataset('era5', 't2m', tile='africa',
+                            identfile=str(ident))
+    conn = ds.conn
+    assert ds.last_gold == '2020-01-01'
+
+    ds.update(Script)
+
+    # Not the metadata cached before the update
+    assert ds.last_gold == '2020-02-01'
+    assert ds.cube_cache is cache
+    assert ds.res == 0.1
+    assert ds.tile == 'africa'
+    assert ds.conn is conn
+
+    # Only the updated sub-product's metadata were dropped
+    stats = Connect.metadata_cache.stats()
+    other._load_metadata()
+    assert other.last_gold == '2020-01-01'
+    assert Connect.metadata_cache.stats()['hits'] == stats['hits'] + 1
+
+
+def test_failures_added_to_messages(monkeypatch, capsys, tmp_path):
+    def fail(self, request, codec=None):
+        raise IOError('server down')
+    monkeypatch.setattr(dataset, 'Connect', FakeConnect)
+    monkeypatch.setattr(FakeConnect, 'get', fail)
+    Connect.metadata_cache.invalidate()
+    ident = tmp_path / 'ident.json'
+    ident.write_text(json.dumps({'url': 'http://127.0.0.1', 'port': '1',
+                                 'pwd': 'x', 'login': 'me'}))
+
+    messages = []
+    ds = dataset.Dataset('era5', 'skt', identfile=str(ident),
+                         messages=messages)
+    ds.get_data('2020-01-01', '2020-01-02', latlon=[0, 0])
+    assert ds.data is None
+    assert len(messages) == 2
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,168 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+import pytest
+import requests
+
+from DQTools.connect import DQclient
+from DQTools.connect.DQclient import APIRequest, ChecksumError, \
+    HDR_CHECKSUM, HDR_ENCODING, PART_SUFFIX, STATE_SUFFIX, ServerError
+
+CONTENT = os.urandom(50000) + b'0123456789' * 5000
+BODY = gzip.compress(CONTENT)
+CHECKSUM = 'sha256=' + hashlib.sha256(CONTENT).hexdigest()
+
+
+class Response(object):
+    def __init__(self, status_code, body=b'', headers=None, fail_after=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = dict(headers or {})
+        self.fail_after = fail_after
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            if self.fail_after is not None and start >= self.fail_after:
+                raise requests.exceptions.ChunkedEncodingError('dropped')
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class Server(object):
+    """
+    Serves BODY, honouring Range headers unless told otherwise.
+    """
+    def __init__(self, checksum=CHECKSUM, ignore_range=False,
+                 range_error=False, fail_after=None, changing=False,
+                 always_partial=False):
+        self.checksum = checksum
+        self.ignore_range = ignore_range
+        self.range_error = range_error
+        self.fail_after = fail_after
+        self.changing = changing
+        self.always_partial = always_partial
+        self.ranges = []
+
+    def post(self, url, auth=None, data=None, headers=None, stream=False):
+        offset = int(headers['Range'][6:-1]) if 'Range' in headers else None
+        self.ranges.append(offset)
+        if self.always_partial:
+            offset = offset or 10000
+        sent = {HDR_ENCODING: 'gzip', HDR_CHECKSUM: self.checksum}
+        if self.changing:
+            sent[HDR_CHECKSUM] = 'sha256=%d' % len(self.ranges)
+        fail_after, self.fail_after = self.fail_after, None
+        if offset is None or self.ignore_range:
+            return Response(200, BODY, sent, fail_after)
+        if self.range_error:
+            return Response(416, headers={'error': 'range'})
+        return Response(206, BODY[offset:], sent, fail_after)
+
+
+def client(server):
+    return APIRequest(logging.getLogger('test'), 'GET_FILE',
+                      'http://127.0.0.1:1', 'me', 'x', pool=server,
+                      chunk_size=4096, codecs=['gzip'])
+
+
+def download(server, target):
+    client(server).get_from_dq({'command': 'GET_FILE', 'params': {},
+                                'target': str(target)})
+
+
+def left_over(target):
+    return [name for name in os.listdir(os.path.dirname(str(target)))
+            if name != os.path.basename(str(target))]
+
+
+def partial(target, size, checksum=CHECKSUM):
+    part = str(target) + PART_SUFFIX
+    with open(part, 'wb') as f:
+        f.write(BODY[:size])
+    with open(part + STATE_SUFFIX, 'w') as f:
+        json.dump({'encoding': 'gzip', 'checksum': checksum}, f)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(DQclient, 'RETRY_BACKOFF', 0)
+
+
+def test_fresh_download(tmp_path):
+    target = tmp_path / 'file.tif'
+    server = Server()
+    download(server, target)
+    assert target.read_bytes() == CONTENT
+    assert server.ranges == [None]
+    assert left_over(target) == []
+
+
+def test_resumed_after_partial_write(tmp_path):
+    target = tmp_path / 'file.tif'
+    partial(target, 10000)
+    server = Server()
+    download(server, target)
+    assert target.read_bytes() == CONTENT
+    assert server.ranges == [10000]
+
+
+def test_resumed_after_dropped_connection(tmp_path):
+    target = tmp_path / 'file.tif'
+    server = Server(fail_after=8192)
+    download(server, target)
+    assert target.read_bytes() == CONTENT
+    assert server.ranges == [None, 8192]
+
+
+def test_range_ignored(tmp_path):
+    target = tmp_path / 'file.tif'
+    partial(target, 10000)
+    server = Server(ignore_range=True)
+    download(server, target)
+    # The whole body replaced the partial file rather than being appended
+    assert target.read_bytes() == CONTENT
+    assert server.ranges == [10000]
+
+
+def test_range_not_satisfiable(tmp_path):
+    target = tmp_path / 'file.tif'
+    partial(target, 10000)
+    server = Server(range_error=True)
+    download(server, target)
+    assert target.read_bytes() == CONTENT
+    assert server.ranges == [10000, None]
+
+
+def test_partial_of_a_different_file(tmp_path):
+    target = tmp_path / 'file.tif'
+    partial(target, 10000, checksum='sha256=other')
+    server = Server()
+    download(server, target)
+    assert target.read_bytes() == CONTENT
+    assert server.ranges == [10000, None]
+
+
+def test_restarted_once_only(tmp_path):
+    target = tmp_path / 'file.tif'
+    partial(target, 10000, checksum='sha256=other')
+    # Every answer is the end of a different file
+    server = Server(changing=True, always_partial=True)
+    with pytest.raises(ServerError):
+        download(server, target)
+    assert len(server.ranges) == 2
+    assert not target.exists()
+
+
+def test_checksum_mismatch(tmp_path):
+    target = tmp_path / 'file.tif'
+    server = Server(checksum='sha256=' + '0' * 64)
+    with pytest.raises(ChecksumError):
+        download(server, target)
+    assert not target.exists()
+    assert left_over(target) == []
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+pytest.importorskip('dask')
+
+import DQTools.dataset as dataset
+from DQTools.lazy import grid_centre, lazy_dataset
+
+# Five-day composites which do not start on the first ideal time step
+TIMES = pd.date_range('2020-01-03', '2020-06-30', freq='5D')
+CUBE = xr.Dataset(
+    {'ndvi': (('time', 'latitude', 'longitude'),
+              np.random.RandomState(0).rand(len(TIMES), 3, 4))},
+    coords={'time': TIMES, 'latitude': [10., 9.5, 9.],
+            'longitude': [30., 30.5, 31., 31.5]})
+
+
+class FakeConnect(object):
+    """
+    Serves the data of CUBE.
+    """
+    def __init__(self, identfile=None, sysfile=None):
+        self.requests = []
+
+    def get_subproduct_meta(self, product, subproduct, bounds, tile):
+        return {'time_resolution': '5 days',
+                'first_timestep': '2020-01-01',
+                'last_timestep': '2020-06-30',
+                'last_gold': '2020-06-30',
+                'fill_value': -999,
+                'all_subproduct_tiles': ['africa'],
+                'description': 'test'}
+
+    def get_subproduct_data(self, product, subproduct, start, stop, use_dask,
+                            bounds, res, tile, country, latlon, projection,
+                            codec=None, time_window=None):
+        self.requests.append((start, stop, latlon))
+        data = CUBE.sel(time=slice(pd.Timestamp(start), pd.Timestamp(stop)))
+        if tile:
+            pass
+        elif latlon:
+            data = data.sel(latitude=latlon[0], longitude=latlon[1],
+                            method='nearest')
+        else:
+            data = data.sel(latitude=slice(bounds.north, bounds.south),
+                            longitude=slice(bounds.west, bounds.east))
+        return [data]
+
+
+@pytest.fixture
+def ds(monkeypatch):
+    monkeypatch.setattr(dataset, 'Connect', FakeConnect)
+    return dataset.Dataset('modis', 'ndvi', tile='africa',
+                           identfile='ident.json')
+
+
+@pytest.mark.parametrize('region', [None, [10, 31.5, 9, 30.5]])
+def test_lazy_matches_eager(ds, region):
+    if region is not None:
+        ds.tile = None
+    ds.get_data('2020-01-01', '2020-04-30', region=region)
+    eager = ds.data
+
+    ds.get_data('2020-01-01', '2020-04-30', region=region, lazy=True,
+                time_chunk=4)
+    lazy = ds.data
+    assert lazy is not None
+    assert lazy.ndvi.chunks[0][0] == 4
+
+    xr.testing.assert_equal(lazy.compute(), eager)
+    assert float(lazy.ndvi.mean()) == pytest.approx(float(eager.ndvi.mean()))
+
+
+def test_grid_centre():
+    assert grid_centre(CUBE) == (9.5, 31.0)
+    assert grid_centre(CUBE.ndvi.mean(['latitude', 'longitude'])
+                       .to_dataset()) is None
+
+
+def test_chunk_with_other_times_fails():
+    def fetch(start, stop):
+        return CUBE.sel(time=slice(start, stop))
+
+    planned = pd.date_range('2020-01-01', '2020-02-01', freq='5D').values
+    data = lazy_dataset(fetch, planned, CUBE.isel(time=[0]), time_chunk=2)
+    with pytest.raises(ValueError):
+        data.compute()
+
+
+def test_dask_pointer_not_merged(ds, monkeypatch):
+    def pointers(*args, **kwargs):
+        return ['/data/modis/ndvi.vrt', '/data/modis/evi.vrt']
+    monkeypatch.setattr(ds.conn, 'get_subproduct_data', pointers)
+
+    ds.get_data('2020-01-01', '2020-04-30', use_dask=True, lazy=True)
+    assert ds.data == '/data/modis/ndvi.vrt'
@@ -0,0 +1,59 @@
+import time
+
+from DQTools.connect.cache import MetadataCache
+
+
+def test_get_put():
+    cache = MetadataCache()
+    assert cache.get(('server', 'a')) == (False, None)
+    value = {'names': ['era5']}
+    cache.put(('server', 'a'), value)
+
+    # Copies are stored and returned
+    value['names'].append('chirps')
+    found, cached = cache.get(('server', 'a'))
+    assert found and cached == {'names': ['era5']}
+    cached['names'].append('tamsat')
+    assert cache.get(('server', 'a'))[1] == {'names': ['era5']}
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'entries': 1}
+
+
+def test_expiry(monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    cache = MetadataCache(default_ttl=10,
+                          action_ttls={'subproduct': 1, 'never': 0})
+    assert cache.ttl_for({'action': 'subproduct'}) == 1
+    assert cache.ttl_for({'action': 'product'}) == 10
+
+    cache.put('a', 1)
+    cache.put('b', 2, ttl=cache.ttl_for({'action': 'subproduct'}))
+    cache.put('c', 3, ttl=cache.ttl_for({'action': 'never'}))
+    now[0] += 5
+    assert cache.get('a') == (True, 1)
+    assert cache.get('b') == (False, None)
+    assert cache.get('c') == (False, None)
+
+
+def test_lru_and_invalidate():
+    cache = MetadataCache(max_entries=2)
+    cache.put(('s1', 'a'), 1)
+    cache.put(('s2', 'b'), 2)
+    cache.get(('s1', 'a'))
+    cache.put(('s1', 'c'), 3)
+    # The least recently used entry was dropped
+    assert not cache.get(('s2', 'b'))[0]
+
+    cache.invalidate('s1')
+    assert cache.stats()['entries'] == 0
+
+
+def test_invalidate_matching():
+    cache = MetadataCache()
+    cache.put(('s1', 'me', 'a'), 1)
+    cache.put(('s1', 'me', 'b'), 2)
+    cache.put(('s2', 'me', 'a'), 3)
+    cache.invalidate('s1', match=lambda key: key[2] == 'a')
+    assert cache.get(('s1', 'me', 'a')) == (False, None)
+    assert cache.get(('s1', 'me', 'b')) == (True, 2)
+    assert cache.get(('s2', 'me', 'a')) == (True, 3)
@@ -0,0 +1,130 @@
+import datetime
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from DQTools.connect.connect import Connect
+from DQTools.connect.planner import DEFAULT_TIME_WINDOW, join, join_times, \
+    plan, stitch, sub_boxes, time_windows
+from DQTools.regions import Bounds
+
+START = datetime.datetime(2019, 1, 1)
+STOP = datetime.datetime(2021, 6, 30)
+BOUNDS = Bounds(north=10., south=0., east=30., west=20.)
+
+TIMES = pd.date_range(START, STOP)
+CUBE = xr.Dataset(
+    {'skt': (('time', 'latitude', 'longitude'),
+             np.random.RandomState(0).rand(len(TIMES), 21, 21))},
+    coords={'time': TIMES, 'latitude': np.linspace(10, 0, 21),
+            'longitude': np.linspace(20, 30, 21)})
+
+
+def fetch(start, stop, bounds):
+    """
+    The pieces of CUBE a GET_DATA request returns, both ends included.
+    """
+    return [CUBE.sel(time=slice(start, stop),
+                     latitude=slice(bounds.north, bounds.south),
+                     longitude=slice(bounds.west, bounds.east))]
+
+
+def test_time_windows():
+    windows = time_windows(START, STOP, DEFAULT_TIME_WINDOW)
+    assert len(windows) == 3
+    assert windows[0][0] == START and windows[-1][1] == STOP
+    # Neighbouring windows share their boundary
+    for (_, high), (low, _) in zip(windows[:-1], windows[1:]):
+        assert high == low
+
+    assert time_windows(START, STOP, None) == [(START, STOP)]
+    assert time_windows(START, START + datetime.timedelta(days=10),
+                        DEFAULT_TIME_WINDOW) == \
+        [(START, START + datetime.timedelta(days=10))]
+
+
+def test_sub_boxes():
+    grid = sub_boxes(BOUNDS, (2, 3))
+    assert len(grid) == 2 and all(len(row) == 3 for row in grid)
+    assert grid[0][0].north == 10. and grid[-1][-1].south == 0.
+    assert grid[0][0].west == 20. and grid[-1][-1].east == 30.
+    assert grid[0][0].south == grid[1][0].north
+    assert grid[0][0].east == grid[0][1].west
+    assert sub_boxes(BOUNDS, None) == [[BOUNDS]]
+
+
+@pytest.mark.parametrize('boxes', [None, (2, 2), (3, 4)])
+def test_stitch_matches_single_request(boxes):
+    pieces = plan(START, STOP, BOUNDS, time_window=DEFAULT_TIME_WINDOW,
+                  boxes=boxes)
+    results = [[[fetch(low, high, box) for box in row] for row in grid]
+               for low, high, grid in pieces]
+
+    joined = stitch(results)
+    assert len(joined) == 1
+    single = fetch(START, STOP, BOUNDS)[0]
+    # The time steps and pixels on the boundaries are not repeated
+    assert joined[0].sizes == single.sizes
+    xr.testing.assert_identical(joined[0], single)
+
+
+def test_join_times_keeps_one_of_each():
+    pieces = [CUBE.isel(time=slice(10, 20)), CUBE.isel(time=slice(0, 11)),
+              CUBE.isel(time=slice(19, 25))]
+    xr.testing.assert_identical(join_times(pieces),
+                                CUBE.isel(time=slice(0, 25)))
+
+
+def test_join_tolerates_rounding():
+    west = CUBE.isel(time=0, longitude=slice(0, 11))
+    east = CUBE.isel(time=0, longitude=slice(10, None))
+    east = east.assign_coords(longitude=east.longitude + 1e-9)
+    joined = join([west, east], 'longitude')
+    assert joined.sizes['longitude'] == 21
+    np.testing.assert_allclose(joined.longitude, CUBE.longitude)
+
+
+def test_join_refuses_gaps():
+    with pytest.raises(ValueError):
+        join([CUBE.isel(time=0, longitude=slice(0, 8)),
+              CUBE.isel(time=0, longitude=slice(10, None))], 'longitude')
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = tmp_path / 'ident.json'
+    path.write_text(json.dumps({'url': 'http://127.0.0.1', 'port': '1',
+                                'pwd': 'x', 'login': 'me'}))
+    conn = Connect(identfile=str(path))
+    conn.requests = []
+
+    def get(request, codec=None):
+        params = request['params']
+        conn.requests.append(params)
+        return fetch(params['start_date'], params['end_date'],
+                     Bounds(params['north'], params['south'],
+                            params['east'], params['west']))
+
+    conn.http_client.get = get
+    return conn
+
+
+def request(conn, **options):
+    return conn.get_subproduct_data('era5', 'skt', START, STOP, False,
+                                    BOUNDS, None, None, None, None, None,
+                                    **options)
+
+
+def test_single_request_by_default(conn):
+    data = request(conn)
+    assert len(conn.requests) == 1
+    xr.testing.assert_identical(data[0], fetch(START, STOP, BOUNDS)[0])
+
+
+def test_split_when_asked(conn):
+    data = request(conn, time_window=DEFAULT_TIME_WINDOW, boxes=(2, 2))
+    assert len(conn.requests) == 12
+    xr.testing.assert_identical(data[0], fetch(START, STOP, BOUNDS)[0])
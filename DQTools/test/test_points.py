@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from DQTools.points import PointIndex, as_points, covering_bounds, \
+    extract_points
+
+DATA = xr.Dataset(
+    {'skt': (('time', 'latitude', 'longitude'),
+             np.random.RandomState(0).rand(3, 5, 6))},
+    coords={'time': pd.date_range('2020-01-01', periods=3),
+            'latitude': np.linspace(2, 0, 5),
+            'longitude': np.linspace(10, 12.5, 6)})
+
+POINTS = pd.DataFrame({'latitude': [1.9, 0.6, 0.1],
+                       'longitude': [10.2, 11.4, 12.4]},
+                      index=['a', 'b', 'c'])
+
+
+def test_as_points():
+    points = as_points(POINTS)
+    assert list(points.labels) == ['a', 'b', 'c']
+    assert list(as_points([(1, 2), (3, 4)]).lon) == [2, 4]
+    with pytest.raises(ValueError):
+        as_points(pd.DataFrame({'x': [1], 'y': [2]}))
+
+
+def test_covering_bounds():
+    assert covering_bounds(POINTS, margin=0.5) == \
+        pytest.approx([2.4, 12.9, -0.4, 9.7])
+
+
+def test_matches_nearest_pixel():
+    extracted = extract_points(DATA, POINTS)
+    assert list(extracted.point.values) == ['a', 'b', 'c']
+    for label, row in POINTS.iterrows():
+        nearest = DATA.sel(latitude=row.latitude, longitude=row.longitude,
+                           method='nearest')
+        np.testing.assert_array_equal(extracted.skt.sel(point=label).values,
+                                      nearest.skt.values)
+
+
+def test_irregular_grid():
+    lat = np.array([0., 0.1, 0.5, 2.])
+    index = PointIndex(lat, [0., 1.])
+    rows, _ = index.lookup([0.04, 0.35, 1.5], [0., 0., 0.])
+    assert list(rows) == [0, 2, 3]
@@ -0,0 +1,90 @@
+import pickle
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from DQTools.connect.DQclient import AssimilaData
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Answers every GET_META request with the action it asked for.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        req = pickle.loads(self.rfile.read(length))
+        body = pickle.dumps({'action': req.get('action')})
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(AssimilaData, '_pools', {})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1', str(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def client(server, login='me', **options):
+    url, port = server
+    return AssimilaData(url=url, port=port, pwd='x', login=login,
+                        **options)
+
+
+def meta(action):
+    return {'command': 'GET_META', 'action': action, 'params': {}}
+
+
+def test_clients_share_pool(server):
+    first, second = client(server), client(server)
+    assert first.pool is second.pool
+    assert client(server, login='other').pool is not first.pool
+
+
+def test_connection_reused(server):
+    for i in range(3):
+        assert client(server).get(meta('action %d' % i)) == \
+            {'action': 'action %d' % i}
+
+    stats = client(server).connection_stats()
+    assert stats['totals']['requests'] == 3
+    assert stats['totals']['new_connections'] == 1
+    assert stats['totals']['reused_connections'] == 2
+    assert stats['last_request']['reused_connection']
+
+
+def test_without_keep_alive(server):
+    dq = client(server, keep_alive=False)
+    for i in range(3):
+        dq.get(meta('action'))
+    assert dq.connection_stats()['totals']['new_connections'] == 3
+
+
+def test_shared_between_threads(server):
+    results = []
+
+    def fetch(i):
+        results.append(client(server).get(meta(i))['action'])
+
+    threads = [threading.Thread(target=fetch, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert sorted(results) == list(range(8))
+    totals = client(server).connection_stats()['totals']
+    assert totals['requests'] == 8
+    assert totals['new_connections'] <= client(server).pool.pool_size
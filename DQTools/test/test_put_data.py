@@ -0,0 +1,111 @@
+import gzip
+import io
+import logging
+import pickle
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from DQTools.connect.DQclient import APIRequest, HDR_ACCEPT_ENCODING, \
+    HDR_ACCEPT_TRANSFER, HDR_ENCODING, HDR_TRANSFER, SLICED_TRANSFER
+from DQTools.connect.streams import pickled_slices, time_slices
+
+DATA = xr.Dataset(
+    {'skt': (('time', 'latitude', 'longitude'),
+             np.random.RandomState(0).rand(50, 10, 10))},
+    coords={'time': pd.date_range('2020-01-01', periods=50),
+            'latitude': np.arange(10.), 'longitude': np.arange(10.)})
+# One time step of DATA
+STEP_BYTES = DATA.nbytes // 50
+
+
+class Response(object):
+    def __init__(self, status_code=200, text='', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = dict(headers or {})
+
+
+class Server(object):
+    """
+    Accepts PUT_DATA uploads, advertising the given headers in reply to
+    the first POST.
+    """
+    def __init__(self, headers):
+        self.headers = headers
+        self.uploads = []
+
+    def post(self, url, auth=None, data=None, **kwargs):
+        return Response(text='/upload/1', headers=self.headers)
+
+    def put(self, url, auth=None, data=None, headers=None):
+        streamed = isinstance(data, types.GeneratorType)
+        body = b''.join(data) if streamed else data
+        self.uploads.append((url, body, dict(headers), streamed))
+        return Response()
+
+
+def unpickle_all(body):
+    stream = io.BytesIO(gzip.decompress(body))
+    blocks = []
+    while stream.tell() < len(stream.getbuffer()):
+        blocks.append(pickle.load(stream))
+    return blocks
+
+
+def put(server, data=DATA, slice_bytes=10 * STEP_BYTES):
+    dq = APIRequest(logging.getLogger('test'), 'PUT_DATA',
+                    'http://127.0.0.1:1', 'me', 'x', pool=server,
+                    slice_bytes=slice_bytes, codecs=['gzip'])
+    dq.put_to_dq({'command': 'PUT_DATA', 'params': {}}, data=data)
+    assert len(server.uploads) == 1
+    return server.uploads[0]
+
+
+@pytest.mark.parametrize('steps', [1, 7, 10, 49, 50, 200])
+def test_block_boundaries(steps):
+    blocks = list(time_slices(DATA, steps * STEP_BYTES))
+    assert [block.sizes['time'] for block in blocks[:-1]] == \
+        [min(steps, 50)] * (len(blocks) - 1)
+    xr.testing.assert_identical(xr.concat(blocks, 'time'), DATA)
+
+
+def test_blocks_without_time():
+    still = DATA.isel(time=0, drop=True)
+    assert list(time_slices(still, STEP_BYTES)) == [still]
+    assert len(list(time_slices(DATA, 1))) == 50
+    empty = DATA.isel(time=slice(0, 0))
+    assert len(list(time_slices(empty, STEP_BYTES))) == 1
+
+
+def test_pickled_slices():
+    blocks = [pickle.loads(block)
+              for block in pickled_slices(DATA, 20 * STEP_BYTES)]
+    assert [block.sizes['time'] for block in blocks] == [20, 20, 10]
+
+
+def test_sliced_upload():
+    server = Server({HDR_ACCEPT_TRANSFER: 'chunked, sliced',
+                     HDR_ACCEPT_ENCODING: 'gzip'})
+    url, body, headers, streamed = put(server)
+    assert url == 'http://127.0.0.1:1/upload/1'
+    assert streamed
+    assert headers == {HDR_ENCODING: 'gzip', HDR_TRANSFER: SLICED_TRANSFER}
+
+    blocks = unpickle_all(body)
+    assert len(blocks) == 5
+    xr.testing.assert_identical(xr.concat(blocks, 'time'), DATA)
+
+
+def test_single_pickle_if_not_accepted():
+    # A server which does not say it reads sliced transfers gets the
+    # original single pickle
+    url, body, headers, streamed = put(Server({}))
+    assert not streamed
+    assert headers == {HDR_ENCODING: 'gzip'}
+    blocks = unpickle_all(body)
+    assert len(blocks) == 1
+    xr.testing.assert_identical(blocks[0], DATA)
@@ -0,0 +1,115 @@
+import io
+import logging
+import os
+import types
+
+import pytest
+
+from DQTools.connect import compression
+from DQTools.connect.DQclient import APIRequest, HDR_ACCEPT_ENCODING, \
+    HDR_ACCEPT_TRANSFER, HDR_ENCODING
+from DQTools.connect.streams import ProgressFile
+
+# Partly compressible contents, several chunks long
+CONTENTS = (os.urandom(30000) + b'tile ' * 20000) * 3
+CHUNK_SIZE = 8192
+
+
+class Response(object):
+    def __init__(self, status_code=200, text='', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = dict(headers or {})
+
+
+class Server(object):
+    """
+    Accepts PUT_FILE uploads, advertising the given headers in reply to
+    the first POST, and reading bodies as requests would send them.
+    """
+    def __init__(self, headers):
+        self.headers = headers
+        self.uploads = []
+
+    def post(self, url, auth=None, data=None, **kwargs):
+        return Response(text='/upload/1', headers=self.headers)
+
+    def put(self, url, auth=None, data=None, headers=None):
+        if isinstance(data, types.GeneratorType):
+            kind, body = 'chunked', b''.join(data)
+        else:
+            kind, length = 'sized', len(data) if hasattr(data, '__len__') \
+                else os.fstat(data.fileno()).st_size
+            body = b''.join(iter(lambda: data.read(CHUNK_SIZE), b''))
+            assert len(body) == length
+        self.uploads.append((kind, body, dict(headers)))
+        return Response()
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'tile.tif'
+    path.write_bytes(CONTENTS)
+    return str(path)
+
+
+def upload(server, source, codec, progress=None):
+    dq = APIRequest(logging.getLogger('test'), 'PUT_FILE',
+                    'http://127.0.0.1:1', 'me', 'x', pool=server,
+                    chunk_size=CHUNK_SIZE, codecs=[codec])
+    dq.put_to_dq({'command': 'PUT_FILE', 'params': {}, 'source': source},
+                 progress=progress)
+    assert len(server.uploads) == 1
+    return server.uploads[0]
+
+
+def decompress(name, body):
+    with compression.get_codec(name).open(io.BytesIO(body)) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('codec', compression.available())
+@pytest.mark.parametrize('transfer', ['chunked', 'sliced', None])
+def test_round_trip(source, codec, transfer):
+    headers = {HDR_ACCEPT_ENCODING: codec}
+    if transfer:
+        headers[HDR_ACCEPT_TRANSFER] = transfer
+    kind, body, sent = upload(Server(headers), source, codec)
+
+    assert sent == {HDR_ENCODING: codec}
+    # Only compressed bodies are worth sending without a length
+    assert kind == ('chunked' if transfer and codec != 'none' else 'sized')
+    assert decompress(codec, body) == CONTENTS
+
+
+@pytest.mark.parametrize('transfer', ['chunked', None])
+def test_progress(source, transfer):
+    headers = {HDR_ACCEPT_ENCODING: 'gzip'}
+    if transfer:
+        headers[HDR_ACCEPT_TRANSFER] = transfer
+    reports = []
+    kind, body, sent = upload(Server(headers), source, 'gzip',
+                              progress=lambda *report: reports.append(report))
+
+    sizes = [done for done, total in reports]
+    assert len(reports) > 1
+    assert sizes == sorted(sizes) and sizes[-1] == len(body)
+    totals = set(total for done, total in reports)
+    assert totals == ({None} if transfer else {len(body)})
+
+
+def test_gzip_if_codec_not_accepted(source):
+    kind, body, sent = upload(Server({}), source, 'zstd'
+                              if 'zstd' in compression.available()
+                              else 'none')
+    assert sent == {HDR_ENCODING: 'gzip'}
+    assert decompress('gzip', body) == CONTENTS
+
+
+def test_progress_file():
+    reports = []
+    f = ProgressFile(io.BytesIO(CONTENTS), len(CONTENTS),
+                     lambda *report: reports.append(report))
+    assert len(f) == len(CONTENTS)
+    assert b''.join(f) == CONTENTS
+    assert reports[-1] == (len(CONTENTS), len(CONTENTS))
@@ -0,0 +1,36 @@
+import pytest
+
+from DQTools.regions import Bounds, RegionRegistry, get_bounds, \
+    get_registry
+
+REGISTRY = RegionRegistry([
+    ('africa', Bounds(north=40., south=-40., east=55., west=-20.)),
+    ('kenya', Bounds(north=5., south=-5., east=42., west=34.)),
+    ('fiji', Bounds(north=-12., south=-21., east=-178., west=177.))])
+
+
+def test_containing_smallest_first():
+    assert REGISTRY.containing(0., 38.) == ['kenya', 'africa']
+    assert REGISTRY.containing(60., 0.) == []
+
+
+def test_antimeridian():
+    assert REGISTRY.containing(-17., 179.) == ['fiji']
+    assert REGISTRY.containing(-17., -179.) == ['fiji']
+    assert REGISTRY.containing(-17., 181.) == ['fiji']
+    assert REGISTRY.intersecting(-10., -170., -30., 170.) == ['fiji']
+
+
+def test_intersecting():
+    assert REGISTRY.intersecting(1., 36., -1., 30.) == ['kenya', 'africa']
+
+
+def test_get_bounds():
+    registry = get_registry()
+    assert get_registry() is registry
+    name = registry.names()[0]
+    assert get_bounds(name) == registry.bounds(name)
+    assert get_bounds([10, 20, 0, 5]) == Bounds(north=10, south=0, east=20,
+                                                west=5)
+    with pytest.raises(RuntimeError):
+        get_bounds('nowhere')
@@ -0,0 +1,92 @@
+import gzip
+import io
+import logging
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from DQTools.connect import wire
+from DQTools.connect.DQclient import APIRequest, HDR_ENCODING, HDR_FORMAT, \
+    load_data
+from DQTools.connect.streams import IterStream, open_response
+
+DATA = xr.Dataset(
+    {'skt': (('time', 'latitude', 'longitude'),
+             np.random.RandomState(0).rand(30, 20, 25))},
+    coords={'time': pd.date_range('2020-01-01', periods=30),
+            'latitude': np.linspace(10, 0, 20),
+            'longitude': np.linspace(20, 30, 25)})
+
+
+class Response(object):
+    """
+    A streamed GET_DATA response, counting how much of it was read.
+    """
+    def __init__(self, body, headers=None):
+        self.body = body
+        self.headers = dict(headers or {})
+        self.read = 0
+        self.closed = False
+
+    @property
+    def content(self):
+        self.read = len(self.body)
+        return self.body
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            chunk = self.body[start:start + chunk_size]
+            self.read += len(chunk)
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+def test_iter_stream():
+    stream = io.BufferedReader(IterStream([b'ab', b'', b'cde', b'f']),
+                               buffer_size=2)
+    assert stream.read(3) == b'abc'
+    assert stream.read() == b'def'
+    assert stream.read() == b''
+
+    buffer = bytearray(10)
+    assert IterStream([b'abc', b'de']).readinto(buffer) == 3
+    assert IterStream([]).readinto(buffer) == 0
+
+
+@pytest.mark.parametrize('chunk_size', [7, 1024, 1 << 20])
+def test_streamed_pickle(chunk_size):
+    resp = Response(gzip.compress(pickle.dumps(DATA, protocol=-1)))
+    loaded = load_data(open_response(resp, chunk_size), resp.headers)
+    xr.testing.assert_identical(loaded, DATA)
+    # The whole body was read, so the connection can be used again
+    assert resp.read == len(resp.body)
+
+
+def test_streamed_wire_format():
+    resp = Response(gzip.compress(wire.dumps(DATA)),
+                    {HDR_FORMAT: wire.FORMAT_NAME, HDR_ENCODING: 'gzip'})
+    loaded = load_data(open_response(resp, 4096), resp.headers)
+    xr.testing.assert_identical(loaded, DATA)
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_decode_data(stream):
+    dq = APIRequest(logging.getLogger('test'), 'GET_DATA',
+                    'http://127.0.0.1:1', 'me', 'x', pool=object(),
+                    stream=stream, chunk_size=4096)
+    resp = Response(gzip.compress(pickle.dumps(DATA, protocol=-1)))
+    xr.testing.assert_identical(dq._decode_data(resp), DATA)
+    assert resp.closed
+
+
+@pytest.mark.parametrize('cut', [0.2, 0.99])
+def test_truncated_stream(cut):
+    body = gzip.compress(pickle.dumps(DATA, protocol=-1))
+    resp = Response(body[:int(len(body) * cut)])
+    with pytest.raises((EOFError, pickle.UnpicklingError)):
+        load_data(open_response(resp, 4096), resp.headers)
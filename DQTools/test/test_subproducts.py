@@ -0,0 +1,76 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import DQTools.dataset as dataset
+from DQTools.connect.connect import Connect
+
+TIMES = pd.date_range('2020-01-01', '2020-01-10')
+GRID = {'time': TIMES, 'latitude': [10., 9.5, 9.], 'longitude': [30., 30.5]}
+
+
+def variable(name, offset):
+    values = offset + np.random.RandomState(offset).rand(len(TIMES), 3, 2)
+    return xr.Dataset({name: (('time', 'latitude', 'longitude'), values)},
+                      coords=GRID, attrs={'subproduct': name})
+
+
+class FakeConnect(Connect):
+    """
+    Answers GET_DATA requests with a Dataset per sub-product asked for.
+    """
+    def __init__(self, identfile=None, sysfile=None):
+        super(FakeConnect, self).__init__(identfile=identfile,
+                                          sysfile=sysfile)
+        self.http_client.get = self.get
+        self.requests = []
+
+    def get(self, request, codec=None):
+        if request['command'] == 'GET_META':
+            return {'time_resolution': '1 days',
+                    'first_timestep': '2020-01-01',
+                    'last_timestep': '2020-01-10',
+                    'last_gold': '2020-01-10',
+                    'fill_value': -999,
+                    'all_subproduct_tiles': ['africa'],
+                    'description': 'test'}
+        self.requests.append(request['params'])
+        return [variable(name, offset) for offset, name
+                in enumerate(request['params']['subproduct'])]
+
+
+@pytest.fixture
+def ds(monkeypatch, tmp_path):
+    monkeypatch.setattr(dataset, 'Connect', FakeConnect)
+    ident = tmp_path / 'ident.json'
+    ident.write_text(json.dumps({'url': 'http://127.0.0.1', 'port': '1',
+                                 'pwd': 'x', 'login': 'me'}))
+    return dataset.Dataset('era5', 'skt', tile='africa', identfile=str(ident))
+
+
+def test_one_request_for_all(ds):
+    ds.get_data('2020-01-01', '2020-01-10', subproducts=['t2m', 'skt', 'tp'])
+
+    assert len(ds.conn.requests) == 1
+    assert ds.conn.requests[0]['subproduct'] == ['skt', 't2m', 'tp']
+    assert sorted(ds.data.data_vars) == ['skt', 't2m', 'tp']
+    xr.testing.assert_identical(ds.data.t2m, variable('t2m', 1).t2m)
+    # The attributes are those of the Dataset's own sub-product
+    assert ds.data.attrs == {'subproduct': 'skt'}
+
+
+def test_single_subproduct(ds):
+    ds.get_data('2020-01-01', '2020-01-10')
+    assert ds.conn.requests[0]['subproduct'] == ['skt']
+    xr.testing.assert_identical(ds.data, variable('skt', 0))
+
+
+def test_points_of_all(ds):
+    points = ds.get_points([[9.9, 30.1], [9.1, 30.4]], '2020-01-01',
+                           '2020-01-10', subproducts=['t2m'])
+    assert len(ds.conn.requests) == 1
+    assert sorted(points.data_vars) == ['skt', 't2m']
+    assert points.t2m.dims == ('point', 'time')
@@ -0,0 +1,52 @@
+import datetime
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from DQTools.connect import wire
+
+DATA = xr.Dataset(
+    {'skt': (('time', 'latitude', 'longitude'),
+             np.arange(24, dtype='float32').reshape(2, 3, 4),
+             {'units': 'K', 'scale': np.float32(0.5)})},
+    coords={'time': pd.date_range('2020-01-01', periods=2),
+            'latitude': [1., 0.5, 0.], 'longitude': [0., 1., 2., 3.]},
+    attrs={'product': 'era5', 'last_gold': datetime.date(2020, 1, 2)})
+
+
+def test_round_trip():
+    payload = wire.dumps(DATA)
+    xr.testing.assert_identical(wire.loads(payload), DATA)
+    xr.testing.assert_identical(wire.load(io.BytesIO(payload)), DATA)
+
+
+def test_list_and_dataarray():
+    other = DATA.rename(skt='tp')
+    loaded = wire.loads(wire.dumps([DATA, other]))
+    assert len(loaded) == 2
+    xr.testing.assert_identical(loaded[1], other)
+    xr.testing.assert_identical(wire.loads(wire.dumps(DATA.skt)), DATA.skt)
+
+
+def test_attrs_round_trip():
+    attrs = {'when': datetime.datetime(2020, 1, 2, 3), 'values': np.arange(3)}
+    loaded = wire.loads_attrs(wire.dumps_attrs(attrs))
+    assert loaded['when'] == attrs['when']
+    np.testing.assert_array_equal(loaded['values'], attrs['values'])
+
+
+def test_unsupported_raise():
+    with pytest.raises(wire.WireFormatError):
+        wire.dumps(xr.Dataset({'name': ('x', np.array(['a', None]))}))
+    with pytest.raises(wire.WireFormatError):
+        wire.loads(wire.dumps(DATA)[:-1])
+    with pytest.raises(wire.WireFormatError):
+        wire.loads(b'not a payload')
+
+
+def test_dataarray_named_as_coordinate():
+    with pytest.raises(wire.WireFormatError):
+        wire.dumps(DATA.skt.rename('time'))
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from DQTools.zonal import read_zones, zonal_stats, zone_bounds
+
+DATA = xr.Dataset(
+    {'skt': (('time', 'latitude', 'longitude'),
+             np.random.RandomState(0).rand(4, 10, 10))},
+    coords={'time': pd.date_range('2020-01-01', periods=4),
+            'latitude': np.arange(9.5, 0, -1.), 'longitude': np.arange(0.5, 10)})
+
+
+def box(west, south, east, north, name):
+    return {'type': 'Feature', 'properties': {'name': name},
+            'geometry': {'type': 'Polygon',
+                         'coordinates': [[[west, south], [east, south],
+                                          [east, north], [west, north],
+                                          [west, south]]]}}
+
+
+ZONES = {'type': 'FeatureCollection',
+         'features': [box(0, 0, 3, 4, 'west'), box(5, 5, 10, 10, 'north')]}
+
+
+def test_read_zones():
+    assert [name for name, _ in read_zones(ZONES, 'name')] == \
+        ['west', 'north']
+    assert [name for name, _ in read_zones(ZONES)] == [0, 1]
+    assert zone_bounds(ZONES) == [10, 10, 0, 0]
+    with pytest.raises(ValueError):
+        read_zones(ZONES, 'missing')
+
+
+def test_matches_masked_statistics():
+    out = zonal_stats(DATA, ZONES, stats=('mean', 'count', 'min', 'max'),
+                      percentiles=[90], name_field='name')
+    assert list(out.pixels.values) == [12, 25]
+
+    inside = DATA.sel(latitude=slice(4, 0), longitude=slice(0, 3)).skt
+    west = out.skt.sel(zone='west')
+    np.testing.assert_allclose(west.sel(stat='mean'),
+                               inside.mean(['latitude', 'longitude']))
+    np.testing.assert_allclose(west.sel(stat='min'),
+                               inside.min(['latitude', 'longitude']))
+    np.testing.assert_allclose(west.sel(stat='max'),
+                               inside.max(['latitude', 'longitude']))
+    np.testing.assert_allclose(
+        west.sel(stat='p90'),
+        inside.quantile(0.9, ['latitude', 'longitude']))
+    assert (west.sel(stat='count') == 12).all()
+
+
+def test_nan_pixels_ignored():
+    data = DATA.copy(deep=True)
+    data.skt[0, 9, 0] = np.nan
+    out = zonal_stats(data, ZONES, stats=('mean', 'count'),
+                      name_field='name')
+    counts = out.skt.sel(zone='west', stat='count').values
+    assert list(counts) == [11, 12, 12, 12]
+    assert not np.isnan(out.skt.sel(zone='west', stat='mean')).any()
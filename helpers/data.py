@@ -1,5 +1,6 @@
 from __future__ import print_function
 import pickle
+import sqlite3
 import subprocess
 import warnings
 import matplotlib
@@ -8,7 +9,6 @@ import numpy as np
 import os
 import datetime
 import pandas as pd
-import osr
 import sys
 import pickle
 sys.path.append("../../")
@@ -17,9 +17,23 @@ from IPython.lib.display import FileLink
 from DQTools.DQTools.dataset import Dataset
 from DQTools.DQTools.search import Search
 from DQTools.DQTools.connect import connect
+from DQTools.DQTools.connect.catalog import CatalogStore
+from DQTools.DQTools.availability import AvailabilityIndex
+from DQTools.DQTools.aggregate import aggregate_time, FREQUENCIES
+from DQTools.DQTools.points import covering_bounds
+from helpers import reproject
+from helpers.fetchplan import FetchPlan
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 
+# Set True to look up units in the local catalog file (see
+# DQTools.connect.catalog) rather than downloading the product tables
+USE_CATALOG = False
+
+# Largest area, in square degrees, fetched to compare locations with one
+# request; locations further apart are fetched one at a time
+MAX_SHARED_AREA = 4.0
+
 
 class Data:
     """
@@ -35,6 +49,7 @@ class Data:
         """
 
         self.out = out
+        self._conn = None
         if keyfile is None:
             self.keyfile = os.path.join(os.path.expanduser("~"),
                                         'assimila_dq.txt')
@@ -42,16 +57,24 @@ class Data:
             self.keyfile = keyfile
 
     def get_data_from_datacube_latlon(self, product, subproduct, start, end,
-                                      latitude, longitude):
+                                      latitude, longitude, cube_cache=None,
+                                      time_window=None):
         """
         Get a datacube dataset for a point location request.
 
         :param product:     the name of the datacube product
-        :param subproduct:  the name of the datacube sub-product
+        :param subproduct:  the name of the datacube sub-product, or a list
+                            of sub-products of the product to fetch together
         :param start:       the start date of the period
         :param end:         the end date of the period
         :param latitude     the latitude of the point location
         :param longitude    the longitude of the point location
+        :param cube_cache   optional; local cache of earlier requests, so
+                            only time steps not already fetched are
+                            downloaded. See Dataset.
+        :param time_window  optional; longest period fetched by one
+                            request, longer periods being fetched as
+                            several requests at once. See Dataset.get_data.
 
         :return: xarray of datacube dataset data
         """
@@ -60,17 +83,39 @@ class Data:
             clear_output()
             print("Getting data...")
 
-            ds = Dataset(product=product,
-                         subproduct=subproduct,
-                         identfile=self.keyfile)
+            return self._fetch_latlon(product, subproduct, start, end,
+                                      latitude, longitude, cube_cache,
+                                      time_window)
 
-            ds.get_data(start=start, stop=end,
-                        latlon=[latitude, longitude])
-           
-            return ds.data
+    def _fetch_latlon(self, product, subproduct, start, end, latitude,
+                      longitude, cube_cache=None, time_window=None,
+                      messages=None):
+        """
+        The fetch of get_data_from_datacube_latlon, without writing to the
+        output widget, so it can be run in a FetchPlan.
+
+        :param messages: optional; list to add failure messages to rather
+                         than printing them, e.g. the plan's messages
+        """
+        # Any further sub-products come back in the same request
+        subproducts = [subproduct] if isinstance(subproduct, str) \
+            else list(subproduct)
+
+        ds = Dataset(product=product,
+                     subproduct=subproducts[0],
+                     identfile=self.keyfile,
+                     cube_cache=cube_cache,
+                     messages=messages)
+
+        ds.get_data(start=start, stop=end,
+                    latlon=[latitude, longitude],
+                    subproducts=subproducts[1:], time_window=time_window)
+
+        return ds.data
 
     def get_data_from_datacube_nesw(self, product, subproduct, north, east,
-                                    south, west, start, end):
+                                    south, west, start, end, lazy=False,
+                                    time_window=None):
         """
         Get a datacube dataset for a region location request.
 
@@ -82,6 +127,11 @@ class Data:
         :param west:        western latitude
         :param start:       the start date of the period
         :param end:         the end date of the period
+        :param lazy:        optional; return dask arrays fetched a chunk
+                            of time steps at a time when computed. See
+                            Dataset.get_data.
+        :param time_window: optional; longest period fetched by one
+                            request. See Dataset.get_data.
 
         :return: xarray of datacube dataset data
         """
@@ -90,14 +140,27 @@ class Data:
             clear_output()
             print("Getting data...")
 
-            ds = Dataset(product=product,
-                         subproduct=subproduct,
-                         identfile=self.keyfile)
+            return self._fetch_nesw(product, subproduct, north, east, south,
+                                    west, start, end, lazy, time_window)
+
+    def _fetch_nesw(self, product, subproduct, north, east, south, west,
+                    start, end, lazy=False, time_window=None, messages=None):
+        """
+        The fetch of get_data_from_datacube_nesw, without writing to the
+        output widget, so it can be run in a FetchPlan.
+
+        :param messages: optional; see _fetch_latlon
+        """
+        ds = Dataset(product=product,
+                     subproduct=subproduct,
+                     identfile=self.keyfile,
+                     messages=messages)
 
-            ds.get_data(start=start, stop=end,
-                        region=[north, east, south, west])
+        ds.get_data(start=start, stop=end,
+                    region=[north, east, south, west], lazy=lazy,
+                    time_window=time_window)
 
-            return ds.data
+        return ds.data
 
     def check(self, north, east, south, west, start, end):
         """
@@ -167,8 +230,9 @@ class Data:
         elif y[subproduct].crs == "+init=epsg:4326" and proj == 'Sinusoidal':
             conv = 'latlon_to_sinu'
             
-        y["latitude"] = [self.coord_transform(0, i, conv)[1] for i in y["latitude"].data]
-        y["longitude"] = [self.coord_transform(i, 0, conv)[0] for i in y["longitude"].data]
+        # Each axis in one call
+        y["latitude"] = self.coord_transform(0, y["latitude"].data, conv)[1]
+        y["longitude"] = self.coord_transform(y["longitude"].data, 0, conv)[0]
         
         return y
     
@@ -183,10 +247,29 @@ class Data:
         :return units:     the required unit
         """
         conn = connect.Connect(identfile='../../DQTools/DQTools/connect/.assimila_dq')
-        _product = conn.get_all_table_data(tablename='product')
-        product_id = _product[_product.name == product].idproduct.values[0]
-        _subproduct = conn.get_all_table_data(tablename='subproduct')
-        units = _subproduct[_subproduct.idproduct == product_id][_subproduct.name == subproduct].units.values[0]
+        _subproduct = None
+        if USE_CATALOG:
+            try:
+                # indexed look-ups in the local catalog rather than
+                # downloading and filtering the whole product and
+                # sub-product tables
+                catalog = CatalogStore.shared()
+                _product = catalog.find(conn, 'product', name=product)
+                product_id = _product.idproduct.values[0]
+                _subproduct = catalog.find(conn, 'subproduct',
+                                           idproduct=product_id,
+                                           name=subproduct)
+            except (OSError, sqlite3.Error) as e:
+                warnings.warn("Local catalog unavailable, downloading the "
+                              "product tables.\n%s" % e)
+
+        if _subproduct is None:
+            _product = conn.get_all_table_data(tablename='product')
+            product_id = _product[_product.name == product].idproduct.values[0]
+            _subproduct = conn.get_all_table_data(tablename='subproduct')
+            _subproduct = _subproduct[(_subproduct.idproduct == product_id) &
+                                      (_subproduct.name == subproduct)]
+        units = _subproduct.units.values[0]
         
         if units == "Kelvin":
             return "K"
@@ -194,15 +277,23 @@ class Data:
             return units
 
     def average_subproduct(self, product, subproduct, frequency, average, north,
-                               east, south, west, date1, date2, proj):
+                               east, south, west, date1, date2, proj,
+                               statistic='mean'):
             """
             Find the average of a sub product over an area or point over 2 given dates.
             Averaging done by area or by pixel with an averaging frequency of days/
             months/years.
 
+            The statistic of each period and of the whole period are worked
+            out together in one pass over the data, which for an area are
+            fetched a chunk of time steps at a time, so long periods over
+            large areas do not need to fit in memory.
+
             :param product:     the name of the datacube product
             :param subproduct:  the name of the datacube sub-product
-            :param frequency:   the time period over which to average 
+            :param frequency:   the time period over which to average: days,
+                                months, years or a pandas frequency such as
+                                '7D'
             :param north:       northern latitude
             :param east:        eastern longitude
             :param south:       southern latitude
@@ -210,18 +301,23 @@ class Data:
             :param date1:       the start of the analysis period
             :param date2:       the end of the analysis period
             :param proj:        the user specified crs projection
+            :param statistic:   optional; mean (the default), sum, count,
+                                min, max or std
 
             :return fig: figure object for the plot
-            """      
+            """
+            label = 'Average' if statistic == 'mean' else statistic
 
             def by_pixel(freq):
                 """
-                Average the sub-product by pixel using resampling (up and down) to find
-                the average per specified time increment ['1D', '1MS', '1YS'].
+                Average the sub-product by pixel, per specified time
+                increment ['1D', '1MS', '1YS'].
                 """
+                result = aggregate_time(y[subproduct], freq,
+                                        stats=(statistic,)).overall[statistic]
+
                 if north == south and east == west:
                     # y = self.coord_transform_plot(_y, subproduct, proj)
-                    pixel_average = y[subproduct].resample(time=freq).mean('time').mean('time')
                     print(f"""
     ==================================================
     Product:    {product}
@@ -230,34 +326,38 @@ class Data:
     Date 1:     {date1}
     Date 2:     {date2}
     ================================================== 
-    Average = {pixel_average.data} {units}
+    {label} = {result.data} {units}
     """)
-                    return pixel_average
+                    return result
 
                 else:
                     # y = self.coord_transform_plot(_y, subproduct, proj)
                     fig, axs = plt.subplots(figsize=(9, 6),
                                             sharex=True, sharey=True)
                     
-                    y[subproduct].resample(time=freq).mean('time').mean('time').plot.imshow(ax=axs, cbar_kwargs={"label" : str(subproduct) + " (" + str(units) + ")"})
+                    result.plot.imshow(ax=axs, cbar_kwargs={"label" : str(subproduct) + " (" + str(units) + ")"})
                     axs.set_aspect("equal")
                     if freq == '1D':
-                        plt.title(f'average: days')
+                        plt.title(f'{label.lower()}: days')
                     elif freq == '1MS':
-                        plt.title(f'average: months')
+                        plt.title(f'{label.lower()}: months')
                     elif freq == '1YS':
-                        plt.title(f'average: years')
+                        plt.title(f'{label.lower()}: years')
+                    else:
+                        plt.title(f'{label.lower()}: {freq}')
                     plt.tight_layout()
                     plt.show(block=False)
 
-                    return y[subproduct].resample(time=freq).mean('time').mean('time'), fig 
+                    return result, fig 
 
             def by_area(freq):
                 """
-                Average the sub-product by area using resampling (up and down) to find
-                the average per specified time increment ['1D', '1MS', '1YS'].
+                Average the sub-product over the area, per specified time
+                increment ['1D', '1MS', '1YS'].
                 """
-                area_average = y[subproduct].resample(time=freq).mean('time').mean(['longitude', 'latitude']).mean('time')
+                area_average = aggregate_time(
+                    y[subproduct], freq, stats=(statistic,),
+                    dims=['latitude', 'longitude']).overall[statistic]
                 print(f"""
     ==================================================
     Product:    {product}
@@ -266,7 +366,7 @@ class Data:
     Date 1:     {date1}
     Date 2:     {date2}
     ================================================== 
-    Average = {area_average.data} {units}
+    {label} = {area_average.data} {units}
     """)
                 return area_average
 
@@ -292,34 +392,18 @@ class Data:
                         self, product, subproduct, date1, date2, north, east)
 
                 else:
+                    # Fetched as each chunk is reached by the aggregation
                     list_of_results = Data.get_data_from_datacube_nesw(
                         self, product, subproduct, north, east,
-                        south, west, date1, date2)
+                        south, west, date1, date2, lazy=True)
 
                 y = list_of_results
-                if frequency == 'days':
-                    freq='1D'
-                    if average == 'by pixel':
-                        return by_pixel(freq)
-
-                    elif average == 'by area':
-                        return by_area(freq)
-
-                elif frequency == 'months':
-                    freq='1MS'
-                    if average == 'by pixel':
-                        return by_pixel(freq)
-
-                    elif average == 'by area':
-                        return by_area(freq)
+                freq = FREQUENCIES.get(frequency, frequency)
+                if average == 'by pixel':
+                    return by_pixel(freq)
 
-                elif frequency == 'years':
-                    freq='1YS'
-                    if average == 'by pixel':
-                        return by_pixel(freq)
-
-                    elif average == 'by area':
-                        return by_area(freq)
+                elif average == 'by area':
+                    return by_area(freq)
 
                     
     def color_map_subtraction(self, product, subproduct, north, east, south,
@@ -354,17 +438,27 @@ class Data:
             # Get the units of the sub-product
             units = Data.get_units(product, subproduct)
                 
+            # Both dates are fetched at the same time
+            plan = FetchPlan()
             if north == south and east == west:
-                list_of_results1 = Data.get_data_from_datacube_latlon(
-                    self, product, subproduct, date1, date1, north, east)
-
-                y1 = list_of_results1
-
-                list_of_results2 = Data.get_data_from_datacube_latlon(
-                    self, product, subproduct, date2, date2, north, east)
-
-                y2 = list_of_results2
+                plan.add(1, self._fetch_latlon, product, subproduct,
+                         date1, date1, north, east,
+                         messages=plan.messages)
+                plan.add(2, self._fetch_latlon, product, subproduct,
+                         date2, date2, north, east,
+                         messages=plan.messages)
+            else:
+                plan.add(1, self._fetch_nesw, product, subproduct, north,
+                         east, south, west, date1, date1,
+                         messages=plan.messages)
+                plan.add(2, self._fetch_nesw, product, subproduct, north,
+                         east, south, west, date2, date2,
+                         messages=plan.messages)
+            print("Getting data...")
+            results = plan.run()
+            y1, y2 = results[1], results[2]
 
+            if north == south and east == west:
                 difference = y2[subproduct][0] - y1[subproduct][0]
 
                 print(f"""
@@ -378,18 +472,6 @@ Change was {difference.data} {units} from {date1} to {date2}.""")
                 return difference
                 
             else:
-                list_of_results1 = Data.get_data_from_datacube_nesw(
-                    self, product, subproduct, north, east,
-                    south, west, date1, date1)
-
-                y1 = list_of_results1
-
-                list_of_results2 = Data.get_data_from_datacube_nesw(
-                    self, product, subproduct, north, east,
-                    south, west, date2, date2)
-
-                y2 = list_of_results2
-
                 difference = y2[subproduct][0] - y1[subproduct][0]
 
                 fig, axs = plt.subplots(figsize=(9, 6))
@@ -447,17 +529,27 @@ Change was {difference.data} {units} from {date1} to {date2}.""")
             # Get the units of the sub-product to display on the colourbar
             units = Data.get_units(product, subproduct)
             
+            # Both periods are fetched at the same time
+            plan = FetchPlan()
             if north == south and east == west:
+                plan.add(1, self._fetch_latlon, product, subproduct,
+                         date1, date2, north, east,
+                         messages=plan.messages)
+                plan.add(2, self._fetch_latlon, product, subproduct,
+                         date3, date4, north, east,
+                         messages=plan.messages)
+            else:
+                plan.add(1, self._fetch_nesw, product, subproduct, north,
+                         east, south, west, date1, date2,
+                         messages=plan.messages)
+                plan.add(2, self._fetch_nesw, product, subproduct, north,
+                         east, south, west, date3, date4,
+                         messages=plan.messages)
+            print("Getting data...")
+            results = plan.run()
+            y1, y2 = results[1], results[2]
 
-                list_of_results1 = Data.get_data_from_datacube_latlon(
-                    self, product, subproduct, date1, date2, north, east)
-
-                y1 = list_of_results1
-
-                list_of_results2 = Data.get_data_from_datacube_latlon(
-                    self, product, subproduct, date3, date4, north, east)
-
-                y2 = list_of_results2
+            if north == south and east == west:
                 
                 if trends == 'overlaid':
                     fig = plt.figure(figsize=(15, 4))
@@ -493,18 +585,6 @@ Change was {difference.data} {units} from {date1} to {date2}.""")
 
             else:
 
-                list_of_results1 = Data.get_data_from_datacube_nesw(
-                    self, product, subproduct, north, east,
-                    south, west, date1, date2)
-
-                y1 = list_of_results1
-
-                list_of_results2 = Data.get_data_from_datacube_nesw(
-                    self, product, subproduct, north, east,
-                    south, west, date3, date4)
-
-                y2 = list_of_results2
-
                 # Share axis to allow zooming on both plots simultaneously
                 fig, axs = plt.subplots(1, 2, figsize=(15, 4),
                                         sharex=True, sharey=True)
@@ -559,28 +639,33 @@ Change was {difference.data} {units} from {date1} to {date2}.""")
             units1 = Data.get_units(product1, subproduct1)
             units2 = Data.get_units(product2, subproduct2)
             
+            # Every date of both products is fetched at the same time
+            plan = FetchPlan()
             for count, date in enumerate(dates):
                 self.check_date(product1, subproduct1, date)
                 self.check_date(product2, subproduct2, date)
                 
                 if north == south and east == west:
-                    results1 = Data.get_data_from_datacube_latlon(
-                        self, product1, subproduct1, dates[count], dates[count], north, east)
-                    
-                    results2 = Data.get_data_from_datacube_latlon(
-                        self, product2, subproduct2, dates[count], dates[count], north, east)
+                    plan.add((count, 1), self._fetch_latlon, product1,
+                             subproduct1, date, date, north, east,
+                             messages=plan.messages)
+                    plan.add((count, 2), self._fetch_latlon, product2,
+                             subproduct2, date, date, north, east,
+                             messages=plan.messages)
 
                 else:
-                    results1 = Data.get_data_from_datacube_nesw(
-                        self, product1, subproduct1, north, east,
-                        south, west, dates[count], dates[count])
-                    
-                    results2 = Data.get_data_from_datacube_nesw(
-                        self, product2, subproduct2, north, east,
-                        south, west, dates[count], dates[count])
+                    plan.add((count, 1), self._fetch_nesw, product1,
+                             subproduct1, north, east, south, west,
+                             date, date, messages=plan.messages)
+                    plan.add((count, 2), self._fetch_nesw, product2,
+                             subproduct2, north, east, south, west,
+                             date, date, messages=plan.messages)
 
-                results_arr1.append(results1)
-                results_arr2.append(results2)
+            print("Getting data...")
+            results = plan.run()
+            for count in range(len(dates)):
+                results_arr1.append(results[(count, 1)])
+                results_arr2.append(results[(count, 2)])
 
             if north == south and east == west:
                 print(f"""
@@ -800,19 +885,14 @@ Lat/Lon:    {north}/{east}
             clear_output()
             print("Getting data...")
 
-            data1 = self.get_data_from_datacube_latlon('tamsat',
-                                                     'rfe',
-                                                     np.datetime64(start),
-                                                     np.datetime64(end),
-                                                     latitude,
-                                                     longitude)
-
-            data2 = self.get_data_from_datacube_latlon('chirps',
-                                                     'rfe',
-                                                     np.datetime64(start),
-                                                     np.datetime64(end),
-                                                     latitude,
-                                                     longitude)
+            # Both products are fetched at the same time
+            plan = FetchPlan()
+            for product in ('tamsat', 'chirps'):
+                plan.add(product, self._fetch_latlon, product, 'rfe',
+                         np.datetime64(start), np.datetime64(end),
+                         latitude, longitude, messages=plan.messages)
+            results = plan.run()
+            data1, data2 = results['tamsat'], results['chirps']
 
             plt.figure(figsize=(16, 8))
 
@@ -842,24 +922,18 @@ Lat/Lon:    {north}/{east}
             clear_output()
             print("Getting data...")
 
-            p1 = self.get_data_from_datacube('era5',
-                                             'skt',
-                                             np.datetime64(start),
-                                             np.datetime64(end),
-                                             latitude,
-                                             longitude)
-
-            p2 = self.get_data_from_datacube('era5',
-                                             't2m',
-                                             np.datetime64(start),
-                                             np.datetime64(end),
-                                             latitude,
-                                             longitude)
+            # Both sub-products in one request
+            data = self.get_data_from_datacube_latlon('era5',
+                                                      ['skt', 't2m'],
+                                                      np.datetime64(start),
+                                                      np.datetime64(end),
+                                                      latitude,
+                                                      longitude)
 
             plt.figure(figsize=(8, 6))
 
-            p1.rfe.plot(label='skt')
-            p2.rfe.plot(label='t2m')
+            data.skt.plot(label='skt')
+            data.t2m.plot(label='t2m')
 
             plt.legend()
             plt.show()
@@ -874,21 +948,17 @@ Lat/Lon:    {north}/{east}
 
             product_name = product.lower()
 
-            y1 = self.get_data_from_datacube_latlon(
-                product_name,
-                'rfe',
-                np.datetime64(f"{int(year1)}-01-01"),
-                np.datetime64(f"{int(year1)}-12-31"),
-                latitude,
-                longitude).groupby('time.dayofyear').mean()
+            # Both years are fetched at the same time
+            plan = FetchPlan()
+            for year in (year1, year2):
+                plan.add(year, self._fetch_latlon, product_name, 'rfe',
+                         np.datetime64(f"{int(year)}-01-01"),
+                         np.datetime64(f"{int(year)}-12-31"),
+                         latitude, longitude, messages=plan.messages)
+            results = plan.run()
 
-            y2 = self.get_data_from_datacube_latlon(
-                product_name,
-                'rfe',
-                np.datetime64(f"{int(year2)}-01-01"),
-                np.datetime64(f"{int(year2)}-12-31"),
-                latitude,
-                longitude).groupby('time.dayofyear').mean()
+            y1 = results[year1].groupby('time.dayofyear').mean()
+            y2 = results[year2].groupby('time.dayofyear').mean()
 
             plt.figure(figsize=(16, 10))
 
@@ -1039,17 +1109,21 @@ Lat/Lon:    {north}/{east}
                 np.datetime64(start),
                 np.datetime64(end),
                 latitude,
-                longitude).groupby('time.dayofyear').mean()
+                longitude,
+                cube_cache=True).groupby('time.dayofyear').mean()
 
             print("2/3 Calculating climatology...")
 
+            # The 20 years are kept in the local cube cache, so repeat
+            # calls only download what has changed or was not fetched.
             clim = self.get_data_from_datacube_latlon(
                 product_name,
                 'rfe',
                 np.datetime64(f"2000-01-01"),
                 np.datetime64(f"2019-12-31"),
                 latitude,
-                longitude)
+                longitude,
+                cube_cache=True)
 
             std = clim.groupby("time.dayofyear").std()
             mean = clim.groupby("time.dayofyear").mean()
@@ -1265,18 +1339,25 @@ Lat/Lon:    {north}/{east}
 
             fig, ax1 = plt.subplots(figsize=(8, 4))
 
-            # latlon1
-            list_of_results = Data.get_data_from_datacube(
-                product, subproduct, start, end, lat1, lon1,)
+            # Both locations from one request for the area around them,
+            # if they are close enough for that area to be small
+            north, east, south, west = covering_bounds(
+                [[lat1, lon1], [lat2, lon2]], margin=0.25)
+            if (north - south) * (east - west) <= MAX_SHARED_AREA:
+                ds = Dataset(product=product,
+                             subproduct=subproduct,
+                             identfile=self.keyfile)
+                points = ds.get_points([[lat1, lon1], [lat2, lon2]],
+                                       start, end)
+                x = points.isel(point=0)
+                y = points.isel(point=1)
+            else:
+                x = self._fetch_latlon(product, subproduct, start, end,
+                                       lat1, lon1)
+                y = self._fetch_latlon(product, subproduct, start, end,
+                                       lat2, lon2)
 
-            x = list_of_results
             x.__getitem__(subproduct).plot(label=(lat1, lon1))
-
-            # latlon2
-            list_of_results = Data.get_data_from_datacube(
-                product, subproduct, start, end, lat2, lon2,)
-
-            y = list_of_results
             y.__getitem__(subproduct).plot(label=(lat2, lon2))
 
             list_x = x.__getitem__(subproduct).values
@@ -1290,39 +1371,56 @@ Lat/Lon:    {north}/{east}
             fig.tight_layout()
             plt.show()
 
-    def calculate_timesteps(self, years, period=16):
+    def zonal_statistics(self, product, subproduct, zones, start_date,
+                         end_date, stat='mean', name_field=None):
         """
-        For Modis products, There is always a time step on 1st Jan each year
-        Returns a list of all possible product dates in the years requested
-        prepended with the last date in the previous year and the first date in
-        the following year to allow for looking for nearest dates at the start or
-        end of a year.
-
-        :param years:             A list of years
-        :param period [optional]: period of product in days
-        
-        :return dates:            A list of dates
+        Plot a statistic of the sub-product within each zone of a shapefile
+        or GeoJSON file over time.
+
+        :param product:     the name of the datacube product
+        :param subproduct:  the name of the datacube sub-product
+        :param zones:       path to the shapefile or GeoJSON of the zones
+        :param start_date:  the start date of the analysis
+        :param end_date:    the end date of the analysis
+        :param stat:        'mean', 'sum', 'count', 'min', 'max' or a
+                            percentile such as 'p90'
+        :param name_field:  the property naming each zone, optional
+
+        :return: pandas DataFrame of the statistic, a column per zone
         """
+        with self.out:
+            clear_output()
+            print("Getting data...")
 
-        n = 366//period
-        # get last date in preceeding year
-        dates = [datetime.date(years[0]-1, 1, 1) + datetime.timedelta(days=n*period)]
-        if dates[0].year == years[0]:  # day 366 but not a leap year
-            dates = [datetime.date(years[0]-1, 1, 1) + datetime.timedelta(days=(n-1)*period)]
-        for year in years:
-            start = datetime.date(year, 1, 1)
-            dates = dates + [start + datetime.timedelta(days=i*period) for i in range(n)]
-            if dates[-1].year != year:
-                # if last date was day 366 but this was not a leap year, remove date
-                dates = dates[:-1]
-        dates = dates + [datetime.date(years[-1]+1, 1, 1)]
-
-        return dates
+            self.check_date(product, subproduct, start_date)
+            self.check_date(product, subproduct, end_date)
+
+            if stat.startswith('p'):
+                stats, percentiles = (), [float(stat[1:])]
+            else:
+                stats, percentiles = (stat,), None
+
+            ds = Dataset(product=product,
+                         subproduct=subproduct,
+                         identfile=self.keyfile)
+            result = ds.get_zonal_stats(zones, start_date, end_date,
+                                        stats=stats,
+                                        percentiles=percentiles,
+                                        name_field=name_field)
+
+            table = result[subproduct].isel(stat=0).to_pandas().T
+            table.plot(figsize=(10, 6))
+            plt.ylabel('%s %s' % (stat, subproduct))
+            plt.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
+            plt.show()
+
+            return table
 
     def get_dates(self, dataset, start, end):
         
-        first_date = dataset.first_timestep
-        last_date = dataset.last_timestep
+        index = self.availability(dataset.product, dataset.subproduct)
+        first_date = index.first
+        last_date = index.last
         if end < start:
             print('End date before start date.')
             raise ValueError('End date before start date.')
@@ -1333,55 +1431,53 @@ Lat/Lon:    {north}/{east}
             print(f'Last available date {last_date}')
             raise ValueError('Requested dates outside of available dates.')
 
-        # check start date
-        if start <= first_date:
-            first = first_date
-        else:
-            timesteps = self.calculate_timesteps([start.year])
-            first = self.closest_later_date(timesteps, start)
-        # check end date
-        if end >= last_date:
-            last = last_date
-        else:
-            timesteps = self.calculate_timesteps([end.year])
-            last = self.closest_earlier_date(timesteps, end)
+        # nearest available dates inside the period
+        first = index.later(start)
+        last = index.earlier(end)
         return first, last
 
-    def closest_earlier_date(self, date_list, date):
+    def availability(self, product, subproduct, latlon=None):
+        """
+        The time steps available for a sub-product. The index is shared, so
+        checking several dates costs one metadata request.
 
-        earlier = filter(lambda d: d <= date, date_list)
-        try:
-            closest = min(earlier, key=lambda d: abs(d - date))
-        except ValueError:
-            closest = None
-        return closest
+        :param product:    the name of the requested product
+        :param subproduct: the name of the requested sub-product
+        :param latlon:     optional; [latitude, longitude] of a location
+                           with data, to read the actual time steps rather
+                           than those expected from the metadata
 
-    def closest_later_date(self, date_list, date):
+        :return:           AvailabilityIndex
+        """
+        if self._conn is None:
+            self._conn = connect.Connect(identfile=self.keyfile)
 
-        earlier = filter(lambda d: d >= date, date_list)
-        try:
-            closest = min(earlier, key=lambda d: abs(d - date))
-        except ValueError:
-            closest = None
-        return closest
+        return AvailabilityIndex.for_subproduct(self._conn, product,
+                                                subproduct, latlon=latlon)
 
-    def check_date(self, product, subproduct, date):
+    def check_date(self, product, subproduct, date, latlon=None):
         """
         Check whether the requested sub-product date is available. If so, return
-        True, if not, return False and display the closest earlier and later datetimes.
+        True, if not, display the closest earlier and later datetimes and
+        raise ValueError.
+
+        Dates are always checked against the first and last time steps, but
+        only checked against the time steps themselves where those are known:
+        when read at latlon, or for products in
+        availability.YEARLY_COMPOSITES.
         
         :param product:    the name of the requested product
         :param subproduct: the name of the requested sub-product
+        :param date:       the date to check
+        :param latlon:     optional; see availability()
         
-        :return available: True/False if the requested date is available or not.
+        :return available: True if the requested date is available.
         """
 
-        ds = Dataset(product=product,
-                     subproduct=subproduct,
-                     identfile=self.keyfile)
+        index = self.availability(product, subproduct, latlon=latlon)
 
-        first_date = ds.first_timestep
-        last_date = ds.last_timestep
+        first_date = index.first
+        last_date = index.last
         available = True
         
         if not isinstance(date, datetime.date):
@@ -1391,39 +1487,15 @@ Lat/Lon:    {north}/{east}
             print(f'{date} not available. First available date {first_date}')
             available = False
 
-        if np.datetime64(date) > last_date:
+        elif np.datetime64(date) > last_date:
             print(f'{date} not available. Last available date {last_date}')
             available = False
-  
-        if product == 'MOD13A2':
-            year = date.year
-            timesteps = self.calculate_timesteps([year], period=16)
-            available = date in timesteps
-            if not available:
-                print(type(date), type(timesteps[0]))
-                date1 = self.closest_earlier_date(timesteps, date)
-                date2 = self.closest_later_date(timesteps, date)
-                print(f'{date} not available. Nearest available dates: {date1} and {date2}')
-        
-#         # If date not available (wrong frequency), try to find a date before and after.
-#         if ds.get_data(start=date, stop=date) is None:
-#             for i in range(400):
-#                 if ds.get_data(start=date+datetime.timedelta(hours=i),
-#                                stop=date+datetime.timedelta(hours=i)) is None:
-#                     continue
-#                 else:
-#                     date1 = date+datetime.timedelta(hours=i)
-#                     break
-#             for i in range(400):
-#                 if ds.get_data(start=date-datetime.timedelta(hours=i),
-#                                stop=date-datetime.timedelta(hours=i)) is None:
-#                     continue
-#                 else:
-#                     date2 = date+datetime.timedelta(hours=i)
-#                     break
-            
-#             print(f'{date} not available. Nearest available dates {date1} and {date2}')
-#             available = False
+
+        elif index.complete and date not in index:
+            available = False
+            date1 = index.earlier(date)
+            date2 = index.later(date)
+            print(f'{date} not available. Nearest available dates: {date1} and {date2}')
         
         if not available:
             raise ValueError(f'{date} not available.')
@@ -1456,8 +1528,8 @@ Lat/Lon:    {north}/{east}
         Convert a given set of coordinates between 3 coordinate systems: WGS84,
         British National Grid and Sinusoidal.
 
-        :param x:     the x-coordinate in the respective base
-        :param y:     the y-coordinate in the respective base
+        :param x:     the x-coordinate in the respective base, or an array
+        :param y:     the y-coordinate in the respective base, or an array
 
         :param: conv: the conversion required: ['bng_to_latlon'
                                                 'latlon_to_bng',
@@ -1469,64 +1541,9 @@ Lat/Lon:    {north}/{east}
         :return x, y:  reprojected x, y coordinates in the required base
         """
 
-        # Sinusoidal definition
-        # from https://spatialreference.org/ref/sr-org/6842/
-        # It fully match with the metadata in the MODIS products
-        sinusoidal_srs = (f'+proj=sinu +lon_0=0 +x_0=0 +y_0=0 +a=6371007.181 '
-                          f'+b=6371007.181 +units=m +no_defs ')
-
-        # British National Grid (BNG) definition
-        # from https://spatialreference.org/ref/epsg/osgb-1936-british-national-grid/
-        # User should pass those parameters?
-        bng_srs = (f' +proj=tmerc +lat_0=49 +lon_0=-2 +k=0.9996012717 '
-                   f' +x_0=400000 +y_0=-100000 +ellps=airy +datum=OSGB36 '
-                   f' +units=m +no_defs ')
-
-        # Sinu spatial reference system
-        sinu = osr.SpatialReference()
-        sinu.ImportFromProj4(sinusoidal_srs)
-
-        # BNG spatial reference system
-        bng = osr.SpatialReference()
-        bng.ImportFromProj4(bng_srs)
-
-        # lat/lon spatial reference system
-        latlon = osr.SpatialReference()
-        latlon.ImportFromEPSG(4326)
-        
-        if conv is None:
-            return x, y
-
-        elif conv == 'bng_to_latlon':
-            transform = osr.CoordinateTransformation(bng, latlon)
-            x, y, z = transform.TransformPoint(x, y)
-            return round(x, 6), round(y, 6)
-
-        elif conv == 'latlon_to_bng':
-            transform = osr.CoordinateTransformation(latlon, bng)
-            x, y, z = transform.TransformPoint(x, y)
-            return round(x, 6), round(y, 6)
-
-        elif conv == 'bng_to_sinu':
-            transform = osr.CoordinateTransformation(bng, sinu)
-            x, y, z = transform.TransformPoint(x, y)
-            return round(x, 6), round(y, 6)
-
-        elif conv == 'sinu_to_bng':
-            transform = osr.CoordinateTransformation(sinu, bng)
-            x, y, z = transform.TransformPoint(x, y)
-            return x, y
-
-        elif conv == 'latlon_to_sinu':
-            transform = osr.CoordinateTransformation(latlon, sinu)
-            x, y, z = transform.TransformPoint(x, y)
-            return round(x, 6), round(y, 6)
-
-        elif conv == 'sinu_to_latlon':
-            transform = osr.CoordinateTransformation(sinu, latlon)
-            x, y, z = transform.TransformPoint(x, y)
-            return round(x, 6), round(y, 6)
-        
+        # Transformations are cached, and arrays of coordinates are
+        # converted in one call
+        return reproject.transform(x, y, conv)
 
     def check_coords(self, north, east, south, west, projection):
         """
@@ -1547,15 +1564,15 @@ Lat/Lon:    {north}/{east}
             return north, east, south, west
 
         if projection == 'National Grid':
-            x1, y1 = self.coord_transform(x=east, y=north, conv='latlon_to_bng')
-            x2, y2 = self.coord_transform(x=west, y=south, conv='latlon_to_bng')
-            north, east, south, west = y1, x1, y2, x2
+            x, y = self.coord_transform(x=[east, west], y=[north, south],
+                                        conv='latlon_to_bng')
+            north, east, south, west = y[0], x[0], y[1], x[1]
             return north, east, south, west
 
         if projection == 'Sinusoidal':
-            x1, y1 = self.coord_transform(x=east, y=north, conv='latlon_to_sinu')
-            x2, y2 = self.coord_transform(x=west, y=south, conv='latlon_to_sinu')
-            north, east, south, west = y1, x1, y2, x2
+            x, y = self.coord_transform(x=[east, west], y=[north, south],
+                                        conv='latlon_to_sinu')
+            north, east, south, west = y[0], x[0], y[1], x[1]
             return north, east, south, west
         
     @staticmethod
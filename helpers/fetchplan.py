@@ -0,0 +1,81 @@
+"""
+Independent DataCube fetches run at the same time.
+
+Analyses which compare two periods, products or dates need several cubes
+which do not depend on each other. A FetchPlan is given them all up front
+and then fetches them together on a thread pool, so the wait is about that
+of the slowest fetch rather than the sum of them all. Results are looked
+up by the key each fetch was added with.
+
+The fetches share the thread-safe connection pool of the DQ client. They
+must not write to notebook output widgets, which are not thread-safe:
+they add anything to tell the user to the plan's messages list instead
+(e.g. Dataset(messages=plan.messages)), and run() prints the messages
+from the calling thread once all the fetches have finished.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from DQTools.DQTools.connect.planner import DEFAULT_WORKERS
+
+
+class FetchPlan(object):
+    """
+    A set of independent fetches, run together.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS):
+        """
+        :param max_workers: optional; most fetches run at the same time
+        """
+        self.max_workers = max_workers
+        self.messages = []
+        self._fetches = []
+
+    def __len__(self):
+        return len(self._fetches)
+
+    def add(self, key, function, *args, **kwargs):
+        """
+        Add a fetch to the plan.
+
+        :param key: name for the result, e.g. 'period1' or (date, product)
+        :param function: called with the remaining arguments to fetch the
+                         data
+        :return: key
+        """
+        self._fetches.append((key, function, args, kwargs))
+        return key
+
+    def run(self):
+        """
+        Run all the fetches.
+
+        If any fetch fails, those not yet started are cancelled and the
+        error of the first to be added is raised. Either way, the messages
+        added by the fetches are printed first.
+
+        :return: dict of each key to its fetch's result
+        """
+        try:
+            return self._run()
+        finally:
+            messages, self.messages[:] = list(self.messages), []
+            for message in messages:
+                print(message)
+
+    def _run(self):
+        if len(self._fetches) < 2 or self.max_workers < 2:
+            return dict((key, function(*args, **kwargs))
+                        for key, function, args, kwargs in self._fetches)
+
+        workers = min(self.max_workers, len(self._fetches))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [(key, pool.submit(function, *args, **kwargs))
+                       for key, function, args, kwargs in self._fetches]
+            try:
+                return dict((key, future.result())
+                            for key, future in futures)
+            except Exception:
+                for _, future in futures:
+                    future.cancel()
+                raise
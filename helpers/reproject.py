@@ -0,0 +1,134 @@
+"""
+Coordinate reprojection between WGS84, British National Grid and
+Sinusoidal.
+
+Spatial references and transformations are built once per pair of
+coordinate systems and kept, and whole arrays of coordinates are
+transformed in a single call rather than point by point. OSR objects are
+not thread-safe, so each thread builds and keeps its own.
+"""
+import threading
+
+import numpy as np
+import osr
+
+# Sinusoidal definition
+# from https://spatialreference.org/ref/sr-org/6842/
+# It fully match with the metadata in the MODIS products
+SINUSOIDAL_SRS = ('+proj=sinu +lon_0=0 +x_0=0 +y_0=0 +a=6371007.181 '
+                  '+b=6371007.181 +units=m +no_defs ')
+
+# British National Grid (BNG) definition
+# from https://spatialreference.org/ref/epsg/osgb-1936-british-national-grid/
+BNG_SRS = (' +proj=tmerc +lat_0=49 +lon_0=-2 +k=0.9996012717 '
+           ' +x_0=400000 +y_0=-100000 +ellps=airy +datum=OSGB36 '
+           ' +units=m +no_defs ')
+
+# Conversion names, as (source, target) coordinate systems
+CONVERSIONS = {'bng_to_latlon': ('bng', 'latlon'),
+               'latlon_to_bng': ('latlon', 'bng'),
+               'bng_to_sinu': ('bng', 'sinu'),
+               'sinu_to_bng': ('sinu', 'bng'),
+               'latlon_to_sinu': ('latlon', 'sinu'),
+               'sinu_to_latlon': ('sinu', 'latlon')}
+
+# Decimal places results are rounded to (sinu_to_bng has never been
+# rounded)
+DECIMALS = 6
+UNROUNDED = ('sinu_to_bng',)
+
+# Spatial references and transformations of the current thread
+_local = threading.local()
+
+
+def _cached(name):
+    """
+    The current thread's dictionary of cached objects of a kind.
+    """
+    cache = getattr(_local, name, None)
+    if cache is None:
+        cache = {}
+        setattr(_local, name, cache)
+    return cache
+
+
+def _reference(name):
+    """
+    The spatial reference system for 'latlon', 'bng' or 'sinu'.
+    """
+    references = _cached('references')
+    srs = references.get(name)
+    if srs is None:
+        srs = osr.SpatialReference()
+        if name == 'latlon':
+            srs.ImportFromEPSG(4326)
+        elif name == 'bng':
+            srs.ImportFromProj4(BNG_SRS)
+        else:
+            srs.ImportFromProj4(SINUSOIDAL_SRS)
+
+        # GDAL 3 would otherwise expect WGS84 coordinates as lat, lon
+        if hasattr(srs, 'SetAxisMappingStrategy'):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        references[name] = srs
+    return srs
+
+
+def get_transform(conv):
+    """
+    The coordinate transformation for a conversion, created on first use
+    in each thread. It must not be passed to other threads.
+
+    :param conv: a name from CONVERSIONS
+    :return: osr.CoordinateTransformation
+    """
+    try:
+        source, target = CONVERSIONS[conv]
+    except KeyError:
+        raise ValueError("Unknown conversion %s, choose from %s"
+                         % (conv, sorted(CONVERSIONS)))
+
+    transforms = _cached('transforms')
+    transform = transforms.get(conv)
+    if transform is None:
+        transform = osr.CoordinateTransformation(_reference(source),
+                                                 _reference(target))
+        transforms[conv] = transform
+    return transform
+
+
+def transform(x, y, conv):
+    """
+    Convert coordinates between WGS84 (x longitude, y latitude), British
+    National Grid and Sinusoidal.
+
+    :param x: x-coordinate, or array of them
+    :param y: y-coordinate, or array of them (broadcast against x)
+    :param conv: the conversion required, a name from CONVERSIONS, or None
+                 for no conversion
+    :return x, y: the reprojected coordinates, as arrays of the broadcast
+                  shape, or floats if x and y were single values
+    """
+    if conv is None:
+        return x, y
+
+    scalar = np.ndim(x) == 0 and np.ndim(y) == 0
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                               np.asarray(y, dtype=float))
+
+    points = np.column_stack([x.ravel(), y.ravel()])
+    if len(points):
+        result = np.array(get_transform(conv).TransformPoints(points.tolist()),
+                          dtype=float)
+    else:
+        result = np.empty((0, 3))
+    new_x = result[:, 0].reshape(x.shape)
+    new_y = result[:, 1].reshape(y.shape)
+
+    if conv not in UNROUNDED:
+        new_x = np.round(new_x, DECIMALS)
+        new_y = np.round(new_y, DECIMALS)
+
+    if scalar:
+        return float(new_x), float(new_y)
+    return new_x, new_y
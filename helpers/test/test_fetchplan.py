@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from helpers.fetchplan import FetchPlan
+
+
+class Fetches(object):
+    """
+    Fetches which take a while, recording the threads they ran in and
+    the most running at once.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most = 0
+        self.threads = set()
+
+    def __call__(self, value, delay=0.05, error=None, messages=None):
+        with self.lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+            self.threads.add(threading.current_thread())
+        time.sleep(delay)
+        with self.lock:
+            self.running -= 1
+        if messages is not None:
+            messages.append("fetched %s" % value)
+        if error is not None:
+            raise error
+        return value * 2
+
+
+def test_results_by_key():
+    fetch = Fetches()
+    plan = FetchPlan()
+    # The first added finishes last
+    for i, delay in enumerate([0.2, 0.1, 0.0]):
+        plan.add(('date', i), fetch, i, delay=delay)
+    assert len(plan) == 3
+
+    results = plan.run()
+    assert results == {('date', 0): 0, ('date', 1): 2, ('date', 2): 4}
+    assert list(results) == [('date', 0), ('date', 1), ('date', 2)]
+    assert fetch.most == 3
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_max_workers(max_workers):
+    fetch = Fetches()
+    plan = FetchPlan(max_workers=max_workers)
+    for i in range(6):
+        plan.add(i, fetch, i)
+    assert plan.run() == dict((i, i * 2) for i in range(6))
+    assert fetch.most == max_workers
+    if max_workers == 1:
+        assert fetch.threads == {threading.current_thread()}
+
+
+def test_first_error_raised():
+    fetch = Fetches()
+    plan = FetchPlan()
+    plan.add(1, fetch, 1, delay=0.1, error=KeyError('first'))
+    plan.add(2, fetch, 2, error=ValueError('second'))
+    plan.add(3, fetch, 3)
+    with pytest.raises(KeyError):
+        plan.run()
+
+
+def test_messages_printed_by_caller(capsys):
+    fetch = Fetches()
+    plan = FetchPlan()
+    plan.add(1, fetch, 1, messages=plan.messages)
+    plan.add(2, fetch, 2, error=IOError('down'), messages=plan.messages)
+    with pytest.raises(IOError):
+        plan.run()
+
+    assert sorted(capsys.readouterr().out.splitlines()) == \
+        ['fetched 1', 'fetched 2']
+    assert plan.messages == []
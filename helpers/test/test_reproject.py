@@ -0,0 +1,60 @@
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osr')
+
+from helpers import reproject
+
+# Trafalgar Square, as (longitude, latitude) and British National Grid
+LONDON = (-0.128, 51.508)
+LONDON_BNG = (530000., 180500.)
+
+
+def test_latlon_order():
+    # Longitude is x and latitude y, whichever GDAL version is used
+    x, y = reproject.transform(LONDON[0], LONDON[1], 'latlon_to_bng')
+    assert isinstance(x, float)
+    assert x == pytest.approx(LONDON_BNG[0], abs=500)
+    assert y == pytest.approx(LONDON_BNG[1], abs=500)
+
+    lon, lat = reproject.transform(x, y, 'bng_to_latlon')
+    assert lon == pytest.approx(LONDON[0], abs=1e-5)
+    assert lat == pytest.approx(LONDON[1], abs=1e-5)
+
+
+def test_arrays():
+    lon = np.array([[-3., -2.], [-1., 0.]])
+    lat = np.array([[50., 51.], [52., 53.]])
+    x, y = reproject.transform(lon, lat, 'latlon_to_sinu')
+    assert x.shape == y.shape == (2, 2)
+    for i in range(2):
+        for j in range(2):
+            assert (x[i, j], y[i, j]) == reproject.transform(
+                lon[i, j], lat[i, j], 'latlon_to_sinu')
+    assert reproject.transform(1., 2., None) == (1., 2.)
+    with pytest.raises(ValueError):
+        reproject.get_transform('latlon_to_utm')
+
+
+def test_transform_per_thread():
+    lon, lat = np.meshgrid(np.linspace(-5, 1, 200), np.linspace(50, 58, 200))
+    expected = reproject.transform(lon, lat, 'latlon_to_bng')
+    transforms, results = [], []
+
+    def convert():
+        transforms.append(reproject.get_transform('latlon_to_bng'))
+        results.append(reproject.transform(lon, lat, 'latlon_to_bng'))
+
+    threads = [threading.Thread(target=convert) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(id(transform) for transform in transforms)) == 4
+    assert reproject.get_transform('latlon_to_bng') not in transforms
+    for x, y in results:
+        np.testing.assert_array_equal(x, expected[0])
+        np.testing.assert_array_equal(y, expected[1])